@@ -1,195 +1,265 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, stream_with_context, g
 import sqlite3
 import os
+import threading
+import time
+from contextlib import nullcontext
 from natural_language_to_sql import NaturalLanguageToSQL
+from db_pool import ConnectionPool
+from translation_cache import TranslationCache
+from result_cache import ResultCache, is_read_only
+from result_stream import parse_page, paginate_sql, ndjson_stream, encode_cursor
+from schema_catalog import SchemaCatalog
+from join_planner import JoinPlanner
+from value_index import ValueIndex
+from metrics import registry as metrics, SlowRequestProfiler, statement_kind
+from index_advisor import IndexAdvisor
+from rollups import RollupManager
+from query_governor import QueryGovernor, QueryBudget
+from result_format import (MEDIA_TYPES, negotiate_format, collect_columns, encode_columnar_json,
+                           encode_msgpack, encode_arrow)
+from sessions import SessionStore, statement_subjects, narrow_sql, refine_rows
 
 app = Flask(__name__)
 
-# Define your database schema
+# Fallback schema used until the catalog of DB_PATH has been introspected
 DB_SCHEMA = {
     'customers': ['id', 'name', 'email', 'signup_date', 'country'],
     'orders': ['id', 'customer_id', 'order_date', 'total_amount', 'status'],
     'products': ['id', 'name', 'category', 'price', 'stock']
 }
 
+# Translations are cached in memory; set TRANSLATION_CACHE_PATH to share
+# them between worker processes through a sqlite file
+translation_cache = TranslationCache(
+    max_size=int(os.environ.get('TRANSLATION_CACHE_SIZE', 2048)),
+    ttl=float(os.environ.get('TRANSLATION_CACHE_TTL', 3600)),
+    shared_path=os.environ.get('TRANSLATION_CACHE_PATH'))
+
 # Initialize the NL to SQL converter
-nl_to_sql = NaturalLanguageToSQL(db_schema=DB_SCHEMA)
-
-# Ensure the templates directory exists
-os.makedirs('templates', exist_ok=True)
-
-# Create the HTML template
-with open('templates/index.html', 'w') as f:
-    f.write('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>SQL Assistant</title>
-    <link href="https://cdnjs.cloudflare.com/ajax/libs/tailwindcss/2.2.19/tailwind.min.css" rel="stylesheet">
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/jquery/3.6.0/jquery.min.js"></script>
-</head>
-<body class="bg-gray-100 min-h-screen">
-    <div class="container mx-auto px-4 py-8">
-        <div class="max-w-4xl mx-auto">
-            <h1 class="text-3xl font-bold text-center mb-8">SQL Assistant</h1>
-            <p class="text-center text-gray-600 mb-8">Ask questions about your data in plain English</p>
-            
-            <div class="bg-white rounded-lg shadow-md p-6 mb-8">
-                <div class="mb-4">
-                    <label for="queryInput" class="block text-sm font-medium text-gray-700 mb-2">Your Question:</label>
-                    <div class="flex">
-                        <input type="text" id="queryInput" 
-                               class="flex-grow px-4 py-2 border border-gray-300 rounded-l-md focus:outline-none focus:ring-2 focus:ring-blue-500" 
-                               placeholder="e.g., Show me all customers from the USA who spent more than $1000">
-                        <button id="submitBtn" 
-                                class="bg-blue-600 hover:bg-blue-700 text-white font-medium py-2 px-6 rounded-r-md transition duration-200">
-                            Ask
-                        </button>
-                    </div>
-                </div>
-                
-                <div id="examples" class="text-sm text-gray-500 mb-6">
-                    <p class="mb-1">Example questions:</p>
-                    <ul class="list-disc pl-5">
-                        <li class="example-query cursor-pointer hover:text-blue-600">Show all customers from Canada</li>
-                        <li class="example-query cursor-pointer hover:text-blue-600">Find orders with total amount greater than 500</li>
-                        <li class="example-query cursor-pointer hover:text-blue-600">List all products in the Electronics category with stock less than 10</li>
-                    </ul>
-                </div>
-            </div>
-            
-            <div id="results" class="hidden bg-white rounded-lg shadow-md p-6">
-                <div class="mb-6">
-                    <h3 class="text-lg font-semibold text-gray-800 mb-2">Generated SQL Query:</h3>
-                    <div id="sqlQuery" class="bg-gray-100 p-4 rounded-md font-mono text-sm overflow-x-auto"></div>
-                </div>
-                
-                <div>
-                    <h3 class="text-lg font-semibold text-gray-800 mb-2">Results:</h3>
-                    <div id="resultTable" class="overflow-x-auto">
-                        <!-- Results will be inserted here -->
-                    </div>
-                    <p id="noResults" class="hidden text-gray-500 italic py-4">No results found.</p>
-                    <p id="errorMessage" class="hidden text-red-500 py-4"></p>
-                </div>
-            </div>
-        </div>
-    </div>
-    
-    <script>
-        $(document).ready(function() {
-            // Example queries
-            $('.example-query').click(function() {
-                $('#queryInput').val($(this).text());
-                $('#submitBtn').click();
-            });
-            
-            // Submit query
-            $('#submitBtn').click(function() {
-                const query = $('#queryInput').val().trim();
-                if (!query) return;
-                
-                // Show loading state
-                $('#submitBtn').text('Processing...').attr('disabled', true);
-                
-                // Send query to backend
-                $.ajax({
-                    url: '/query',
-                    type: 'POST',
-                    contentType: 'application/json',
-                    data: JSON.stringify({ query: query }),
-                    success: function(response) {
-                        // Display results
-                        $('#results').removeClass('hidden');
-                        $('#sqlQuery').text(response.sql_query);
-                        
-                        // Reset button
-                        $('#submitBtn').text('Ask').attr('disabled', false);
-                        
-                        // Handle error
-                        if (response.error) {
-                            $('#resultTable').empty();
-                            $('#noResults').addClass('hidden');
-                            $('#errorMessage').text(response.error).removeClass('hidden');
-                            return;
-                        }
-                        
-                        // Hide error message if previously shown
-                        $('#errorMessage').addClass('hidden');
-                        
-                        // Check if we have results
-                        if (response.results && response.results.length > 0) {
-                            $('#noResults').addClass('hidden');
-                            
-                            // Create table
-                            const table = $('<table class="min-w-full divide-y divide-gray-200"></table>');
-                            
-                            // Table header
-                            const thead = $('<thead class="bg-gray-50"></thead>');
-                            const headerRow = $('<tr></tr>');
-                            
-                            // Get column names from first result
-                            const columns = Object.keys(response.results[0]);
-                            columns.forEach(column => {
-                                headerRow.append(`<th scope="col" class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">${column}</th>`);
-                            });
-                            
-                            thead.append(headerRow);
-                            table.append(thead);
-                            
-                            // Table body
-                            const tbody = $('<tbody class="bg-white divide-y divide-gray-200"></tbody>');
-                            response.results.forEach(row => {
-                                const tr = $('<tr></tr>');
-                                columns.forEach(column => {
-                                    tr.append(`<td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${row[column]}</td>`);
-                                });
-                                tbody.append(tr);
-                            });
-                            
-                            table.append(tbody);
-                            $('#resultTable').empty().append(table);
-                        } else {
-                            $('#resultTable').empty();
-                            $('#noResults').removeClass('hidden');
-                        }
-                    },
-                    error: function(xhr, status, error) {
-                        $('#submitBtn').text('Ask').attr('disabled', false);
-                        $('#results').removeClass('hidden');
-                        $('#resultTable').empty();
-                        $('#noResults').addClass('hidden');
-                        $('#errorMessage').text('Server error: ' + error).removeClass('hidden');
-                    }
-                });
-            });
-            
-            // Allow pressing Enter to submit
-            $('#queryInput').keypress(function(e) {
-                if (e.which == 13) {
-                    $('#submitBtn').click();
-                }
-            });
-        });
-    </script>
-</body>
-</html>
-    ''')
+nl_to_sql = NaturalLanguageToSQL(db_schema=DB_SCHEMA, translation_cache=translation_cache)
+nl_to_sql.metrics = metrics
+
+# Database connection settings
+DB_PATH = os.environ.get('DB_PATH', 'demo.db')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5.0))
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 5.0))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 256))
+# DB_READ_ONLY=1 opens the database read-only (write questions then fail);
+# DB_MMAP_SIZE > 0 reads it through a memory map, so every process
+# serving it shares one copy of its pages in the OS page cache
+DB_READ_ONLY = os.environ.get('DB_READ_ONLY', '0') == '1'
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 0))
+# Catalog and value index refresh threads, started with the server (see
+# start_background_refresh) rather than on import; the prefork server
+# (prefork.py) turns them off and reloads its workers instead, as threads
+# do not survive fork()
+BACKGROUND_REFRESH = os.environ.get('BACKGROUND_REFRESH', '1') == '1'
 
 # Database connection
 def get_db_connection():
     # Create demo database if it doesn't exist
-    if not os.path.exists('demo.db'):
+    if not os.path.exists(DB_PATH) and not DB_READ_ONLY:
         create_demo_db()
-    conn = sqlite3.connect('demo.db')
+    # Pooled connections move between worker threads, and keep a large
+    # statement cache so repeated generated SQL is not re-prepared
+    if DB_READ_ONLY:
+        conn = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True, timeout=DB_BUSY_TIMEOUT,
+                               check_same_thread=False, cached_statements=DB_STATEMENT_CACHE_SIZE)
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE_SIZE)
+    if DB_MMAP_SIZE > 0:
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
     conn.row_factory = sqlite3.Row
     return conn
 
+# Connections are only opened (and demo.db only checked) when the pool grows
+db_pool = ConnectionPool(get_db_connection, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT)
+
+# Encoded results of read-only queries, invalidated per table on writes made
+# through the app and wholesale when demo.db is written from outside
+result_cache = ResultCache(DB_PATH, max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+# Conversation sessions (see sessions.py): follow-up questions refine the
+# previous answer of their session, from its remembered rows when possible.
+# Idle sessions expire after SESSION_IDLE_TIMEOUT seconds; remembered rows
+# share SESSION_MAX_BYTES and results over SESSION_MAX_ROWS are not kept
+conversation_sessions = SessionStore(
+    max_sessions=int(os.environ.get('SESSION_MAX_SESSIONS', 10000)),
+    idle_timeout=float(os.environ.get('SESSION_IDLE_TIMEOUT', 1800)),
+    max_bytes=int(os.environ.get('SESSION_MAX_BYTES', 64 * 1024 * 1024)),
+    max_rows=int(os.environ.get('SESSION_MAX_ROWS', 10000)))
+
+# The translator sees the real tables of DB_PATH: a persisted snapshot is
+# loaded right away and refreshed in the background for changed tables
+# once the server starts
+schema_catalog = SchemaCatalog(DB_PATH, snapshot_path=os.environ.get('SCHEMA_SNAPSHOT_PATH',
+                                                                     DB_PATH + '.schema.json'))
+
+# Multi-table questions are joined along foreign keys; when they run,
+# joins estimated above MAX_JOIN_ROWS are cut at that many rows
+# (JOIN_GUARD=limit) or refused with an error (JOIN_GUARD=refuse)
+nl_to_sql.join_planner = JoinPlanner(
+    catalog=schema_catalog, database=DB_PATH,
+    max_estimated_rows=int(os.environ.get('MAX_JOIN_ROWS', 1000000)),
+    guard=os.environ.get('JOIN_GUARD', 'limit'))
+
+if schema_catalog.load():
+    nl_to_sql.set_catalog(schema_catalog)
+
+# Distinct values of low-cardinality text columns ("Canada", "Pending"),
+# persisted next to the database and refreshed per changed table once the
+# server starts; tables over VALUE_INDEX_SAMPLE_ROWS rows are sampled
+value_index = ValueIndex(
+    schema_catalog,
+    snapshot_path=os.environ.get('VALUE_INDEX_PATH', DB_PATH + '.values.json'),
+    max_distinct=int(os.environ.get('VALUE_INDEX_MAX_DISTINCT', 100)),
+    max_bytes=int(os.environ.get('VALUE_INDEX_MAX_BYTES', 4 * 1024 * 1024)),
+    sample_rows=int(os.environ.get('VALUE_INDEX_SAMPLE_ROWS', 100000)))
+if value_index.load():
+    nl_to_sql.set_value_index(value_index)
+
+# Every generated statement runs under a budget: results are cut after
+# GOVERNOR_MAX_ROWS rows (GOVERNOR_STREAM_MAX_ROWS when streamed), statements
+# are interrupted after GOVERNOR_TIMEOUT seconds or GOVERNOR_MAX_STEPS sqlite
+# VM instructions, and plans estimated to examine more than
+# GOVERNOR_MAX_COST rows are refused. Requests may lower max_rows, timeout
+# and max_steps, never raise them.
+query_governor = QueryGovernor(
+    max_rows=int(os.environ.get('GOVERNOR_MAX_ROWS', 10000)),
+    timeout=float(os.environ.get('GOVERNOR_TIMEOUT', 10.0)),
+    max_steps=int(os.environ['GOVERNOR_MAX_STEPS']) if os.environ.get('GOVERNOR_MAX_STEPS') else None,
+    max_cost=int(float(os.environ.get('GOVERNOR_MAX_COST', 1e9))),
+    row_count=nl_to_sql.join_planner.row_count,
+    join_guard=nl_to_sql.join_planner.check_statement,
+    data_version=result_cache.version)
+stream_budget = QueryBudget(int(os.environ.get('GOVERNOR_STREAM_MAX_ROWS', 1000000)),
+                            query_governor.default_budget.timeout,
+                            query_governor.default_budget.max_steps,
+                            query_governor.default_budget.max_cost)
+nl_to_sql.governor = query_governor
+
+# Rows fetched per fetchmany call when streaming results, or building
+# columnar responses
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+
+# Batch translation limits; BATCH_PROCESSES > 1 spreads large batches
+# over a process pool
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 50000))
+BATCH_PROCESSES = int(os.environ.get('BATCH_PROCESSES', 1))
+
+# Executed statements feed the index advisor; INDEX_ADVISOR=recommend only
+# reports indexes (GET /indexes), =create also builds them; off by default
+INDEX_ADVISOR = os.environ.get('INDEX_ADVISOR', 'off')
+index_advisor = None
+if INDEX_ADVISOR != 'off':
+    index_advisor = IndexAdvisor(
+        DB_PATH, min_uses=int(os.environ.get('INDEX_ADVISOR_MIN_USES', 50)),
+        create=INDEX_ADVISOR == 'create',
+        max_indexes=int(os.environ.get('INDEX_ADVISOR_MAX_INDEXES', 10)),
+        max_index_bytes=int(os.environ.get('INDEX_ADVISOR_MAX_BYTES', 256 * 1024 * 1024)),
+        governor=query_governor)
+
+# Aggregates asked repeatedly can be answered from rollup tables kept up to
+# date by triggers: ROLLUPS=use reads existing ones, =create also builds
+# them for fact tables of ROLLUP_MIN_ROWS rows or more
+ROLLUPS = os.environ.get('ROLLUPS', 'off')
+rollup_manager = None
+if ROLLUPS != 'off':
+    rollup_manager = RollupManager(
+        DB_PATH, min_uses=int(os.environ.get('ROLLUP_MIN_USES', 3)),
+        create=ROLLUPS == 'create' and not DB_READ_ONLY,
+        max_rollups=int(os.environ.get('ROLLUP_MAX_ROLLUPS', 20)),
+        min_rows=int(os.environ.get('ROLLUP_MIN_ROWS', 10000)),
+        max_ratio=float(os.environ.get('ROLLUP_MAX_RATIO', 0.1)))
+
+# Pool and cache counters are exported next to the latency histograms
+metrics.add_gauges('pool', db_pool.stats)
+metrics.add_gauges('translation_cache', translation_cache.stats)
+metrics.add_gauges('result_cache', result_cache.stats)
+metrics.add_gauges('sessions', conversation_sessions.stats)
+metrics.add_gauges('value_index', value_index.stats)
+metrics.add_gauges('governor', query_governor.stats)
+if index_advisor is not None:
+    metrics.add_gauges('index_advisor', index_advisor.stats)
+if rollup_manager is not None:
+    metrics.add_gauges('rollups', rollup_manager.stats)
+
+# Opt-in: set PROFILE_SLOW_REQUESTS_MS to profile a PROFILE_SAMPLE_RATE
+# fraction of requests and dump those slower than the threshold
+# to PROFILE_DIR as cProfile .prof files
+slow_request_profiler = None
+if os.environ.get('PROFILE_SLOW_REQUESTS_MS'):
+    slow_request_profiler = SlowRequestProfiler(
+        float(os.environ['PROFILE_SLOW_REQUESTS_MS']) / 1000,
+        os.environ.get('PROFILE_DIR', 'profiles'),
+        sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01)))
+    metrics.add_gauges('slow_profiles', slow_request_profiler.stats)
+
+def warm_up():
+    """
+    Bring the catalog, value index and translator up to date synchronously
+
+    Used instead of the background refresh threads by servers that build
+    everything once and then fork their workers.
+
+    Returns:
+        bool: True if the schema or the indexed values changed
+    """
+    if not os.path.exists(DB_PATH) and not DB_READ_ONLY:
+        create_demo_db()
+    changed = schema_catalog.refresh()
+    if changed or nl_to_sql.catalog is None:
+        nl_to_sql.set_catalog(schema_catalog)
+    if value_index.refresh() or nl_to_sql.value_version != value_index.version:
+        nl_to_sql.set_value_index(value_index)
+        changed = True
+    return changed
+
+_background_refresh_lock = threading.Lock()
+_background_refresh_started = False
+
+def start_background_refresh():
+    """
+    Start the refresh threads once per process, if BACKGROUND_REFRESH is on
+
+    Called when the server starts (first request, __main__, ASGI lifespan)
+    so that importing this module never writes the snapshot files.
+
+    Returns:
+        bool: True if this call started them
+    """
+    global _background_refresh_started
+    if not BACKGROUND_REFRESH:
+        return False
+    with _background_refresh_lock:
+        if _background_refresh_started:
+            return False
+        _background_refresh_started = True
+    schema_catalog.refresh_in_background(
+        on_change=nl_to_sql.set_catalog,
+        interval=float(os.environ['SCHEMA_REFRESH_INTERVAL']) if os.environ.get('SCHEMA_REFRESH_INTERVAL') else None)
+    value_index.refresh_in_background(
+        on_change=nl_to_sql.set_value_index,
+        interval=float(os.environ['VALUE_INDEX_REFRESH_INTERVAL']) if os.environ.get('VALUE_INDEX_REFRESH_INTERVAL') else None)
+    return True
+
+def after_fork():
+    """Replace process-local resources inherited from the parent in a forked worker"""
+    translation_cache.after_fork()
+    db_pool.after_fork()
+    result_cache.after_fork()
+    nl_to_sql.join_planner.after_fork()
+    if index_advisor is not None:
+        index_advisor.after_fork()
+    if rollup_manager is not None:
+        rollup_manager.after_fork()
+
 def create_demo_db():
     """Create a demo database with sample data"""
-    conn = sqlite3.connect('demo.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     # Create tables
@@ -242,10 +312,72 @@ def create_demo_db():
     conn.commit()
     conn.close()
 
+@app.before_request
+def start_refresh_on_first_request():
+    # WSGI servers import the app and then serve it without a startup hook
+    if not _background_refresh_started:
+        start_background_refresh()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if slow_request_profiler is not None and request.endpoint != 'prometheus_metrics':
+        g.profile = slow_request_profiler.start()
+
+@app.after_request
+def record_request_latency(response):
+    if request.endpoint != 'prometheus_metrics' and 'request_start' in g:
+        metrics.observe('request', time.perf_counter() - g.request_start,
+                        g.get('query_type', request.endpoint or 'unknown'))
+    if g.get('profile') is not None:
+        # Written profiles are counted in the slow_profiles gauges
+        slow_request_profiler.stop(g.pop('profile'), request.path)
+    return response
+
 @app.route('/')
 def home():
     return render_template('index.html')
 
+def truncation_json(query):
+    """Encoded truncated / truncated_reason members for a GovernedQuery"""
+    if not query.truncated:
+        return b',"truncated":false'
+    return b',"truncated":true,"truncated_reason":' + app.json.dumps(query.reason).encode('utf-8')
+
+def results_response(fields, results_json):
+    """
+    Build a JSON response around an already-encoded results array
+
+    results_json may be followed by further encoded members, such as the
+    pagination cursor (``[...],"next":"..."``).
+    """
+    head = app.json.dumps(fields, separators=(',', ':')).encode('utf-8')
+    body = head[:-1] + b',"results":' + results_json + b'}'
+    return app.response_class(body, mimetype='application/json')
+
+def binary_response(fmt, fields, query, values, limit, next_cursor):
+    """Encode a columnar result as msgpack or Arrow, with the response fields"""
+    document = dict(fields)
+    if limit is not None:
+        document['next'] = next_cursor
+    document['truncated'] = query.truncated
+    if query.truncated:
+        document['truncated_reason'] = query.reason
+    encode = encode_msgpack if fmt == 'msgpack' else encode_arrow
+    return app.response_class(encode(document, query.columns, values), mimetype=MEDIA_TYPES[fmt])
+
+def remember_turn(session, natural_query, statement, params, refinement, refined=None):
+    """Record an answered question as the context of the session's follow-ups"""
+    if refinement is not None:
+        # A refinement keeps the tables and selected columns
+        tables, columns = session.tables, session.columns
+    elif statement is not None:
+        tables, columns = statement_subjects(statement)
+    else:
+        tables, columns = [], []
+    conversation_sessions.remember(session, natural_query, statement if tables else None, params,
+                                   tables, columns, nl_to_sql.schema_version, refined)
+
 @app.route('/query', methods=['POST'])
 def process_query():
     data = request.json
@@ -254,31 +386,307 @@ def process_query():
     if not natural_query:
         return jsonify({'error': 'No query provided'})
     
-    # Convert natural language to SQL
-    sql_query = nl_to_sql.generate_sql(natural_query)
+    # "session": true starts a conversation and its id continues it; an
+    # unknown or expired id starts a new one
+    session, refinement = None, None
+    if data.get('session'):
+        if isinstance(data['session'], str):
+            session = conversation_sessions.get(data['session'])
+        if session is None:
+            session = conversation_sessions.create()
+        elif session.statement is not None and session.schema_version == nl_to_sql.schema_version:
+            if natural_query == session.natural_query:
+                # Asked again, e.g. for its next page: answered the same way
+                refinement = {'filters': [], 'order': None, 'limit': None}
+            else:
+                refinement = nl_to_sql.parse_refinement(natural_query, session.tables, session.columns)
+    
+    if refinement is not None:
+        # A follow-up narrows the previous statement
+        statement, params = narrow_sql(session.statement, session.params, refinement,
+                                       qualify=len(session.tables) > 1)
+        sql_query = statement.sql()
+    else:
+        # Convert natural language to SQL; values from the question come back
+        # as parameters, so all questions of one shape share a prepared statement
+        sql_query, params, statement = nl_to_sql.generate_statement(natural_query)
+    query_type = g.query_type = statement_kind(sql_query)
+    fields = {'natural_query': natural_query, 'sql_query': sql_query, 'params': list(params)}
+    if session is not None:
+        fields['session'] = session.id
+        if refinement is not None and any(refinement.values()):
+            fields['refined'] = 'sql'
+    
+    # Cursor-based pagination (limit / after) applies to read-only queries;
+    # the request may tighten the execution budget
+    try:
+        limit, offset = parse_page(data)
+        budget = query_governor.budget(data, base=stream_budget if data.get('stream') else None)
+        # Row objects (default), columnar JSON, msgpack or Arrow
+        fmt = negotiate_format(data.get('format'), request.headers.get('Accept'))
+        if data.get('stream') and fmt not in ('json', 'columnar'):
+            raise ValueError('Streamed results are NDJSON; format must be json or columnar')
+    except ValueError as e:
+        return jsonify(dict(fields, error=str(e)))
+    if fmt != 'json':
+        fields['format'] = fmt
+    # Results computed under a tighter budget than the default are not shared
+    cacheable = budget is query_governor.default_budget
+    if limit is not None and not is_read_only(sql_query):
+        limit, offset = None, 0
+    # An aggregate with a rollup reads it instead of its fact table; results
+    # stay cached under the generated statement, whose tables invalidate them
+    rollup_sql = rollup_manager.rewrite(sql_query) if rollup_manager is not None else None
+    if rollup_sql is not None:
+        fields['rollup_sql'] = rollup_sql
+    if limit is not None:
+        if budget.max_rows is not None:
+            limit = min(limit, budget.max_rows)
+        page_sql, page_params = paginate_sql(sql_query, limit, offset, params)
+        run_sql = paginate_sql(rollup_sql, limit, offset, params)[0] if rollup_sql is not None else page_sql
+        # The page (and its look-ahead row) is bounded already
+        budget = budget.tightened(max_rows=limit + 1)
+    else:
+        page_sql, page_params = sql_query, params
+        run_sql = rollup_sql or page_sql
+    
+    # A follow-up on a remembered result is answered without sqlite, unless
+    # the database changed since it was read
+    remembered = conversation_sessions.remembered(session) if refinement is not None else None
+    if (remembered is not None and cacheable and limit is None and not data.get('stream')
+            and fmt in ('json', 'columnar') and remembered[2] == result_cache.version()):
+        result_columns, rows, version = remembered
+        rows = refine_rows(result_columns, rows, refinement)
+        if rows is not None:
+            if fmt == 'json':
+                results_json = app.json.dumps([dict(zip(result_columns, row)) for row in rows],
+                                              separators=(',', ':')).encode('utf-8')
+            else:
+                values, _ = collect_columns([rows], len(result_columns))
+                results_json = encode_columnar_json(result_columns, values, app.json.dumps)
+            fields['refined'] = 'memory'
+            remember_turn(session, natural_query, statement, params, refinement, 'memory')
+            conversation_sessions.keep_rows(session, result_columns, rows, len(results_json), version)
+            return results_response(fields, results_json + b',"truncated":false')
+    
+    # Stream rows as NDJSON, one fetchmany batch at a time
+    if data.get('stream'):
+        if session is not None:
+            remember_turn(session, natural_query, statement, params, refinement, fields.get('refined'))
+        lines = ndjson_stream(db_pool, run_sql, fields,
+                              batch_size=STREAM_BATCH_SIZE, limit=limit, offset=offset,
+                              dumps=lambda obj: app.json.dumps(obj, separators=(',', ':')),
+                              params=page_params, governor=query_governor, budget=budget,
+                              columnar=fmt == 'columnar')
+        return app.response_class(stream_with_context(lines), mimetype='application/x-ndjson')
     
     # Execute the SQL query
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
-        conn.close()
-        
-        # Convert results to a list of dictionaries
-        formatted_results = [dict(row) for row in results]
+        # Hot reports are answered from cached bytes without touching sqlite;
+        # only complete results in the JSON encodings are cached
+        cacheable = cacheable and fmt in ('json', 'columnar')
+        results_json = result_cache.get(page_sql, page_params, fmt) if cacheable else None
+        if results_json is not None:
+            results_json += b',"truncated":false'
+            if session is not None:
+                remember_turn(session, natural_query, statement, params, refinement, fields.get('refined'))
+        else:
+            # Read first: results cached or rows kept for the session are
+            # stale once it moves
+            version = result_cache.version()
+            start = time.perf_counter()
+            with db_pool.connection() as conn:
+                if fmt == 'json':
+                    query = query_governor.execute(conn, run_sql, page_params, budget)
+                else:
+                    # Rows go from each fetchmany batch straight into
+                    # per-column lists, without a dict per row
+                    with query_governor.run(conn, run_sql, page_params, budget) as query:
+                        values, more = collect_columns(query.batches(STREAM_BATCH_SIZE),
+                                                       len(query.columns), limit)
+            result_cache.note_statement(sql_query)
+            if session is not None:
+                remember_turn(session, natural_query, statement, params, refinement, fields.get('refined'))
+            serialize_start = time.perf_counter()
+            metrics.observe('execute', serialize_start - start, query_type)
+            if rollup_sql is None:
+                if index_advisor is not None:
+                    index_advisor.record(sql_query, params, serialize_start - start)
+                if rollup_manager is not None:
+                    rollup_manager.record(sql_query, serialize_start - start)
+            
+            next_cursor = None
+            if fmt == 'json':
+                # Convert results to a list of dictionaries
+                formatted_results = [dict(row) for row in query.rows]
+                if limit is not None and len(formatted_results) > limit:
+                    formatted_results = formatted_results[:limit]
+                    next_cursor = encode_cursor(offset + limit)
+                results_json = app.json.dumps(formatted_results, separators=(',', ':')).encode('utf-8')
+            else:
+                if more:
+                    next_cursor = encode_cursor(offset + limit)
+                if fmt != 'columnar':
+                    response = binary_response(fmt, fields, query, values, limit, next_cursor)
+                    metrics.observe('serialize', time.perf_counter() - serialize_start, query_type)
+                    return response
+                results_json = encode_columnar_json(query.columns, values, app.json.dumps)
+            if limit is not None:
+                results_json += b',"next":' + app.json.dumps(next_cursor).encode('utf-8')
+            if cacheable and not query.truncated:
+                result_cache.put(page_sql, results_json, page_params, fmt, version=version)
+            # Complete results are remembered for the session's follow-ups
+            if (session is not None and session.statement is not None and limit is None
+                    and not query.truncated and statement.limit is None):
+                rows = [tuple(row) for row in query.rows] if fmt == 'json' else list(zip(*values))
+                conversation_sessions.keep_rows(session, query.columns, rows, len(results_json), version)
+            results_json += truncation_json(query)
+            metrics.observe('serialize', time.perf_counter() - serialize_start, query_type)
         
-        return jsonify({
-            'natural_query': natural_query,
-            'sql_query': sql_query,
-            'results': formatted_results
-        })
+        return results_response(fields, results_json)
     except Exception as e:
-        return jsonify({
-            'natural_query': natural_query,
-            'sql_query': sql_query,
-            'error': str(e)
-        })
+        return jsonify(dict(fields, error=str(e)))
+
+@app.route('/query/batch', methods=['POST'])
+def process_query_batch():
+    data = request.json or {}
+    natural_queries = data.get('queries')
+    execute = data.get('execute', True)
+    
+    if not isinstance(natural_queries, list) or not natural_queries:
+        return jsonify({'error': 'No queries provided'})
+    if len(natural_queries) > BATCH_MAX_QUERIES:
+        return jsonify({'error': f'Too many queries (maximum is {BATCH_MAX_QUERIES})'})
+    # One budget for every statement of the batch
+    try:
+        budget = query_governor.budget(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)})
+    cacheable = budget is query_governor.default_budget
+    
+    # Translate the whole batch at once
+    start = time.perf_counter()
+    translations = nl_to_sql.generate_sql_batch(natural_queries, processes=BATCH_PROCESSES)
+    translate_ms = (time.perf_counter() - start) * 1000
+    
+    items = []
+    execute_start = time.perf_counter()
+    with db_pool.connection() if execute else nullcontext() as conn:
+        for natural_query, translation in zip(natural_queries, translations):
+            item = {
+                'natural_query': natural_query,
+                'sql_query': translation['sql_query'],
+                'params': translation['params'],
+                'translate_ms': translation['elapsed_ms']
+            }
+            items.append(item)
+            if translation['error'] is not None:
+                item['error'] = translation['error']
+                continue
+            if not execute:
+                continue
+            
+            # Execute on one connection for the whole batch
+            item_start = time.perf_counter()
+            sql_query = translation['sql_query']
+            params = translation['params']
+            try:
+                results_json = result_cache.get(sql_query, params) if cacheable else None
+                item['truncated'] = False
+                if results_json is None:
+                    version = result_cache.version()
+                    rollup_sql = rollup_manager.rewrite(sql_query) if rollup_manager is not None else None
+                    query = query_governor.execute(conn, rollup_sql or sql_query, params, budget)
+                    # Each write is committed on its own: an interrupted
+                    # statement would roll back the whole open transaction
+                    if conn.in_transaction:
+                        conn.commit()
+                    formatted_results = [dict(row) for row in query.rows]
+                    if rollup_sql is not None:
+                        item['rollup_sql'] = rollup_sql
+                    else:
+                        if index_advisor is not None:
+                            index_advisor.record(sql_query, params, time.perf_counter() - item_start)
+                        if rollup_manager is not None:
+                            rollup_manager.record(sql_query, time.perf_counter() - item_start)
+                    result_cache.note_statement(sql_query)
+                    results_json = app.json.dumps(formatted_results, separators=(',', ':')).encode('utf-8')
+                    if query.truncated:
+                        item['truncated'] = True
+                        item['truncated_reason'] = query.reason
+                    elif cacheable:
+                        result_cache.put(sql_query, results_json, params, version=version)
+                item['results'] = app.json.loads(results_json)
+            except Exception as e:
+                # A failed write must not be committed with the next item
+                if conn.in_transaction:
+                    conn.rollback()
+                item['error'] = str(e)
+            item['execute_ms'] = (time.perf_counter() - item_start) * 1000
+    
+    return jsonify({
+        'items': items,
+        'count': len(items),
+        'errors': sum(1 for item in items if 'error' in item),
+        'translate_ms': translate_ms,
+        'execute_ms': (time.perf_counter() - execute_start) * 1000
+    })
+
+@app.route('/schema')
+def schema():
+    return jsonify(schema_catalog.summary())
+
+@app.route('/sessions/stats')
+def session_stats():
+    return jsonify(conversation_sessions.stats())
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def end_session(session_id):
+    return jsonify({'session': session_id, 'ended': conversation_sessions.discard(session_id)})
+
+@app.route('/pool/stats')
+def pool_stats():
+    return jsonify(db_pool.stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        'translation': translation_cache.stats(),
+        'results': result_cache.stats()
+    })
+
+@app.route('/governor')
+def governor_stats():
+    return jsonify({
+        'budget': query_governor.default_budget.as_dict(),
+        'stream_budget': stream_budget.as_dict(),
+        'stats': query_governor.stats()
+    })
+
+@app.route('/indexes')
+def index_advice():
+    if index_advisor is None:
+        return jsonify({'error': 'Index advisor is disabled (INDEX_ADVISOR=off)'})
+    return jsonify({
+        'mode': INDEX_ADVISOR,
+        'stats': index_advisor.stats(),
+        'candidates': index_advisor.report()
+    })
+
+@app.route('/rollups')
+def rollups():
+    if rollup_manager is None:
+        return jsonify({'error': 'Rollups are disabled (ROLLUPS=off)'})
+    return jsonify(dict(rollup_manager.report(), mode=ROLLUPS, stats=rollup_manager.stats()))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # ?format=json returns the p50/p95/p99 summary instead
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.summary())
+    return app.response_class(metrics.render_prometheus(),
+                              mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
+    start_background_refresh()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,286 @@
+"""
+Asyncio serving mode for the SQL assistant
+
+An ASGI application that serves ``POST /query`` next to the Flask app in
+app.py, sharing its translator, connection pool, caches and rollups.
+Translation (milliseconds of CPU for an uncached question, and it may
+wait for a schema refresh) and sqlite execution go to a bounded thread
+pool, so neither stalls the event loop and a slow query never blocks
+other requests.
+
+Only the plain JSON answer is served here. Conversation sessions,
+streaming, ``limit`` / ``after`` pagination and the other result
+encodings exist in app.py only; requests asking for them get a 400
+rather than a different answer than the Flask app would give. Run it
+with any ASGI server, e.g.::
+
+    uvicorn asgi_app:app --workers 4
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import (nl_to_sql, db_pool, result_cache, index_advisor, query_governor, rollup_manager,
+                 start_background_refresh)
+from query_governor import QueryBudget, parse_limit
+
+# Threads executing sqlite statements
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 8))
+# Queries admitted (running or waiting for a thread) before answering 503
+ASYNC_MAX_PENDING = int(os.environ.get('ASYNC_MAX_PENDING', 64))
+# Wall-clock budget per statement, in seconds
+ASYNC_QUERY_TIMEOUT = float(os.environ.get('ASYNC_QUERY_TIMEOUT', 10.0))
+# The governor's row, step and cost limits apply; the wall clock is owned
+# by the CancelToken deadline, which also covers time spent queued
+ASYNC_BUDGET = QueryBudget(query_governor.default_budget.max_rows, None,
+                           query_governor.default_budget.max_steps,
+                           query_governor.default_budget.max_cost)
+# Request fields of app.py's /query that this server does not implement
+UNSUPPORTED_FIELDS = ('session', 'stream', 'limit', 'after')
+
+
+class QueryCancelled(Exception):
+    """The statement was interrupted by its deadline or a client disconnect"""
+
+
+class CancelToken:
+    """Shared between the event loop and the worker thread running a statement"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.cancelled = False
+        self.reason = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def attach(self, conn):
+        with self._lock:
+            self._conn = conn
+
+    def detach(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self, reason):
+        """Stop the running statement as soon as possible (thread-safe)"""
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    def should_abort(self):
+        # Called by sqlite's progress handler on the worker thread
+        if not self.cancelled and time.monotonic() > self.deadline:
+            self.cancelled = True
+            self.reason = 'deadline exceeded'
+        return self.cancelled
+
+
+def execute_statement(sql_query, params, token, budget=ASYNC_BUDGET):
+    """
+    Run a statement on a pooled connection under the token's deadline
+
+    Returns:
+        bytes: The JSON-encoded result rows followed by the truncation
+            members (``[...],"truncated":false``)
+
+    Raises:
+        QueryCancelled: If the deadline passed or the client went away
+        QueryBudgetExceeded: If the governor refused the statement
+    """
+    cacheable = budget is ASYNC_BUDGET
+    results_json = result_cache.get(sql_query, params) if cacheable else None
+    if results_json is not None:
+        return results_json + b',"truncated":false'
+
+    # Aggregates with a rollup read it, as in app.py
+    rollup_sql = rollup_manager.rewrite(sql_query) if rollup_manager is not None else None
+    version = result_cache.version()
+    with db_pool.connection() as conn:
+        if token.cancelled:
+            raise QueryCancelled(token.reason)
+        token.attach(conn)
+        try:
+            start = time.perf_counter()
+            query = query_governor.execute(conn, rollup_sql or sql_query, params, budget,
+                                           should_abort=token.should_abort)
+            if rollup_sql is None:
+                if index_advisor is not None:
+                    index_advisor.record(sql_query, params, time.perf_counter() - start)
+                if rollup_manager is not None:
+                    rollup_manager.record(sql_query, time.perf_counter() - start)
+        except Exception:
+            if token.cancelled:
+                raise QueryCancelled(token.reason)
+            raise
+        finally:
+            token.detach()
+    if token.cancelled:
+        raise QueryCancelled(token.reason)
+    result_cache.note_statement(sql_query)
+
+    results_json = json.dumps([dict(row) for row in query.rows], separators=(',', ':')).encode('utf-8')
+    if query.truncated:
+        return results_json + b',"truncated":true,"truncated_reason":' + json.dumps(query.reason).encode('utf-8')
+    if cacheable:
+        result_cache.put(sql_query, results_json, params, version=version)
+    return results_json + b',"truncated":false'
+
+
+class AsyncQueryApp:
+    """ASGI application answering POST /query"""
+
+    def __init__(self, threads=ASYNC_DB_THREADS, max_pending=ASYNC_MAX_PENDING,
+                 query_timeout=ASYNC_QUERY_TIMEOUT):
+        self.max_pending = max_pending
+        self.query_timeout = query_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='sqlite')
+        self.pending = 0
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == '/query' and scope['method'] == 'POST':
+                await self.query(receive, send)
+            else:
+                await self.respond(send, 404, {'error': 'Not found'})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_background_refresh()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def respond(self, send, status, payload, body=None, headers=()):
+        if body is None:
+            body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode('ascii'))] + list(headers),
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def query(self, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            await self.respond(send, 400, {'error': 'Invalid JSON'})
+            return
+        if not isinstance(data, dict):
+            await self.respond(send, 400, {'error': 'Request body must be a JSON object'})
+            return
+        unsupported = [name for name in UNSUPPORTED_FIELDS if data.get(name)]
+        if data.get('format') not in (None, 'json'):
+            unsupported.append('format')
+        if unsupported:
+            await self.respond(send, 400, {'error': f"Not supported by the ASGI server: {', '.join(unsupported)}"})
+            return
+        natural_query = data.get('query', '')
+        if not natural_query:
+            await self.respond(send, 200, {'error': 'No query provided'})
+            return
+        if not isinstance(natural_query, str):
+            await self.respond(send, 400, {'error': 'query must be a string'})
+            return
+
+        # Admission control: refuse early instead of queueing without bound
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            await self.respond(send, 503, {'error': 'Server busy, try again later'},
+                               headers=[(b'retry-after', b'1')])
+            return
+
+        # An uncached question takes milliseconds and may wait for a schema
+        # refresh, so translation stays off the event loop too
+        loop = asyncio.get_running_loop()
+        try:
+            sql_query, params = await loop.run_in_executor(self.executor, nl_to_sql.generate_sql, natural_query)
+        except Exception as e:
+            await self.respond(send, 200, {'natural_query': natural_query, 'error': str(e)})
+            return
+        fields = {'natural_query': natural_query, 'sql_query': sql_query, 'params': list(params)}
+
+        # Requests may shorten the deadline, never extend it
+        timeout = self.query_timeout
+        try:
+            if data.get('timeout') is not None:
+                timeout = min(timeout, parse_limit('timeout', data['timeout']))
+            budget = query_governor.budget({key: data.get(key) for key in ('max_rows', 'max_steps')},
+                                           base=ASYNC_BUDGET)
+        except ValueError as e:
+            await self.respond(send, 400, dict(fields, error=str(e)))
+            return
+        token = CancelToken(time.monotonic() + timeout)
+
+        self.pending += 1
+        future = loop.run_in_executor(self.executor, execute_statement, sql_query, params, token, budget)
+        future.add_done_callback(self._release_slot)
+        disconnect = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            done, _ = await asyncio.wait({future, disconnect}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if future not in done:
+                # Client went away or the deadline passed while queued or
+                # running; interrupt the statement and free the thread
+                token.cancel('client disconnected' if disconnect in done else 'deadline exceeded')
+                if disconnect in done:
+                    return
+                await self.respond(send, 504, dict(fields, error=f'Query exceeded {timeout}s deadline'))
+                return
+        finally:
+            disconnect.cancel()
+
+        try:
+            results_json = future.result()
+        except QueryCancelled as e:
+            await self.respond(send, 504, dict(fields, error=f'Query cancelled: {e}'))
+            return
+        except Exception as e:
+            await self.respond(send, 200, dict(fields, error=str(e)))
+            return
+
+        head = json.dumps(fields, separators=(',', ':')).encode('utf-8')
+        await self.respond(send, 200, None, body=head[:-1] + b',"results":' + results_json + b'}')
+
+    def _release_slot(self, future):
+        self.pending -= 1
+        # Mark the outcome as seen when nobody awaited it (client gone)
+        if not future.cancelled():
+            future.exception()
+
+    async def wait_for_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+
+app = AsyncQueryApp()
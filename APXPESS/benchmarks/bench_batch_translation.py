@@ -0,0 +1,69 @@
+"""
+Benchmark NaturalLanguageToSQL.generate_sql_batch against calling
+generate_sql once per question
+
+Usage:
+    python benchmarks/bench_batch_translation.py [n_questions] [processes]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from natural_language_to_sql import NaturalLanguageToSQL
+
+DB_SCHEMA = {
+    'customers': ['id', 'name', 'email', 'signup_date', 'country'],
+    'orders': ['id', 'customer_id', 'order_date', 'total_amount', 'status'],
+    'products': ['id', 'name', 'category', 'price', 'stock']
+}
+
+TEMPLATES = [
+    'Show all customers from {country}',
+    'Find orders with total_amount greater than {number}',
+    'List all products in the {category} category with stock less than {number}',
+    'Show products with price over {number}',
+    'Get the email of customers who signed up after 2022-0{month}-01',
+    'Delete orders with status {status}',
+]
+
+
+def make_questions(n, distinct_ratio=0.2, seed=7):
+    """Logged questions repeat a lot; distinct_ratio controls how much"""
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(max(1, int(n * distinct_ratio))):
+        template = rng.choice(TEMPLATES)
+        pool.append(template.format(country=rng.choice(['Canada', 'USA', 'UK']),
+                                    number=rng.randint(1, 1000000),
+                                    category=rng.choice(['Electronics', 'Clothing', 'Kitchen']),
+                                    month=rng.randint(1, 9),
+                                    status=rng.choice(['Pending', 'Completed'])))
+    return [rng.choice(pool) for _ in range(n)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    for distinct_ratio in (0.05, 1.0):
+        questions = make_questions(n, distinct_ratio)
+
+        # No translation cache, so every run does the same work
+        nl = NaturalLanguageToSQL(DB_SCHEMA, translation_cache=False)
+        loop = timed(lambda: [nl.generate_sql(q) for q in questions])
+        batch = timed(lambda: nl.generate_sql_batch(questions))
+        parallel = timed(lambda: nl.generate_sql_batch(questions, processes=processes))
+
+        print(f'{n} questions, {len(set(questions))} distinct: '
+              f'loop {n / loop:9.0f} q/s  '
+              f'batch {n / batch:9.0f} q/s ({loop / batch:5.1f}x)  '
+              f'batch x{processes} procs {n / parallel:9.0f} q/s ({loop / parallel:5.1f}x)')
@@ -0,0 +1,148 @@
+"""
+Benchmark bulk_loader.py against the naive ways of seeding a database
+
+Writes Chinook inflated by --scale (see scale_chinook.py) as a SQL script
+in the style of Chinook_Sqlite.sql (one multi-row INSERT per table) and
+as a ChinookData.json-style document, then loads each into an empty
+database twice, each time in a fresh process:
+
+- naive: the SQL script through executescript(), or json.load() plus
+  executemany() per table, with default journaling
+- bulk: bulk_loader.bulk_load()
+
+and reports rows per second and the peak memory of the loading process.
+
+Usage:
+    python benchmarks/bench_bulk_load.py [--scale 50] [--output results.json]
+"""
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+
+def write_dumps(database, sql_path, json_path):
+    """Write a database as a SQL script and a JSON document, streaming"""
+    conn = sqlite3.connect(database)
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid")]
+    with open(sql_path, 'w', encoding='utf-8') as sql, open(json_path, 'w', encoding='utf-8') as doc:
+        for (ddl,) in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+            sql.write(ddl + ';\n\n')
+        for (ddl,) in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"):
+            sql.write(ddl + ';\n\n')
+        doc.write('{')
+        for position, table in enumerate(tables):
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+            quoted = " || ', ' || ".join(f'quote("{column}")' for column in columns)
+            sql.write(f'INSERT INTO [{table}] ({", ".join(f"[{column}]" for column in columns)}) VALUES')
+            for row_number, (literals,) in enumerate(conn.execute(f'SELECT {quoted} FROM "{table}"')):
+                sql.write(('\n    (' if row_number == 0 else ',\n    (') + literals + ')')
+            sql.write(';\n\n')
+
+            doc.write(('' if position == 0 else ',') + f'\n  {json.dumps(table)}: [')
+            for row_number, row in enumerate(conn.execute(f'SELECT * FROM "{table}"')):
+                doc.write(('\n    ' if row_number == 0 else ',\n    ') + json.dumps(dict(zip(columns, row))))
+            doc.write('\n  ]')
+        doc.write('\n}\n')
+    conn.close()
+
+
+def naive_sql(database, path):
+    conn = sqlite3.connect(database)
+    with open(path, encoding='utf-8') as f:
+        conn.executescript(f.read())
+    conn.close()
+
+
+def naive_json(database, path, schema):
+    conn = sqlite3.connect(database)
+    conn.executescript(schema)
+    with open(path, encoding='utf-8') as f:
+        document = json.load(f)
+    for table, rows in document.items():
+        if not rows:
+            continue
+        columns = list(rows[0])
+        conn.executemany(f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                         [tuple(row[column] for column in columns) for row in rows])
+        conn.commit()
+    conn.close()
+
+
+def child(mode, database, path, schema_path):
+    """Run one load in this process and print its timings as JSON"""
+    from bulk_loader import bulk_load
+    start = time.perf_counter()
+    if mode == 'naive-sql':
+        naive_sql(database, path)
+    elif mode == 'naive-json':
+        with open(schema_path, encoding='utf-8') as f:
+            naive_json(database, path, f.read())
+    else:
+        bulk_load(database, path, schema=schema_path if mode == 'bulk-json' else None)
+    elapsed = time.perf_counter() - start
+    conn = sqlite3.connect(database)
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    rows = sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+    print(json.dumps({'rows': rows, 'seconds': elapsed,
+                      'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=int, default=50, help='Chinook inflation factor')
+    parser.add_argument('--data-dir', default=os.path.join(BENCH_DIR, 'data'))
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--child', nargs=4, metavar=('MODE', 'DATABASE', 'INPUT', 'SCHEMA'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    from scale_chinook import scale_chinook
+    source = scale_chinook(args.scale, os.path.join(args.data_dir, f'chinook_x{args.scale}.sqlite'))
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        sql_path = os.path.join(workdir, 'chinook.sql')
+        json_path = os.path.join(workdir, 'chinook.json')
+        schema_path = os.path.join(workdir, 'schema.sql')
+        write_dumps(source, sql_path, json_path)
+        with open(schema_path, 'w', encoding='utf-8') as f:
+            for (ddl,) in sqlite3.connect(source).execute(
+                    "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"):
+                f.write(ddl + ';\n')
+        print(f"Chinook x{args.scale}: SQL {os.path.getsize(sql_path) / 1e6:.0f} MB, "
+              f"JSON {os.path.getsize(json_path) / 1e6:.0f} MB")
+
+        for data_format, path in (('sql', sql_path), ('json', json_path)):
+            for method in ('naive', 'bulk'):
+                mode = f'{method}-{data_format}'
+                database = os.path.join(workdir, f'{mode}.sqlite')
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--child', mode, database, path, schema_path],
+                    check=True, capture_output=True, text=True).stdout
+                result = results[mode] = json.loads(output.strip().splitlines()[-1])
+                result['rows_per_second'] = result['rows'] / result['seconds']
+                print(f"  {mode:<11} {result['rows']:>10,} rows  {result['seconds']:7.2f} s  "
+                      f"{result['rows_per_second']:>10,.0f} rows/s  peak {result['peak_rss_mb']:7.1f} MB")
+                os.remove(database)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'scale': args.scale, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
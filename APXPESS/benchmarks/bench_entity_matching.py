@@ -0,0 +1,90 @@
+"""
+Benchmark NaturalLanguageToSQL.identify_entities against the original
+per-table/per-column substring scan
+
+Usage:
+    python benchmarks/bench_entity_matching.py
+"""
+import os
+import re
+import sqlite3
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from natural_language_to_sql import NaturalLanguageToSQL
+
+CHINOOK_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chinook-database',
+                          'ChinookDatabase', 'DataSources', 'Chinook_Sqlite.sqlite')
+
+QUERIES = [
+    'show all customers from canada',
+    'find invoices with total greater than 10',
+    'list tracks where milliseconds is more than 300000 and unitprice below 1',
+    'which employees have a title like sales and a city of calgary',
+    'get the name of every artist with more than 5 albums',
+]
+
+
+def legacy_identify_entities(nl, query):
+    """The loop identify_entities used before the precompiled matcher"""
+    entities = {'tables': [], 'columns': [], 'conditions': [], 'values': []}
+    for table, columns in nl.db_schema.items():
+        if table.lower() in query:
+            if table not in entities['tables']:
+                entities['tables'].append(table)
+        for column in columns:
+            if column.lower() in query:
+                if column not in entities['columns']:
+                    entities['columns'].append(column)
+                if table not in entities['tables']:
+                    entities['tables'].append(table)
+    entities['values'].extend(re.findall(r'\b\d+(?:\.\d+)?\b', query))
+    for condition_phrase, operator in nl.condition_mapping.items():
+        if condition_phrase in query:
+            entities['conditions'].append((condition_phrase, operator))
+    return entities
+
+
+def chinook_schema():
+    conn = sqlite3.connect(CHINOOK_DB)
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    schema = {table: [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')] for table in tables}
+    conn.close()
+    return schema
+
+
+def synthetic_schema(n_columns=5000, columns_per_table=20):
+    schema = {}
+    for t in range(n_columns // columns_per_table):
+        schema[f'table_{t:04d}'] = [f'col_{t:04d}_{c:02d}' for c in range(columns_per_table)]
+    return schema
+
+
+def run(name, schema, number=200):
+    # Exact matching only; the fuzzy pass is measured by bench_fuzzy_matching.py
+    nl = NaturalLanguageToSQL()
+    nl.fuzzy_matcher = None
+    nl.db_schema = schema
+
+    # Both implementations must agree before timing means anything
+    for query in QUERIES:
+        legacy = legacy_identify_entities(nl, query)
+        new = nl.identify_entities(query)
+        assert {key: new[key] for key in legacy} == legacy, query
+
+    legacy = timeit.timeit(lambda: [legacy_identify_entities(nl, q) for q in QUERIES], number=number)
+    matcher = timeit.timeit(lambda: [nl.identify_entities(q) for q in QUERIES], number=number)
+    calls = number * len(QUERIES)
+    n_columns = sum(len(columns) for columns in schema.values())
+    print(f'{name:<22} {len(schema):>6} tables {n_columns:>6} columns  '
+          f'legacy {legacy / calls * 1e6:9.1f} us/query  '
+          f'matcher {matcher / calls * 1e6:7.1f} us/query  '
+          f'speedup {legacy / matcher:6.1f}x')
+
+
+if __name__ == '__main__':
+    run('chinook', chinook_schema())
+    run('synthetic-5000', synthetic_schema())
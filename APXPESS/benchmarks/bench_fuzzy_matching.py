@@ -0,0 +1,162 @@
+"""
+Benchmark the typo-tolerant schema matcher on large schemas
+
+A synthetic schema of realistic snake_case and CamelCase names (10,000
+columns by default) is indexed, then questions that spell a real column
+with spaces, plural table names and one typo are matched against it. The
+run fails when the 95th percentile lookup exceeds the microsecond budget
+or the accuracy drops below the floor.
+
+Usage:
+    python benchmarks/bench_fuzzy_matching.py [--columns 10000] [--budget-us 250]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fuzzy_matcher import bounded_distance, name_words, stem
+from natural_language_to_sql import NaturalLanguageToSQL
+
+DOMAINS = ['customer', 'order', 'invoice', 'product', 'supplier', 'shipment', 'employee', 'account',
+           'payment', 'warehouse', 'vendor', 'contract', 'campaign', 'ticket', 'project', 'branch',
+           'device', 'session', 'subscription', 'refund', 'review', 'category', 'region', 'store',
+           'course', 'student', 'patient', 'doctor', 'vehicle', 'driver', 'route', 'booking',
+           'hotel', 'flight', 'passenger', 'policy', 'claim', 'asset', 'license', 'partner']
+QUALIFIERS = ['billing', 'shipping', 'primary', 'secondary', 'legacy', 'monthly', 'annual', 'daily',
+              'external', 'internal', 'pending', 'archived', 'regional', 'global', 'manual', 'default']
+ATTRIBUTES = ['name', 'email', 'phone', 'address', 'city', 'country', 'postal code', 'status',
+              'created at', 'updated at', 'total', 'amount', 'quantity', 'price', 'discount', 'balance',
+              'description', 'title', 'rating', 'score', 'weight', 'height', 'currency', 'language',
+              'latitude', 'longitude', 'birth date', 'start date', 'end date', 'due date', 'notes',
+              'reference', 'priority', 'category', 'tax rate', 'company', 'website', 'owner',
+              'manager', 'department', 'capacity', 'duration', 'distance', 'revenue', 'margin']
+
+
+def camel(words):
+    return ''.join(word.capitalize() for word in words)
+
+
+def synthetic_schema(n_columns=10000, columns_per_table=25, seed=11):
+    """Tables like shipping_vendor_contract with columns like BillingPostalCode"""
+    rng = random.Random(seed)
+    schema = {}
+    while sum(len(columns) for columns in schema.values()) < n_columns:
+        words = [rng.choice(QUALIFIERS), rng.choice(DOMAINS), rng.choice(DOMAINS)]
+        table = '_'.join(words[rng.randint(0, 1):])
+        if table in schema:
+            table = f'{table}_{len(schema)}'
+        columns = set()
+        while len(columns) < columns_per_table:
+            words = rng.choice(ATTRIBUTES).split()
+            if rng.random() < 0.7:
+                words = [rng.choice(QUALIFIERS + DOMAINS)] + words
+            columns.add(camel(words) if rng.random() < 0.5 else '_'.join(words))
+        schema[table] = sorted(columns)
+    return schema
+
+
+def typo(word, rng):
+    """One transposition, deletion or substitution inside a word"""
+    if len(word) < 6:
+        return word
+    i = rng.randint(1, len(word) - 3)
+    kind = rng.choice(['transpose', 'delete', 'substitute'])
+    if kind == 'transpose':
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if kind == 'delete':
+        return word[:i] + word[i + 1:]
+    return word[:i] + rng.choice('aeioustrn') + word[i + 1:]
+
+
+def make_questions(schema, n=500, seed=13):
+    """Return (question, table, column) triples with the column name mangled"""
+    rng = random.Random(seed)
+    tables = sorted(schema)
+    questions = []
+    for _ in range(n):
+        table = rng.choice(tables)
+        column = rng.choice(schema[table])
+        words = list(name_words(column))
+        longest = max(range(len(words)), key=lambda i: len(words[i]))
+        words[longest] = typo(words[longest], rng)
+        template = rng.choice(['show the {column} of {table}', 'list {table} {column}',
+                               'find {table} where {column} is over 100'])
+        questions.append((template.format(column=' '.join(words), table=' '.join(name_words(table)) + 's'),
+                          table, column))
+    return questions
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--columns', type=int, default=10000)
+    parser.add_argument('--questions', type=int, default=500)
+    parser.add_argument('--budget-us', type=float, default=250.0, help='p95 budget per lookup')
+    parser.add_argument('--min-accuracy', type=float, default=0.9)
+    args = parser.parse_args()
+
+    schema = synthetic_schema(args.columns)
+    n_columns = sum(len(columns) for columns in schema.values())
+
+    nl = NaturalLanguageToSQL()
+    start = time.perf_counter()
+    nl.db_schema = schema
+    build_seconds = time.perf_counter() - start
+    matcher = nl.fuzzy_matcher
+    questions = make_questions(schema, args.questions)
+
+    # Cold lookups: a fresh word cache for every question
+    samples = []
+    correct = 0
+    for question, table, column in questions:
+        matcher._cache.clear()
+        query = nl.normalize_query(question)
+        start = time.perf_counter()
+        matches = matcher.find(query)
+        samples.append(time.perf_counter() - start)
+        if any(payload == ('column', column, table) for _, _, payload, _ in matches):
+            correct += 1
+
+    start = time.perf_counter()
+    for question, _, _ in questions:
+        nl.identify_entities(nl.normalize_query(question))
+    warm = (time.perf_counter() - start) / len(questions)
+
+    # Correcting the same words by scanning the whole vocabulary, for scale
+    vocabulary = list(matcher._vocabulary)
+    start = time.perf_counter()
+    for question, _, _ in questions[:50]:
+        for word in nl.normalize_query(question).split():
+            word = stem(word)
+            if word not in matcher._vocabulary and word not in matcher.ignore_words and len(word) >= 4:
+                min(vocabulary, key=lambda candidate: bounded_distance(word, candidate, matcher.max_edits))
+    scan = (time.perf_counter() - start) / 50
+
+    p50, p95 = percentile(samples, 0.5) * 1e6, percentile(samples, 0.95) * 1e6
+    accuracy = correct / len(questions)
+    print(f'{len(schema)} tables, {n_columns} columns; index {matcher.stats()} built in {build_seconds * 1e3:.0f} ms')
+    print(f'fuzzy find (cold)     p50 {p50:8.1f} us  p95 {p95:8.1f} us  budget {args.budget_us:.0f} us')
+    print(f'identify_entities     {warm * 1e6:8.1f} us/query (warm word cache)')
+    print(f'linear scan           {scan * 1e6:8.1f} us/query (same corrections without the index)')
+    print(f'accuracy              {accuracy:8.1%} ({correct}/{len(questions)})')
+
+    failed = False
+    if p95 > args.budget_us:
+        print(f'FAIL: p95 {p95:.1f} us over the {args.budget_us:.0f} us budget')
+        failed = True
+    if accuracy < args.min_accuracy:
+        print(f'FAIL: accuracy {accuracy:.1%} under {args.min_accuracy:.0%}')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Microbenchmark of the translator's front end
+
+Times, per question of the corpus (see corpus.py), everything the
+translation pipeline does before SQL generation: tokenizing and stop-word
+filtering, query type detection, entity identification (exact and fuzzy,
+with the value index loaded) and date phrase extraction. Like
+generate_sql, the stages see the question's parameterized shape. The
+script only uses the public stage methods when the translator has no
+lexer, so running it on an older checkout measures the previous front end
+the same way:
+
+    git stash; python benchmarks/bench_lexer.py --output before.json; git stash pop
+    python benchmarks/bench_lexer.py --compare before.json --min-speedup 5
+
+The lexer itself (split, cached run analysis) is a small share of the
+total. Most of the time is interpreter overhead in identify_entities: the
+fuzzy pass and the bookkeeping over the few hits of each question, which
+no lexing change removes. Repeated question shapes skip the front end
+altogether through the translation cache.
+
+Usage:
+    python benchmarks/bench_lexer.py [--corpus-size 3000] [--repeat 5]
+        [--output results.json] [--compare before.json] [--min-speedup 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import build_corpus, CHINOOK_DB, DEMO_DB
+from natural_language_to_sql import NaturalLanguageToSQL
+from schema_catalog import SchemaCatalog
+from value_index import ValueIndex
+
+
+def translator(database):
+    catalog = SchemaCatalog(database)
+    catalog.refresh()
+    nl = NaturalLanguageToSQL(translation_cache=False)
+    nl.set_catalog(catalog)
+    values = ValueIndex(catalog)
+    values.refresh()
+    nl.set_value_index(values)
+    return nl
+
+
+def front_end(nl):
+    """The per-question front end of nl as a function of the question shape"""
+    if hasattr(nl, 'lex'):
+        def run(question):
+            query, runs = nl.lex(question)
+            nl.detect_query_type(nl._filtered_tokens(query, runs))
+            nl.identify_entities(query, runs)
+            nl.extract_date_conditions(query, runs)
+    else:
+        def run(question):
+            query, tokens = nl.preprocess_query(question)
+            nl.detect_query_type(tokens)
+            nl.identify_entities(query)
+            nl.extract_date_conditions(query)
+    return run
+
+
+def measure(nl, questions, repeat):
+    run = front_end(nl)
+    # Warm the word caches: steady state, not first sight of each word
+    for question in questions:
+        run(question)
+    clock = time.perf_counter_ns
+    samples = []
+    best_total = None
+    for _ in range(repeat):
+        total = 0
+        for question in questions:
+            start = clock()
+            run(question)
+            elapsed = clock() - start
+            samples.append(elapsed)
+            total += elapsed
+        best_total = total if best_total is None else min(best_total, total)
+    samples.sort()
+    return {
+        'questions': len(questions),
+        'mean_us': best_total / len(questions) / 1000,
+        'p50_us': samples[len(samples) // 2] / 1000,
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus-size', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=5, help='timed passes; the fastest counts')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='earlier results to compute the speed-up against')
+    parser.add_argument('--min-speedup', type=float, default=None,
+                        help='exit with status 1 when the mean speed-up is lower')
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus_size)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    speedups = []
+    for schema_name, database in (('chinook', CHINOOK_DB), ('demo', DEMO_DB)):
+        questions = [item['question'] for item in corpus if item['schema'] == schema_name]
+        if not questions:
+            continue
+        nl = translator(database)
+        shapes = [nl.parameterize_query(nl.normalize_query(question))[0] for question in questions]
+        result = results[schema_name] = measure(nl, shapes, args.repeat)
+        line = (f"  {schema_name:<8} mean {result['mean_us']:7.2f} us  p50 {result['p50_us']:7.2f} us  "
+                f"p99 {result['p99_us']:7.2f} us  ({result['questions']} questions)")
+        if baseline and schema_name in baseline:
+            speedup = baseline[schema_name]['mean_us'] / result['mean_us']
+            speedups.append(speedup)
+            line += f"  x{speedup:.1f} vs {baseline[schema_name]['mean_us']:.2f} us"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.min_speedup is not None and speedups and min(speedups) < args.min_speedup:
+        print(f'FAIL: speed-up x{min(speedups):.1f} under x{args.min_speedup:.1f}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Scaling benchmark of the pre-forking server (see prefork.py)
+
+Starts prefork.py against a copy of Chinook (inflated by --scale) once per
+worker count, loads POST /query over real HTTP from separate client
+processes with the read questions of the corpus, and reports throughput
+and latency for each count, so the speed-up from 1 to N cores is visible.
+
+Usage:
+    python benchmarks/bench_prefork.py [--workers 1,2,4] [--scale 10]
+        [--requests 4000] [--clients 8] [--output prefork.json]
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import build_corpus, CHINOOK_DB
+from scale_chinook import scale_chinook
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'prefork.py exited with status {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/pool/stats')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('prefork.py did not start in time')
+
+
+def client(args):
+    """Post questions one at a time; returns (latencies in seconds, errors)"""
+    port, questions = args
+    latencies = []
+    errors = 0
+    for question in questions:
+        body = json.dumps({'query': question})
+        start = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request('POST', '/query', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            data = response.read()
+            connection.close()
+            if response.status != 200 or b'"error"' in data:
+                errors += 1
+        except OSError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run(workers, db_path, questions, args):
+    port = free_port()
+    env = dict(os.environ, DB_PATH=db_path, SCHEMA_SNAPSHOT_PATH=db_path + '.schema.json',
+               RESULT_CACHE_MAX_BYTES='0')
+    process = subprocess.Popen(
+        [sys.executable, 'prefork.py', '--workers', str(workers), '--port', str(port), '--reload-interval', '0'],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port, process)
+        rng = random.Random(args.seed)
+        plan = [rng.choice(questions) for _ in range(args.requests)]
+        chunks = [(port, plan[i::args.clients]) for i in range(args.clients)]
+        with multiprocessing.Pool(args.clients) as pool:
+            # Warm every worker's caches before timing
+            pool.map(client, [(port, plan[:20])] * args.clients)
+            start = time.perf_counter()
+            outcomes = pool.map(client, chunks)
+            elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+    latencies = [latency for samples, _ in outcomes for latency in samples]
+    return {
+        'workers': workers,
+        'requests': len(plan),
+        'clients': args.clients,
+        'seconds': elapsed,
+        'throughput_rps': len(plan) / elapsed,
+        'errors': sum(errors for _, errors in outcomes),
+        'p50_ms': percentile(latencies, 0.5) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+    }
+
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, cores} & set(range(1, cores + 1)) | {1})
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', default=','.join(map(str, default_workers)),
+                        help='comma-separated worker counts')
+    parser.add_argument('--scale', type=int, default=10, help='Chinook inflation factor')
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--clients', type=int, default=8, help='concurrent client processes')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--data-dir', default=os.path.join(BENCH_DIR, 'data'))
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    questions = [item['question'] for item in build_corpus(2000, databases={'chinook': CHINOOK_DB})
+                 if item['kind'] == 'read']
+    source = scale_chinook(args.scale, os.path.join(args.data_dir, f'chinook_x{args.scale}.sqlite'))
+
+    print(f'{cores} cores, Chinook x{args.scale}, {args.requests} requests from {args.clients} clients')
+    if cores < 2:
+        # Workers then only time-slice one core: the run checks that the
+        # server works, it does not measure how it scales
+        print('  Note: fewer than 2 cores, speed-ups below are not a scaling measurement')
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'chinook.sqlite')
+        shutil.copyfile(source, db_path)
+        for workers in (int(n) for n in args.workers.split(',')):
+            result = run(workers, db_path, questions, args)
+            result['speedup'] = result['throughput_rps'] / results[0]['throughput_rps'] if results else 1.0
+            results.append(result)
+            print(f"  {workers:3d} workers  {result['throughput_rps']:8.1f} req/s  x{result['speedup']:4.2f}  "
+                  f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  errors {result['errors']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cores': cores, 'scale': args.scale, 'scaling_measured': cores >= 2,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
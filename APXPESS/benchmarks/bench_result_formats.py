@@ -0,0 +1,74 @@
+"""
+Benchmark the response encodings of POST /query on a large result
+
+Asks for every invoice line of Chinook inflated by --scale (112,000 rows
+at the default x50) in each available format (see result_format.py) and
+reports the response size and the server time spent executing and
+encoding, next to the default row-object JSON.
+
+Usage:
+    python benchmarks/bench_result_formats.py [--scale 50] [--repeat 3]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from scale_chinook import scale_chinook
+
+QUESTION = 'show all invoice lines'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=int, default=50, help='Chinook inflation factor')
+    parser.add_argument('--repeat', type=int, default=3, help='requests per format; the fastest counts')
+    parser.add_argument('--data-dir', default=os.path.join(BENCH_DIR, 'data'))
+    args = parser.parse_args()
+
+    source = scale_chinook(args.scale, os.path.join(args.data_dir, f'chinook_x{args.scale}.sqlite'))
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'chinook.sqlite')
+    shutil.copyfile(source, db_path)
+    # Read before app is imported: the whole result, and no cached answers
+    os.environ.update(DB_PATH=db_path, SCHEMA_SNAPSHOT_PATH=db_path + '.schema.json',
+                      GOVERNOR_MAX_ROWS='1000000', GOVERNOR_MAX_COST='1e12', GOVERNOR_TIMEOUT='300',
+                      RESULT_CACHE_MAX_BYTES='0')
+    os.chdir(APP_DIR)
+    import app as app_module
+    from result_format import available_formats
+
+    app_module.warm_up()
+    client = app_module.app.test_client()
+    print(f"{QUESTION!r} -> {app_module.nl_to_sql.generate_sql(QUESTION)[0]}")
+
+    baseline = None
+    try:
+        for fmt in available_formats():
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.post('/query', json={'query': QUESTION, 'format': fmt})
+                body = response.get_data()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            if response.mimetype == 'application/json' and response.json.get('error'):
+                print(f"  {fmt:<9} error: {response.json['error']}")
+                continue
+            if baseline is None:
+                baseline = (best, len(body))
+            print(f"  {fmt:<9} {len(body) / 1e6:8.2f} MB  {best * 1e3:8.1f} ms  "
+                  f"size x{baseline[1] / len(body):4.1f}  time x{baseline[0] / best:4.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark aggregate questions answered from rollup tables
+
+Translates dashboard-style questions against Chinook inflated by --scale,
+times each statement on its fact table and on the rollup RollupManager
+builds for it (see rollups.py), and checks both give the same rows. The
+cost of the triggers that keep rollups current is measured with a write
+workload (inserts, updates of measures and keys, deletes) run once before
+and once after the rollups exist; the answers are compared again after it.
+
+Usage:
+    python benchmarks/bench_rollups.py [--scale 50] [--repeat 5] [--writes 5000]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from scale_chinook import scale_chinook
+
+QUESTIONS = [
+    'total sales per country',
+    'average invoice total by billing country',
+    'how many invoices',
+    'how many tracks per genre',
+    'average track length by genre',
+    'minimum milliseconds per genre',
+    'max unit price per media type',
+    'total invoice total per customer',
+]
+
+
+def best_time(conn, sql_query, params, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(sql_query, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def same_rows(a, b):
+    """Equal up to row order and floating point rounding of sums"""
+    def normalized(rows):
+        return sorted(tuple(round(value, 6) if isinstance(value, float) else value for value in row)
+                      for row in rows)
+    return normalized(a) == normalized(b)
+
+
+def write_workload(db_path, writes):
+    """Insert invoice lines and tracks, update some, delete some; returns seconds"""
+    conn = sqlite3.connect(db_path)
+    invoice_lines = conn.execute('SELECT MAX(InvoiceLineId), MAX(InvoiceId) FROM InvoiceLine').fetchone()
+    tracks = conn.execute('SELECT MAX(TrackId), MAX(GenreId), MAX(MediaTypeId) FROM Track').fetchone()
+    invoices = conn.execute('SELECT MAX(InvoiceId), MAX(CustomerId) FROM Invoice').fetchone()
+    start = time.perf_counter()
+    with conn:
+        for i in range(1, writes + 1):
+            conn.execute('INSERT INTO Invoice (InvoiceId, CustomerId, InvoiceDate, BillingCountry, Total) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (invoices[0] + i, i % invoices[1] + 1, '2026-01-01', ('Canada', 'Chile', 'Narnia')[i % 3],
+                          round(i % 17 * 0.99, 2)))
+            conn.execute('INSERT INTO Track (TrackId, Name, MediaTypeId, GenreId, Milliseconds, UnitPrice) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (tracks[0] + i, f'Track {i}', i % tracks[2] + 1, i % tracks[1] + 1,
+                          1000 + i * 37 % 900000, (0.99, 1.99, 9.99)[i % 3]))
+            conn.execute('INSERT INTO InvoiceLine (InvoiceLineId, InvoiceId, TrackId, UnitPrice, Quantity) '
+                         'VALUES (?, ?, ?, 0.99, 1)', (invoice_lines[0] + i, i % invoice_lines[1] + 1, i))
+        for i in range(1, writes + 1, 2):
+            # New measures and new keys; every other one a new extreme
+            conn.execute('UPDATE Track SET Milliseconds = ?, GenreId = ? WHERE TrackId = ?',
+                         (i * 7919 % 5000000 if i % 4 == 1 else 1, i % tracks[1] + 1, i * 13 % tracks[0] + 1))
+            conn.execute('UPDATE Invoice SET Total = Total + 1, BillingCountry = ? WHERE InvoiceId = ?',
+                         ('Narnia', i * 11 % invoices[0] + 1))
+        for i in range(1, writes + 1, 3):
+            # Removes extremes and, for Narnia, whole keys
+            conn.execute('DELETE FROM Track WHERE TrackId = ?', (i * 17 % (tracks[0] + writes) + 1,))
+            conn.execute('DELETE FROM Invoice WHERE InvoiceId = ?', (invoices[0] + i,))
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=int, default=50, help='Chinook inflation factor')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per statement; the fastest counts')
+    parser.add_argument('--writes', type=int, default=5000, help='rows inserted per table by the write workload')
+    parser.add_argument('--data-dir', default=os.path.join(BENCH_DIR, 'data'))
+    args = parser.parse_args()
+
+    source = scale_chinook(args.scale, os.path.join(args.data_dir, f'chinook_x{args.scale}.sqlite'))
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'chinook.sqlite')
+    shutil.copyfile(source, db_path)
+    os.environ.update(DB_PATH=db_path, SCHEMA_SNAPSHOT_PATH=db_path + '.schema.json', ROLLUPS='off')
+    os.chdir(APP_DIR)
+    import app as app_module
+    from rollups import RollupManager
+
+    try:
+        app_module.warm_up()
+        statements = [app_module.nl_to_sql.generate_sql(question) for question in QUESTIONS]
+
+        # Writes without triggers, on a copy so both runs start alike
+        baseline_path = os.path.join(workdir, 'baseline.sqlite')
+        shutil.copyfile(db_path, baseline_path)
+        plain_writes = write_workload(baseline_path, args.writes)
+
+        manager = RollupManager(db_path, min_uses=1, check_interval=0)
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+        direct = {}
+        for sql_query, params in statements:
+            direct[sql_query] = best_time(conn, sql_query, params, args.repeat)
+            manager.record(sql_query, direct[sql_query][0])
+        start = time.perf_counter()
+        manager.wait()
+        print(f'built {manager.stats()["built"]} rollups in {time.perf_counter() - start:.2f} s')
+        for candidate in manager.report()['candidates']:
+            if candidate['status'] != 'created':
+                print(f"  {candidate['table']}.{candidate['measure']} by {candidate['keys']}: "
+                      f"{candidate['status']} ({candidate.get('reason')})")
+
+        mismatches = 0
+        for question, (sql_query, params) in zip(QUESTIONS, statements):
+            rollup_sql = manager.rewrite(sql_query)
+            direct_time, direct_rows = direct[sql_query]
+            if rollup_sql is None:
+                print(f'  {question:<42} {direct_time * 1e3:8.2f} ms  (no rollup)')
+                continue
+            rollup_time, rollup_rows = best_time(conn, rollup_sql, params, args.repeat)
+            same = same_rows(direct_rows, rollup_rows)
+            mismatches += not same
+            print(f'  {question:<42} {direct_time * 1e3:8.2f} ms -> {rollup_time * 1e3:7.3f} ms  '
+                  f'x{direct_time / rollup_time:6.0f}  {"same rows" if same else "MISMATCH"}')
+
+        triggered_writes = write_workload(db_path, args.writes)
+        print(f'write workload: {plain_writes:.2f} s without rollups, {triggered_writes:.2f} s with '
+              f'(x{triggered_writes / plain_writes:.1f})')
+        for question, (sql_query, params) in zip(QUESTIONS, statements):
+            rollup_sql = manager.rewrite(sql_query)
+            if rollup_sql is not None and not same_rows(conn.execute(sql_query, params).fetchall(),
+                                                        conn.execute(rollup_sql, params).fetchall()):
+                mismatches += 1
+                print(f'  MISMATCH after writes: {question}')
+        print(f'{mismatches} mismatches')
+        conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
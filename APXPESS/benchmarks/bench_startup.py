@@ -0,0 +1,48 @@
+"""
+Measure cold-start cost: module import time and first-request latency,
+each in a fresh interpreter
+
+Usage:
+    python benchmarks/bench_startup.py [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{first_call}
+done = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "first_call_ms": (done - imported) * 1000}}))
+'''
+
+CASES = {
+    'natural_language_to_sql': (
+        'natural_language_to_sql',
+        'natural_language_to_sql.NaturalLanguageToSQL({"customers": ["id", "country"]})'
+        '.generate_sql("Show all customers from Canada")'),
+    'app': (
+        'app',
+        'app.app.test_client().post("/query", json={"query": "Show all customers from Canada"})'),
+}
+
+
+def measure(module, first_call):
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, first_call=first_call)],
+                            cwd=APP_DIR, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, (module, first_call) in CASES.items():
+        samples = [measure(module, first_call) for _ in range(runs)]
+        import_ms = sorted(s['import_ms'] for s in samples)[runs // 2]
+        first_ms = sorted(s['first_call_ms'] for s in samples)[runs // 2]
+        print(f'{name:<26} import {import_ms:8.1f} ms   first request {first_ms:8.1f} ms   (median of {runs})')
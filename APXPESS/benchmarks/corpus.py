@@ -0,0 +1,132 @@
+"""
+Reproducible corpus of natural-language questions over the Chinook and
+demo databases
+
+Questions are generated from templates filled with the real table names,
+column names and sampled values of each database, so the same seed always
+gives the same corpus.
+
+Usage:
+    python benchmarks/corpus.py [n_questions] [output.json]
+"""
+import json
+import os
+import random
+import sqlite3
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, APP_DIR)
+
+from schema_catalog import SchemaCatalog
+
+CHINOOK_DB = os.path.join(APP_DIR, 'chinook-database', 'ChinookDatabase', 'DataSources', 'Chinook_Sqlite.sqlite')
+DEMO_DB = os.path.join(APP_DIR, 'demo.db')
+
+# Read-only questions; {table}, {column}, {value} and {number} are filled in
+READ_TEMPLATES = [
+    'Show all {table}',
+    'List every {table}',
+    'Show {column} of {table}',
+    'Find {table} with {column} greater than {number}',
+    'Get {table} where {column} is less than {number}',
+    'List {table} with {column} at least {number}',
+    'Show {table} where {column} is {value}',
+    'Find {table} whose {column} contains {value}',
+    'Which {table} have {column} equal to {value}',
+    'Show {column} and {column2} of {table}',
+    'List {table} and {table2}',
+    'Show {table} with {column} over {number} created after 2021-0{month}-01',
+]
+
+# Write questions; only used for translation benchmarks, never executed
+WRITE_TEMPLATES = [
+    'Delete {table} where {column} is {value}',
+    'Update {table} set {column} to {value}',
+    'Add a new {table}',
+]
+
+
+def load_schema(database):
+    """Return (db_schema, sampled text values per (table, column))"""
+    catalog = SchemaCatalog(database)
+    catalog.refresh()
+    db_schema = catalog.as_db_schema()
+    values = {}
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+    try:
+        for table, info in catalog.tables.items():
+            for column in info['columns']:
+                if 'CHAR' not in column['type'] and 'TEXT' not in column['type']:
+                    continue
+                rows = conn.execute(f'SELECT DISTINCT "{column["name"]}" FROM "{table}" '
+                                    f'WHERE "{column["name"]}" IS NOT NULL LIMIT 50').fetchall()
+                if rows:
+                    values[(table, column['name'])] = [row[0] for row in rows]
+    finally:
+        conn.close()
+    return db_schema, values
+
+
+def make_questions(database, name, n, seed=7, write_ratio=0.1):
+    """
+    Generate n questions over one database
+
+    Returns:
+        list: {'schema': name, 'question': str, 'kind': 'read' | 'write'}
+    """
+    rng = random.Random(f'{seed}:{name}')
+    db_schema, values = load_schema(database)
+    tables = sorted(db_schema)
+    questions = []
+    for _ in range(n):
+        table, table2 = rng.sample(tables, 2) if len(tables) > 1 else (tables[0], tables[0])
+        columns = db_schema[table]
+        column = rng.choice(columns)
+        column2 = rng.choice(columns)
+        text_columns = [c for c in columns if (table, c) in values]
+        value_column = rng.choice(text_columns) if text_columns else column
+        value = rng.choice(values.get((table, value_column), ['x']))
+        kind = 'write' if rng.random() < write_ratio else 'read'
+        template = rng.choice(WRITE_TEMPLATES if kind == 'write' else READ_TEMPLATES)
+        if '{value}' in template:
+            column = value_column
+        questions.append({
+            'schema': name,
+            'kind': kind,
+            'question': template.format(table=table, table2=table2, column=column, column2=column2,
+                                        value=value, number=rng.randint(1, 100000),
+                                        month=rng.randint(1, 9)),
+        })
+    return questions
+
+
+def build_corpus(n=3000, seed=7, databases=None):
+    """
+    Generate a corpus split evenly between the databases
+
+    Args:
+        n (int): Total number of questions
+        seed (int): Random seed
+        databases (dict): name -> database path; Chinook and demo by default
+    """
+    if databases is None:
+        databases = {'chinook': CHINOOK_DB, 'demo': DEMO_DB}
+    databases = {name: path for name, path in databases.items() if os.path.exists(path)}
+    corpus = []
+    for name, path in sorted(databases.items()):
+        corpus.extend(make_questions(path, name, n // len(databases), seed))
+    return corpus
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    corpus = build_corpus(n)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as f:
+            json.dump(corpus, f, indent=1)
+        print(f'Wrote {len(corpus)} questions to {sys.argv[2]}')
+    else:
+        for item in corpus[:20]:
+            print(f"{item['schema']:<8} {item['kind']:<6} {item['question']}")
+        print(f'... {len(corpus)} questions')
@@ -0,0 +1,341 @@
+"""
+Benchmark suite for the translator and the /query endpoint
+
+Runs, on a reproducible question corpus (see corpus.py):
+
+- microbenchmarks of each NaturalLanguageToSQL method, per schema
+- an end-to-end load test of POST /query through Flask's test client,
+  against the demo database and Chinook inflated by each --scales factor
+  (see scale_chinook.py), reporting throughput, tail latency and peak RSS
+
+Results are written as JSON; --compare reports the change against an
+earlier results file and exits with status 1 on regressions.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--corpus-size 3000] [--scales 1,10,100]
+        [--requests 2000] [--concurrency 4] [--output results.json]
+        [--compare baseline.json] [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import build_corpus, load_schema, CHINOOK_DB, DEMO_DB
+from scale_chinook import scale_chinook
+
+
+def latency_summary(samples_ns):
+    """Summarize per-call latencies given in nanoseconds, in microseconds"""
+    if not samples_ns:
+        return {'count': 0}
+    samples = sorted(samples_ns)
+    count = len(samples)
+
+    def pct(q):
+        return samples[min(count - 1, int(q * count))] / 1000
+
+    total = sum(samples)
+    return {
+        'count': count,
+        'mean_us': total / count / 1000,
+        'p50_us': pct(0.50),
+        'p95_us': pct(0.95),
+        'p99_us': pct(0.99),
+        'max_us': samples[-1] / 1000,
+        'ops_per_sec': count / (total / 1e9) if total else None,
+    }
+
+
+def time_calls(fn, inputs, repeat):
+    clock = time.perf_counter_ns
+    samples = []
+    for _ in range(repeat):
+        for args in inputs:
+            start = clock()
+            fn(*args)
+            samples.append(clock() - start)
+    return latency_summary(samples)
+
+
+def run_micro(corpus, repeat):
+    """Time every NaturalLanguageToSQL method on each schema's questions"""
+    from natural_language_to_sql import NaturalLanguageToSQL
+
+    results = {}
+    for schema_name, database in (('chinook', CHINOOK_DB), ('demo', DEMO_DB)):
+        questions = [item['question'] for item in corpus if item['schema'] == schema_name]
+        if not questions:
+            continue
+        db_schema, _ = load_schema(database)
+        nl = NaturalLanguageToSQL(db_schema, translation_cache=False)
+
+        # Inputs of each stage, computed once so stages are timed in isolation
+        normalized = [nl.normalize_query(q) for q in questions]
+        preprocessed = [nl.preprocess_query(q) for q in normalized]
+        query_types = [nl.detect_query_type(tokens) for _, tokens in preprocessed]
+        entities = [nl.identify_entities(query) for query, _ in preprocessed]
+        translations = [nl.rule_based_sql_generation(query, found, query_type)
+                for (query, _), found, query_type in zip(preprocessed, entities, query_types)]
+
+        methods = {
+            'normalize_query': (nl.normalize_query, [(q,) for q in questions]),
+            'preprocess_query': (nl.preprocess_query, [(q,) for q in normalized]),
+            'detect_query_type': (nl.detect_query_type, [(tokens,) for _, tokens in preprocessed]),
+            'identify_entities': (nl.identify_entities, [(query,) for query, _ in preprocessed]),
+            'extract_date_conditions': (nl.extract_date_conditions, [(query,) for query, _ in preprocessed]),
+            'rule_based_sql_generation': (nl.rule_based_sql_generation,
+                                          [(query, found, query_type) for (query, _), found, query_type
+                                           in zip(preprocessed, entities, query_types)]),
+            'generate_sql': (nl.generate_sql, [(q,) for q in questions]),
+        }
+        schema_results = {name: time_calls(fn, inputs, repeat) for name, (fn, inputs) in methods.items()}
+
+        cached = NaturalLanguageToSQL(db_schema)
+        for q in questions:
+            cached.generate_sql(q)
+        schema_results['generate_sql_cached'] = time_calls(cached.generate_sql, [(q,) for q in questions], repeat)
+
+        # Read-only statements only, so the database is left untouched
+        conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        items = [item for item in corpus if item['schema'] == schema_name]
+        reads = [(sql, conn, params) for (sql, params), item in zip(translations, items)
+                 if item['kind'] == 'read' and sql.lstrip().upper().startswith('SELECT')]
+        schema_results['execute_query'] = time_calls(nl.execute_query, reads[:500], 1)
+        conn.close()
+
+        results[schema_name] = schema_results
+        for name, summary in schema_results.items():
+            print(f"  micro {schema_name:<8} {name:<26} p50 {summary['p50_us']:9.1f} us  "
+                  f"p99 {summary['p99_us']:9.1f} us  ({summary['count']} calls)")
+    return results
+
+
+def e2e_worker(args):
+    """Load-test /query in this process (DB_PATH is set by the parent)"""
+    import resource
+    import app as app_module
+
+    # Wait for the real schema instead of the background refresh
+    app_module.schema_catalog.refresh()
+    app_module.nl_to_sql.set_catalog(app_module.schema_catalog)
+
+    with open(args.corpus) as f:
+        questions = [item['question'] for item in json.load(f)]
+    rng = random.Random(args.seed)
+    plan = [rng.choice(questions) for _ in range(args.requests)]
+
+    latencies = []
+    errors = [0]
+    response_bytes = [0]
+    lock = threading.Lock()
+
+    def run(chunk):
+        client = app_module.app.test_client()
+        local = []
+        failed = 0
+        size = 0
+        for question in chunk:
+            start = time.perf_counter_ns()
+            response = client.post('/query', json={'query': question})
+            body = response.get_data()
+            local.append(time.perf_counter_ns() - start)
+            size += len(body)
+            if response.status_code != 200 or b'"error"' in body:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+            response_bytes[0] += size
+
+    threads = [threading.Thread(target=run, args=(plan[i::args.concurrency],))
+               for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+    print(json.dumps({
+        'requests': len(plan),
+        'concurrency': args.concurrency,
+        'seconds': elapsed,
+        'throughput_rps': len(plan) / elapsed,
+        'errors': errors[0],
+        'response_mb': response_bytes[0] / 1e6,
+        'peak_rss_mb': peak_rss_mb,
+        'latency': latency_summary(latencies),
+    }))
+
+
+def run_e2e(corpus, args, workdir):
+    """Run one e2e worker process per database and scale factor"""
+    targets = [('demo', 1, DEMO_DB)]
+    for factor in args.scales:
+        targets.append(('chinook', factor, scale_chinook(factor, os.path.join(args.data_dir,
+                                                                             f'chinook_x{factor}.sqlite'))))
+
+    results = []
+    for schema_name, factor, database in targets:
+        if not os.path.exists(database):
+            continue
+        # Work on a copy so snapshots and write questions never touch the source
+        db_path = os.path.join(workdir, f'{schema_name}_x{factor}.sqlite')
+        shutil.copyfile(database, db_path)
+        corpus_path = os.path.join(workdir, f'{schema_name}.json')
+        with open(corpus_path, 'w') as f:
+            json.dump([item for item in corpus if item['schema'] == schema_name and item['kind'] == 'read'], f)
+
+        env = dict(os.environ, DB_PATH=db_path, SCHEMA_SNAPSHOT_PATH=db_path + '.schema.json')
+        if not args.result_cache:
+            env['RESULT_CACHE_MAX_BYTES'] = '0'
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--e2e-worker', '--corpus', corpus_path,
+             '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+             '--seed', str(args.seed)],
+            cwd=APP_DIR, env=env, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(output.stderr, file=sys.stderr)
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        result.update({'schema': schema_name, 'scale': factor})
+        results.append(result)
+        print(f"  e2e   {schema_name:<8} x{factor:<5} {result['throughput_rps']:8.1f} req/s  "
+              f"p50 {result['latency']['p50_us'] / 1000:8.2f} ms  p99 {result['latency']['p99_us'] / 1000:8.2f} ms  "
+              f"rss {result['peak_rss_mb']:7.1f} MB  errors {result['errors']}")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """
+    Print the change of each metric against a baseline results file
+
+    Returns:
+        list: Descriptions of metrics that regressed by more than tolerance
+    """
+    regressions = []
+
+    def check(name, new, old, higher_is_better):
+        if not old or new is None:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        print(f'  {name:<58} {old:12.2f} -> {new:12.2f}  ({change:+.1%}){flag}')
+        if flag:
+            regressions.append(name)
+
+    for schema_name, methods in current.get('micro', {}).items():
+        for method, summary in methods.items():
+            old = baseline.get('micro', {}).get(schema_name, {}).get(method)
+            if old:
+                check(f'micro {schema_name} {method} p50_us', summary.get('p50_us'), old.get('p50_us'), False)
+
+    old_e2e = {(r['schema'], r['scale']): r for r in baseline.get('e2e', [])}
+    for result in current.get('e2e', []):
+        old = old_e2e.get((result['schema'], result['scale']))
+        if old:
+            label = f"e2e {result['schema']} x{result['scale']}"
+            check(f'{label} throughput_rps', result['throughput_rps'], old['throughput_rps'], True)
+            check(f'{label} p99_us', result['latency']['p99_us'], old['latency']['p99_us'], False)
+            check(f'{label} peak_rss_mb', result['peak_rss_mb'], old['peak_rss_mb'], False)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus-size', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the corpus per microbenchmark')
+    parser.add_argument('--scales', default='1,10,100',
+                        help='comma-separated Chinook scale factors for the e2e test, e.g. 1,10,100,1000')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per e2e target')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads in the e2e test')
+    parser.add_argument('--result-cache', action='store_true',
+                        help='keep the result cache on (off by default to measure execution)')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-e2e', action='store_true')
+    parser.add_argument('--data-dir', default=os.path.join(BENCH_DIR, 'data'),
+                        help='where scaled Chinook databases are kept between runs')
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results.json'))
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--e2e-worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--corpus', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.scales = [int(factor) for factor in args.scales.split(',') if factor]
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.e2e_worker:
+        e2e_worker(args)
+        return 0
+
+    corpus = build_corpus(args.corpus_size, args.seed)
+    print(f'Corpus: {len(corpus)} questions')
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items()
+                     if key not in ('e2e_worker', 'corpus', 'compare', 'output')},
+        },
+    }
+    if not args.skip_micro:
+        results['micro'] = run_micro(corpus, args.repeat)
+    if not args.skip_e2e:
+        workdir = tempfile.mkdtemp(prefix='nl2sql-bench-')
+        try:
+            results['e2e'] = run_e2e(corpus, args, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f'Compared with {args.compare}:')
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) above {args.tolerance:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Inflate the Chinook database by a factor (10x, 100x, 1000x)
+
+Every table is copied factor - 1 times. In copy k, integer primary keys
+and the foreign keys pointing at them are shifted by k times the largest
+key of the referenced table, so joins inside a copy stay intact and the
+copies never collide.
+
+Usage:
+    python benchmarks/scale_chinook.py factor [output.sqlite]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, APP_DIR)
+
+from schema_catalog import SchemaCatalog
+
+CHINOOK_DB = os.path.join(APP_DIR, 'chinook-database', 'ChinookDatabase', 'DataSources', 'Chinook_Sqlite.sqlite')
+
+
+def scaled_path(factor, directory=None):
+    return os.path.join(directory or os.path.join(APP_DIR, 'benchmarks', 'data'), f'chinook_x{factor}.sqlite')
+
+
+def scale_chinook(factor, output=None, source=CHINOOK_DB):
+    """
+    Write a copy of Chinook with every table inflated factor times
+
+    An existing output file is reused, so scaled databases are built once.
+
+    Returns:
+        str: Path of the scaled database
+    """
+    output = output or scaled_path(factor)
+    if os.path.exists(output):
+        return output
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_output = output + '.tmp'
+    shutil.copyfile(source, tmp_output)
+    if factor <= 1:
+        os.replace(tmp_output, output)
+        return output
+
+    catalog = SchemaCatalog(tmp_output)
+    catalog.refresh()
+
+    conn = sqlite3.connect(tmp_output)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA foreign_keys = OFF')
+
+    # Offset added per copy to the keys of each table
+    key_offsets = {}
+    original_rows = {}
+    for table, info in catalog.tables.items():
+        original_rows[table] = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+        primary_keys = [column['name'] for column in info['columns'] if column['pk']]
+        if len(primary_keys) == 1:
+            key_offsets[table] = conn.execute(f'SELECT MAX("{primary_keys[0]}") FROM "{table}"').fetchone()[0] or 0
+
+    start = time.perf_counter()
+    for table, info in catalog.tables.items():
+        shifts = {}
+        for column in info['columns']:
+            if column['pk'] and table in key_offsets and 'INT' in column['type']:
+                shifts[column['name']] = key_offsets[table]
+        for fk in info['foreign_keys']:
+            if fk['ref_table'] in key_offsets:
+                shifts[fk['column']] = key_offsets[fk['ref_table']]
+
+        columns = [column['name'] for column in info['columns']]
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        with conn:
+            for copy in range(1, factor):
+                select_list = ', '.join(
+                    f'"{column}" + {shifts[column] * copy}' if column in shifts else f'"{column}"'
+                    for column in columns)
+                conn.execute(f'INSERT INTO "{table}" ({column_list}) '
+                             f'SELECT {select_list} FROM "{table}" WHERE rowid <= {original_rows[table]}')
+    conn.execute('ANALYZE')
+    conn.close()
+    os.replace(tmp_output, output)
+    print(f'Built {output} (x{factor}) in {time.perf_counter() - start:.1f}s')
+    return output
+
+
+if __name__ == '__main__':
+    factor = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    path = scale_chinook(factor, sys.argv[2] if len(sys.argv) > 2 else None)
+    conn = sqlite3.connect(path)
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                 "AND name NOT LIKE 'sqlite_%' ORDER BY name"):
+        print(f'{table:<16} {conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]:>12,} rows')
+    print(f'{os.path.getsize(path) / 1e6:.1f} MB')
@@ -0,0 +1,632 @@
+"""
+Bulk loading of JSON and SQL dump files into sqlite
+
+Seeds databases for tests and load tests (ChinookData.json, the
+Chinook_Sqlite.sql script, ``sqlite3 .dump`` / ``iterdump`` output, or
+scaled-up versions of them) much faster than running them statement by
+statement, with memory that stays constant however large the input is:
+
+- Inputs are read in chunks and never held whole. JSON rows are
+  decoded in runs of up to a chunk at a time; a multi-row
+  ``INSERT ... VALUES (...), (...)`` is streamed tuple by tuple and
+  re-batched into statements of about batch_bytes, so sqlite still
+  parses the literals itself.
+- Rows go in through large transactions (commit every transaction_rows)
+  with WAL journaling and ``synchronous=OFF`` during the load; the
+  previous journal mode and synchronous setting are restored afterwards.
+- Secondary indexes and triggers are created once the data is in: those
+  in the dump are deferred, existing ones on loaded tables are dropped
+  and rebuilt. An abandoned or failed load recreates the ones it dropped
+  and restores the journal mode.
+
+JSON inputs are an object of ``{"Table": [row, ...], ...}`` with rows as
+objects (or arrays in table column order). Missing tables are created
+from the first row's keys, unless a schema script creates them first.
+
+Usage:
+    python bulk_loader.py database input [--schema schema.sql] [--format json|sql]
+        [--transaction-rows 200000] [--batch-bytes 1048576] [--analyze]
+
+Inputs ending in .gz are decompressed on the fly.
+"""
+import argparse
+import gzip
+import json
+import re
+import sqlite3
+import time
+
+# Leading whitespace and comments between statements
+SPACE_PATTERN = re.compile(r'(?:\s+|--[^\n]*\n|/\*.*?\*/)*', re.DOTALL)
+# Start of a multi-row insert: INSERT INTO [t] ([a], [b]) VALUES
+INSERT_HEAD_PATTERN = re.compile(
+    r'INSERT\s+(?:OR\s+\w+\s+)?INTO\s+((?:\[[^\]]+\]|"(?:[^"]|"")+"|`[^`]+`|[\w.]+))\s*'
+    r'(\([^()]*\))?\s*VALUES\s*', re.IGNORECASE)
+# One parenthesized row of literals; strings may contain anything, ''
+# escaping a quote
+TUPLE_PATTERN = re.compile(r"\s*(\([^()']*(?:'[^']*(?:''[^']*)*'[^()']*)*\))")
+# A run of rows each followed by a comma, matched in one call
+ROWS_PATTERN = re.compile(r"(?:\s*\([^()']*(?:'[^']*(?:''[^']*)*'[^()']*)*\)\s*,)*")
+ROW_SEPARATOR_PATTERN = re.compile(r'\s*([,;])')
+# What the buffer may end with while a row is still being read
+PARTIAL_ROW_PATTERN = re.compile(r"\s*(?:\([^()']*(?:'[^']*(?:''[^']*)*'[^()']*)*(?:'[^']*(?:''[^']*)*)?)?\Z")
+TRAILING_SPACE_PATTERN = re.compile(r'\s*\Z')
+DEFERRED_PATTERN = re.compile(r'CREATE\s+(?:UNIQUE\s+)?(?:INDEX|TRIGGER|TEMP\s+TRIGGER|TEMPORARY\s+TRIGGER)\b',
+                              re.IGNORECASE)
+# Transaction control in dumps; the loader runs its own transactions
+TRANSACTION_PATTERN = re.compile(r'(?:BEGIN|COMMIT|END|ROLLBACK)\b', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s*')
+
+
+class _Reader:
+    """A text stream read in chunks, with a cursor over the unread part"""
+
+    def __init__(self, stream, chunk_size=1024 * 1024, max_item=64 * 1024 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        # Largest single row or statement accepted
+        self.max_item = max_item
+        self.text = ''
+        self.pos = 0
+        # An earlier position to keep in the buffer, if any
+        self.mark = None
+        self.eof = False
+
+    def fill(self, minimum=1):
+        """Read until at least minimum characters are unread (or EOF); returns False at EOF"""
+        # Drop what was consumed; positions move with the text
+        cut = self.pos if self.mark is None else min(self.pos, self.mark)
+        if cut > self.chunk_size:
+            self.text = self.text[cut:]
+            self.pos -= cut
+            if self.mark is not None:
+                self.mark -= cut
+        grew = False
+        while len(self.text) - self.pos < minimum and not self.eof:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                break
+            self.text += chunk
+            grew = True
+        return grew or len(self.text) - self.pos >= minimum
+
+    def more(self):
+        """Read one more chunk; raises when an item outgrows max_item"""
+        if len(self.text) - self.pos > self.max_item:
+            raise ValueError(f'Input item larger than {self.max_item} characters near: '
+                             f'{self.text[self.pos:self.pos + 80]!r}')
+        return self.fill(len(self.text) - self.pos + 1)
+
+    def skip(self, pattern=SPACE_PATTERN):
+        while True:
+            match = pattern.match(self.text, self.pos)
+            self.pos = match.end()
+            if self.pos < len(self.text) or not self.fill():
+                return
+
+    def peek(self):
+        if self.pos >= len(self.text) and not self.fill():
+            return ''
+        return self.text[self.pos]
+
+    def expect(self, characters):
+        self.skip(WHITESPACE_PATTERN)
+        char = self.peek()
+        if not char or char not in characters:
+            raise ValueError(f'Expected one of {characters!r} near: {self.text[self.pos:self.pos + 80]!r}')
+        self.pos += 1
+        return char
+
+
+def iter_json_rows(stream, chunk_size=1024 * 1024, min_run=4096):
+    """
+    Yield (table, row) from a ``{"Table": [row, ...], ...}`` document
+
+    Memory is bounded by the chunk size and the largest row rather than
+    the document. Rows are decoded in runs: the buffered text up to the
+    last "}," (or "]," for array rows) before any other ']' is decoded as
+    one array, which only succeeds when that comma separates rows (cut
+    inside a string or a nested value, the text does not parse). Failed
+    runs halve the window down to min_run characters, below which rows
+    are decoded one by one.
+    """
+    decoder = json.JSONDecoder()
+    reader = _Reader(stream, chunk_size)
+    window = chunk_size
+
+    def decode_run():
+        nonlocal window
+        if window < min_run:
+            window = min(window * 2, chunk_size)
+            return None
+        reader.skip(WHITESPACE_PATTERN)
+        reader.fill(window)
+        start = reader.pos
+        limit = min(len(reader.text), start + window)
+        if reader.text[start:start + 1] == '{':
+            close = reader.text.find(']', start, limit)
+            cut = reader.text.rfind('},', start, limit if close < 0 else close) + 1
+        else:
+            # Array rows end in ']' themselves: the end of the table's
+            # array is only found by a failed decode
+            cut = reader.text.rfind('],', start, limit) + 1
+        if cut <= start:
+            return None
+        try:
+            rows = json.loads('[' + reader.text[start:cut] + ']')
+        except json.JSONDecodeError:
+            window //= 2
+            return None
+        window = min(window * 2, chunk_size)
+        reader.pos = cut
+        return rows
+
+    def decode():
+        reader.skip(WHITESPACE_PATTERN)
+        while True:
+            try:
+                value, end = decoder.raw_decode(reader.text, reader.pos)
+            except json.JSONDecodeError:
+                # Most likely cut at the end of the buffer
+                if not reader.more():
+                    raise
+                continue
+            reader.pos = end
+            return value
+
+    reader.expect('{')
+    reader.skip(WHITESPACE_PATTERN)
+    if reader.peek() == '}':
+        return
+    while True:
+        table = decode()
+        reader.expect(':')
+        reader.expect('[')
+        reader.skip(WHITESPACE_PATTERN)
+        if reader.peek() == ']':
+            reader.pos += 1
+        else:
+            while True:
+                rows = decode_run()
+                if rows is None:
+                    yield table, decode()
+                else:
+                    for row in rows:
+                        yield table, row
+                if reader.expect(',]') == ']':
+                    break
+        if reader.expect(',}') == '}':
+            return
+
+
+def iter_sql_dump(stream, batch_bytes=1024 * 1024, chunk_size=1024 * 1024):
+    """
+    Split a SQL script into statements, streaming the rows of inserts
+
+    Yields:
+        tuple: ('sql', statement) for each statement other than a
+            multi-row insert of plain literals, and ('rows', target,
+            [rows, ...]) batches of about batch_bytes for those, each
+            item being one or more comma-separated row literals and
+            target "table (columns)" as written in the dump
+    """
+    reader = _Reader(stream, chunk_size)
+    while True:
+        reader.skip()
+        reader.fill(64 * 1024)
+        if reader.pos >= len(reader.text):
+            return
+        head = INSERT_HEAD_PATTERN.match(reader.text, reader.pos)
+        if head is not None:
+            reader.mark = reader.pos
+            target = head.group(1) + (' ' + head.group(2) if head.group(2) else '')
+            reader.pos = head.end()
+            batch, size, streamed = [], 0, False
+            while True:
+                # Most rows go by in runs, as many as fit in batch_bytes
+                reader.fill(batch_bytes)
+                rows = ROWS_PATTERN.match(reader.text, reader.pos, reader.pos + batch_bytes)
+                if rows.end() > reader.pos:
+                    batch.append(reader.text[reader.pos:rows.end()].rstrip()[:-1])
+                    size += rows.end() - reader.pos
+                    reader.pos = rows.end()
+                    if size >= batch_bytes:
+                        streamed = True
+                        reader.mark = None
+                        yield 'rows', target, batch
+                        batch, size = [], 0
+                    continue
+
+                # The last row, or one cut by the end of the window
+                row = TUPLE_PATTERN.match(reader.text, reader.pos)
+                end = None
+                if row is not None:
+                    separator = ROW_SEPARATOR_PATTERN.match(reader.text, row.end())
+                    if separator is not None:
+                        end, last = separator.end(), separator.group(1) == ';'
+                    elif TRAILING_SPACE_PATTERN.match(reader.text, row.end()):
+                        if reader.more():
+                            continue
+                        # The script ends without a ';'
+                        end, last = len(reader.text), True
+                elif PARTIAL_ROW_PATTERN.match(reader.text, reader.pos) and reader.more():
+                    # Cut short by the end of the buffer
+                    continue
+                if end is None:
+                    if not streamed:
+                        # Not plain literals (e.g. function calls, ON
+                        # CONFLICT): run the statement as it is
+                        reader.pos = reader.mark
+                        reader.mark = None
+                        break
+                    raise ValueError(f'Unsupported row in INSERT INTO {target} near: '
+                                     f'{reader.text[reader.pos:reader.pos + 80]!r}')
+                reader.pos = end
+                batch.append(row.group(1))
+                size += len(row.group(1))
+                if last or size >= batch_bytes:
+                    streamed = True
+                    reader.mark = None
+                    yield 'rows', target, batch
+                    batch, size = [], 0
+                    if last:
+                        break
+            if streamed:
+                continue
+
+        # Any other statement, up to the ';' that completes it; searched
+        # counts the characters known not to hold it
+        searched = 0
+        while True:
+            end = reader.text.find(';', reader.pos + searched)
+            if end < 0:
+                if reader.more():
+                    continue
+                statement = reader.text[reader.pos:].strip()
+                reader.pos = len(reader.text)
+                if statement:
+                    yield 'sql', statement
+                return
+            statement = reader.text[reader.pos:end + 1]
+            if sqlite3.complete_statement(statement):
+                yield 'sql', statement
+                reader.pos = end + 1
+                break
+            searched = end + 1 - reader.pos
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8-sig')
+    return open(path, encoding='utf-8-sig')
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class BulkLoader:
+    """
+    Loads dump files into one sqlite database
+
+    Use as a context manager, or call finish() (close() to abandon the
+    load): tuned pragmas apply from construction, and deferred indexes and
+    triggers are only created by finish().
+    """
+
+    def __init__(self, database, transaction_rows=200000, batch_bytes=1024 * 1024,
+                 cache_size_kib=64 * 1024, analyze=False):
+        """
+        Args:
+            database (str): Path of the sqlite database (created if missing)
+            transaction_rows (int): Rows per committed transaction
+            batch_bytes (int): Approximate size of each multi-row INSERT
+                built from a SQL dump
+            cache_size_kib (int): Page cache used for the load and the index
+                builds
+            analyze (bool): Run ANALYZE once loaded, for the planner and the
+                query governor's cost estimates
+        """
+        self.database = database
+        self.transaction_rows = transaction_rows
+        self.batch_bytes = batch_bytes
+        self.analyze = analyze
+
+        # Every batch is a new statement text; caching them would keep each
+        # one's compiled program alive
+        self.conn = sqlite3.connect(database, isolation_level=None, cached_statements=0)
+        self._journal_mode = self.conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self._synchronous = self.conn.execute('PRAGMA synchronous').fetchone()[0]
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute(f'PRAGMA cache_size = -{int(cache_size_kib)}')
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+        self.conn.execute('PRAGMA foreign_keys = OFF')
+
+        # Index and trigger DDL run by finish(), in order; those dropped from
+        # the existing schema are put back by close() too
+        self._deferred = []
+        self._dropped = set()
+        self._prepared_tables = set()
+        self._pending = 0
+        self.rows = {}
+        self.seconds = {}
+        self.index_seconds = 0.0
+        self._start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.close()
+
+    def _begin(self):
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN')
+
+    def _count(self, table, rows, seconds):
+        self.rows[table] = self.rows.get(table, 0) + rows
+        self.seconds[table] = self.seconds.get(table, 0.0) + seconds
+        self._pending += rows
+        if self._pending >= self.transaction_rows:
+            self.conn.execute('COMMIT')
+            self._pending = 0
+
+    def _execute_ddl(self, statement):
+        if self.conn.in_transaction:
+            self.conn.execute('COMMIT')
+            self._pending = 0
+        self.conn.execute(statement)
+
+    def _prepare_table(self, table):
+        """Move the indexes and triggers of a table about to be loaded to the deferred list"""
+        key = table.strip('[]"`').lower()
+        if key in self._prepared_tables:
+            return
+        self._prepared_tables.add(key)
+        # Automatic indexes (PRIMARY KEY, UNIQUE) have no SQL and stay
+        existing = self.conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') "
+            "AND lower(tbl_name) = ? AND sql IS NOT NULL", (key,)).fetchall()
+        for kind, name, sql in existing:
+            self._execute_ddl(f'DROP {kind.upper()} {_quote(name)}')
+            self._deferred.append(sql)
+            self._dropped.add(sql)
+
+    def load_sql(self, path, schema_only=False):
+        """
+        Run a SQL script, streaming its inserts
+
+        Args:
+            path (str): The script (.sql or .sql.gz)
+            schema_only (bool): Skip INSERT statements (e.g. to take the
+                tables of a script whose data comes from elsewhere)
+        """
+        # Rows of consecutive inserts into one table (one-row-per-statement
+        # dumps) are sent together
+        pending = {'target': None, 'rows': [], 'size': 0}
+
+        def flush():
+            if pending['rows']:
+                table = pending['target'].split('(')[0].strip()
+                self._prepare_table(table)
+                start = time.perf_counter()
+                self._begin()
+                cursor = self.conn.execute(f"INSERT INTO {pending['target']} VALUES " + ','.join(pending['rows']))
+                self._count(table.strip('[]"`'), cursor.rowcount, time.perf_counter() - start)
+            pending.update(rows=[], size=0)
+
+        with _open(path) as stream:
+            for kind, *item in iter_sql_dump(stream, self.batch_bytes):
+                if kind == 'rows':
+                    if schema_only:
+                        continue
+                    target, batch = item
+                    if target != pending['target']:
+                        flush()
+                        pending['target'] = target
+                    pending['rows'].extend(batch)
+                    pending['size'] += sum(map(len, batch))
+                    if pending['size'] >= self.batch_bytes:
+                        flush()
+                    continue
+                flush()
+                statement = item[0]
+                body = SPACE_PATTERN.sub('', statement, count=1)
+                if TRANSACTION_PATTERN.match(body):
+                    continue
+                if DEFERRED_PATTERN.match(body):
+                    self._deferred.append(statement)
+                elif body[:6].upper() == 'INSERT':
+                    if not schema_only:
+                        # A single statement the row streamer can't split
+                        self._begin()
+                        self.conn.execute(statement)
+                else:
+                    self._execute_ddl(statement)
+            flush()
+
+    def load_json(self, path, batch_rows=10000):
+        """
+        Insert the rows of a ``{"Table": [row, ...]}`` document
+
+        Args:
+            path (str): The document (.json or .json.gz)
+            batch_rows (int): Rows per executemany call
+        """
+        table, statement, columns, batch = None, None, None, []
+
+        def flush():
+            if batch:
+                start = time.perf_counter()
+                self._begin()
+                self.conn.executemany(statement, batch)
+                self._count(table, len(batch), time.perf_counter() - start)
+                batch.clear()
+
+        with _open(path) as stream:
+            for row_table, row in iter_json_rows(stream):
+                if row_table != table:
+                    flush()
+                    table = row_table
+                    columns = self._json_columns(table, row)
+                    known = set(columns)
+                    self._prepare_table(table)
+                    statement = (f'INSERT INTO {_quote(table)} ({", ".join(map(_quote, columns))}) '
+                                 f'VALUES ({", ".join("?" * len(columns))})')
+                if isinstance(row, dict):
+                    if not row.keys() <= known:
+                        raise ValueError(f'Row of {table} with unexpected keys: {sorted(set(row) - set(columns))}')
+                    batch.append(tuple(map(row.get, columns)))
+                else:
+                    batch.append(row)
+                if len(batch) >= batch_rows:
+                    flush()
+            flush()
+
+    def _json_columns(self, table, first_row):
+        """Columns to insert for a JSON table, creating the table if needed"""
+        existing = [row[1] for row in self.conn.execute(f'PRAGMA table_info({_quote(table)})')]
+        if isinstance(first_row, dict):
+            if not existing:
+                self._execute_ddl(f'CREATE TABLE {_quote(table)} ({", ".join(map(_quote, first_row))})')
+            return list(first_row)
+        if not existing:
+            raise ValueError(f'Rows of {table} are arrays but the table does not exist')
+        return existing[:len(first_row)]
+
+    def finish(self):
+        """
+        Commit, build the deferred indexes and triggers, and restore the
+        journal mode
+
+        If a deferred statement fails (e.g. a UNIQUE index over duplicate
+        rows), the load is closed as by close() and the error raised.
+
+        Returns:
+            dict: The load report (see report())
+        """
+        try:
+            if self.conn.in_transaction:
+                self.conn.execute('COMMIT')
+            start = time.perf_counter()
+            while self._deferred:
+                self.conn.execute(self._deferred[0])
+                self._deferred.pop(0)
+            if self.analyze:
+                self.conn.execute('ANALYZE')
+            self.index_seconds = time.perf_counter() - start
+        except Exception:
+            self.close()
+            raise
+        self._restore()
+        return self.report()
+
+    def close(self):
+        """
+        Abandon the load: roll back the open transaction, recreate the
+        indexes and triggers dropped from existing tables, restore the
+        journal mode and close
+
+        Rows of transactions committed before stay. A dropped index that
+        cannot be recreated over them (a UNIQUE one over duplicates) is
+        reported after the others are back.
+
+        Raises:
+            sqlite3.Error: If dropped indexes or triggers could not be
+                recreated
+        """
+        if self.conn.in_transaction:
+            self.conn.execute('ROLLBACK')
+        failed = []
+        for statement in self._deferred:
+            if statement in self._dropped:
+                try:
+                    self.conn.execute(statement)
+                except sqlite3.Error as e:
+                    failed.append(f'{statement.strip()} ({e})')
+        self._deferred = []
+        self._restore()
+        if failed:
+            raise sqlite3.IntegrityError('Could not recreate: ' + '; '.join(failed))
+
+    def _restore(self):
+        """Put back the journal mode and synchronous setting, and close"""
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        if self._journal_mode.lower() != 'wal':
+            self.conn.execute(f'PRAGMA journal_mode = {self._journal_mode}')
+        self.conn.execute(f'PRAGMA synchronous = {int(self._synchronous)}')
+        self.conn.close()
+
+    def report(self):
+        """
+        Returns:
+            dict: Rows and rows per second, per table and in total
+        """
+        elapsed = time.perf_counter() - self._start
+        total = sum(self.rows.values())
+        return {
+            'tables': {table: {'rows': rows,
+                               'rows_per_second': rows / self.seconds[table] if self.seconds[table] else 0.0}
+                       for table, rows in self.rows.items()},
+            'rows': total,
+            'seconds': elapsed,
+            'rows_per_second': total / elapsed if elapsed else 0.0,
+            'index_seconds': self.index_seconds,
+        }
+
+
+def bulk_load(database, path, schema=None, data_format=None, **options):
+    """
+    Load a JSON or SQL dump file into a database
+
+    Args:
+        database (str): Target sqlite database
+        path (str): ChinookData.json-style JSON, or a SQL script; either may
+            be gzipped
+        schema (str): SQL script run first for its DDL only (its inserts
+            are skipped), e.g. the tables for a JSON document
+        data_format (str): 'json' or 'sql'; guessed from the file name
+        options: Passed to BulkLoader
+
+    Returns:
+        dict: See BulkLoader.report
+    """
+    if data_format is None:
+        data_format = 'json' if path.lower().removesuffix('.gz').endswith('.json') else 'sql'
+    with BulkLoader(database, **options) as loader:
+        if schema:
+            loader.load_sql(schema, schema_only=True)
+        if data_format == 'json':
+            loader.load_json(path)
+        else:
+            loader.load_sql(path)
+    return loader.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('database')
+    parser.add_argument('input')
+    parser.add_argument('--schema', help='SQL script whose DDL is run first')
+    parser.add_argument('--format', choices=('json', 'sql'), dest='data_format')
+    parser.add_argument('--transaction-rows', type=int, default=200000)
+    parser.add_argument('--batch-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--analyze', action='store_true', help='run ANALYZE once loaded')
+    args = parser.parse_args()
+
+    report = bulk_load(args.database, args.input, schema=args.schema, data_format=args.data_format,
+                       transaction_rows=args.transaction_rows, batch_bytes=args.batch_bytes,
+                       analyze=args.analyze)
+    for table, stats in report['tables'].items():
+        print(f"  {table:<16} {stats['rows']:>12,} rows  {stats['rows_per_second']:>12,.0f} rows/s")
+    print(f"{report['rows']:,} rows in {report['seconds']:.2f} s ({report['rows_per_second']:,.0f} rows/s), "
+          f"indexes {report['index_seconds']:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
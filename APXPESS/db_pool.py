@@ -0,0 +1,223 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the pool timeout"""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of sqlite connections with thread affinity
+
+    Each worker thread gets back the connection it used last whenever that
+    connection is idle, so sqlite's per-connection statement cache stays
+    warm for the statements that thread keeps running. Connections are
+    health-checked when they have been idle for a while and recycled when
+    the check fails or they exceed ``max_idle_time``.
+    """
+
+    def __init__(self, factory, max_size=8, timeout=5.0, health_check_interval=30.0,
+                 max_idle_time=600.0):
+        """
+        Args:
+            factory (callable): Returns a new DB-API connection
+            max_size (int): Maximum number of open connections
+            timeout (float): Seconds to wait for a free connection before
+                raising PoolTimeout
+            health_check_interval (float): Idle seconds after which a
+                connection is pinged before being handed out
+            max_idle_time (float): Idle seconds after which a connection is
+                closed instead of reused
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_idle_time = max_idle_time
+
+        self._cond = threading.Condition()
+        # id(conn) -> (conn, released_at) for connections not checked out
+        self._idle = {}
+        self._size = 0
+        self._local = threading.local()
+        self._closed = False
+        # Handles inherited over fork(), kept open but never used
+        self._inherited = []
+        self._stats = {
+            'hits': 0,
+            'affinity_hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'recycled': 0,
+        }
+
+    def acquire(self):
+        """Check out a connection, preferring the one this thread used last"""
+        deadline = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout('Connection pool is closed')
+
+                conn = self._take_idle()
+                if conn is not None:
+                    break
+
+                if self._size < self.max_size:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+                    self._stats['misses'] += 1
+                    conn = None
+                    break
+
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self._stats['waits'] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                self._cond.wait(remaining)
+                self._stats['wait_seconds'] += time.monotonic() - now
+
+        if conn is None:
+            try:
+                conn = self.factory()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        self._local.conn_id = id(conn)
+        return conn
+
+    def _take_idle(self):
+        """Pop a usable idle connection; caller holds the lock"""
+        preferred = getattr(self._local, 'conn_id', None)
+        while self._idle:
+            if preferred in self._idle:
+                conn, released_at = self._idle.pop(preferred)
+                affinity = True
+            else:
+                conn, released_at = self._idle.pop(next(iter(self._idle)))
+                affinity = False
+            preferred = None
+
+            idle_for = time.monotonic() - released_at
+            if idle_for > self.max_idle_time:
+                self._discard(conn)
+                self._stats['recycled'] += 1
+                continue
+            if idle_for > self.health_check_interval and not self._is_healthy(conn):
+                self._discard(conn)
+                self._stats['health_check_failures'] += 1
+                continue
+
+            self._stats['hits'] += 1
+            if affinity:
+                self._stats['affinity_hits'] += 1
+            return conn
+        return None
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        """Close a connection and free its slot; caller holds the lock"""
+        self._size -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def release(self, conn, broken=False):
+        """
+        Return a connection to the pool
+
+        An open transaction is rolled back: commit writes before releasing.
+
+        Args:
+            conn: A connection obtained from acquire()
+            broken (bool): Close the connection instead of reusing it
+        """
+        if not broken:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            if broken or self._closed:
+                self._discard(conn)
+            else:
+                self._idle[id(conn)] = (conn, time.monotonic())
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks a connection out and back in
+
+        A transaction the block leaves open (a write statement) is committed
+        when the block succeeds, and rolled back by release() when it raises.
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            # Operational errors such as a bad statement leave the
+            # connection usable; anything lower level does not
+            broken = not isinstance(e, (sqlite3.OperationalError, sqlite3.IntegrityError))
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def after_fork(self):
+        """
+        Forget the parent's connections in a forked child process
+
+        Connections checked out in the parent at fork time belonged to its
+        other threads and are not coming back, so the pool starts empty.
+        """
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._inherited.extend(conn for conn, _ in self._idle.values())
+        self._idle = {}
+        self._size = 0
+
+    def close(self):
+        """Close all idle connections and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            for conn, _ in list(self._idle.values()):
+                self._discard(conn)
+            self._idle.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return pool usage counters for sizing the pool"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['max_size'] = self.max_size
+        checkouts = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / checkouts if checkouts else 0.0
+        return stats
@@ -0,0 +1,241 @@
+class EntityMatcher:
+    """
+    Multi-pattern substring matcher (Aho-Corasick automaton)
+
+    Every registered pattern is found in a single left-to-right pass over
+    the text, so matching cost depends on the length of the question and
+    the number of hits, not on how many tables and columns the schema has.
+    Semantics are the same as a plain ``pattern in text`` check: matches
+    may overlap and are not restricted to word boundaries.
+    """
+
+    def __init__(self):
+        # Trie nodes are stored in parallel lists indexed by node id;
+        # node 0 is the root
+        self._goto = [{}]
+        self._fail = [0]
+        self._terminal = [None]
+        self._outputs = [()]
+
+        # pattern -> node id of its terminal node
+        self._nodes = {}
+        # pattern -> list of payloads registered for it
+        self._payloads = {}
+        self._dirty = False
+        self._dead_nodes = 0
+
+        # Patterns spanning whitespace, by the text before their first
+        # whitespace: 'greater than' under 'greater'
+        self._heads = {}
+        # run text -> (matches inside it, spanning patterns starting in it)
+        self._run_cache = {}
+        self.max_run_cache = 50000
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def __contains__(self, pattern):
+        return pattern in self._payloads
+
+    def add(self, pattern, payload):
+        """
+        Register a payload for a pattern
+
+        Args:
+            pattern (str): The substring to look for
+            payload: Any hashable value returned with each match
+        """
+        if not pattern:
+            return
+        payloads = self._payloads.get(pattern)
+        if payloads is None:
+            self._payloads[pattern] = [payload]
+            self._insert(pattern)
+        elif payload not in payloads:
+            payloads.append(payload)
+
+    def remove(self, pattern, payload=None):
+        """
+        Unregister a payload (or every payload when None) for a pattern
+        """
+        payloads = self._payloads.get(pattern)
+        if payloads is None:
+            return
+        if payload is not None:
+            if payload in payloads:
+                payloads.remove(payload)
+            if payloads:
+                return
+
+        del self._payloads[pattern]
+        node = self._nodes.pop(pattern)
+        self._terminal[node] = None
+        self._dead_nodes += len(pattern)
+        self._dirty = True
+
+    def copy(self):
+        """
+        Return an independent matcher with the same patterns
+
+        A matcher other threads are reading must not change under them:
+        change and build a copy instead, then swap it in.
+        """
+        clone = EntityMatcher.__new__(EntityMatcher)
+        clone.__dict__.update(self.__dict__)
+        clone._goto = [dict(edges) for edges in self._goto]
+        clone._fail = list(self._fail)
+        clone._terminal = list(self._terminal)
+        clone._outputs = list(self._outputs)
+        clone._nodes = dict(self._nodes)
+        clone._payloads = {pattern: list(payloads) for pattern, payloads in self._payloads.items()}
+        clone._heads = {head: list(patterns) for head, patterns in self._heads.items()}
+        clone._run_cache = {}
+        return clone
+
+    def clear(self):
+        """Remove every pattern"""
+        self.__init__()
+
+    def _insert(self, pattern):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._outputs.append(())
+                self._goto[node][ch] = nxt
+            node = nxt
+        self._terminal[node] = pattern
+        self._nodes[pattern] = node
+        self._dirty = True
+
+    def build(self):
+        """
+        (Re)compute failure links and output sets
+
+        Called lazily by ``find_all`` after the pattern set changed. Nodes
+        left behind by removed patterns are compacted away once they make
+        up more than half of the trie.
+        """
+        if not self._dirty:
+            return
+        if self._dead_nodes and self._dead_nodes * 2 > len(self._goto):
+            payloads = self._payloads
+            self.__init__()
+            self._payloads = payloads
+            for pattern in payloads:
+                self._insert(pattern)
+
+        self._run_cache = {}
+        self._heads = {}
+        for pattern in self._payloads:
+            parts = pattern.split(None, 1)
+            if parts and parts[0] != pattern:
+                head = '' if pattern[0].isspace() else parts[0]
+                self._heads.setdefault(head, []).append(pattern)
+
+        goto, fail, terminal, outputs = self._goto, self._fail, self._terminal, self._outputs
+
+        # Breadth-first walk so that failure targets are always finished
+        # before the nodes that point at them
+        queue = []
+        for child in goto[0].values():
+            fail[child] = 0
+            queue.append(child)
+        outputs[0] = ()
+
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            own = (terminal[node],) if terminal[node] is not None else ()
+            outputs[node] = own + outputs[fail[node]]
+            for ch, child in goto[node].items():
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(ch, 0)
+                queue.append(child)
+
+        self._dirty = False
+
+    def find_all(self, text):
+        """
+        Find every occurrence of every registered pattern
+
+        Args:
+            text (str): The text to scan
+
+        Returns:
+            list: ``(start, end, pattern)`` tuples in order of their end offset
+        """
+        if self._dirty:
+            self.build()
+
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if outputs[node]:
+                end = i + 1
+                for pattern in outputs[node]:
+                    matches.append((end - len(pattern), end, pattern))
+        return matches
+
+    def _scan_run(self, text):
+        matches = self.find_all(text)
+        starts = []
+        if self._heads:
+            for offset in range(len(text) + 1):
+                for pattern in self._heads.get(text[offset:], ()):
+                    starts.append((offset, pattern))
+        if len(self._run_cache) >= self.max_run_cache:
+            self._run_cache.clear()
+        result = self._run_cache[text] = (matches, starts)
+        return result
+
+    def find_in_runs(self, text, runs):
+        """
+        ``find_all(text)`` for a text already split into whitespace-separated
+        runs (see lexer.Lexer)
+
+        Patterns without whitespace lie inside one run, so each distinct run
+        is scanned once and its matches are cached; patterns spanning
+        whitespace are looked up by the end of the run they start in and
+        checked against the text.
+
+        Args:
+            text (str): The text the runs were taken from
+            runs (list): (start offset, run) pairs; runs have a ``text``
+
+        Returns:
+            list: ``(start, end, pattern)`` tuples in order of their end offset
+        """
+        if self._dirty:
+            self.build()
+        cache = self._run_cache
+        matches = []
+        spanning = False
+        for offset, run in runs:
+            inner, starts = cache.get(run.text) or self._scan_run(run.text)
+            for start, end, pattern in inner:
+                matches.append((offset + start, offset + end, pattern))
+            for start, pattern in starts:
+                start += offset
+                if text.startswith(pattern, start):
+                    matches.append((start, start + len(pattern), pattern))
+                    spanning = True
+        if spanning:
+            # Longest first among matches ending together, like find_all
+            matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+    def payloads(self, pattern):
+        """Return the payloads registered for a pattern"""
+        return self._payloads.get(pattern, [])
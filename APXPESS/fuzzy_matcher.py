@@ -0,0 +1,308 @@
+import re
+
+# Words of an identifier: InvoiceLine -> invoice line, total_amount ->
+# total amount, BillingPostalCode -> billing postal code
+NAME_WORD_PATTERN = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+QUESTION_WORD_PATTERN = re.compile(r'[a-z]+')
+
+# Question words that mean the same as a word used in table/column names
+DEFAULT_SYNONYMS = {
+    'client': 'customer',
+    'buyer': 'customer',
+    'purchaser': 'customer',
+    'mail': 'email',
+    'cost': 'price',
+    'spent': 'total',
+    'sum': 'total',
+    'revenue': 'total',
+    'length': 'milliseconds',
+    'duration': 'milliseconds',
+    'staff': 'employee',
+    'worker': 'employee',
+    'qty': 'quantity',
+    'song': 'track',
+    'tune': 'track',
+    'singer': 'artist',
+    'band': 'artist',
+    'record': 'album',
+    'bill': 'invoice',
+    'purchase': 'order',
+    'item': 'product',
+    'inventory': 'stock',
+    'nation': 'country',
+    'telephone': 'phone',
+    'registered': 'signup',
+    'joined': 'signup',
+}
+
+
+def stem(word):
+    """Crude plural folding so 'customers', 'addresses' and 'categories' match their names"""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('ses', 'xes', 'ches', 'shes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def name_words(name):
+    """Split a table or column name into stemmed lowercase words"""
+    words = []
+    for part in re.split(r'[\W_]+', name):
+        words.extend(stem(word.lower()) for word in NAME_WORD_PATTERN.findall(part))
+    return tuple(words)
+
+
+def trigrams(word):
+    padded = f'${word}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_distance(a, b, limit):
+    """
+    Optimal string alignment distance (edits incl. transpositions), or
+    limit + 1 as soon as it is known to exceed limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Common prefixes and suffixes cost nothing
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    a, b = a[start:], b[start:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if not a or not b:
+        return len(a) + len(b)
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyMatcher:
+    """
+    Typo- and synonym-tolerant lookup of table and column names
+
+    Names are indexed as bags of stemmed words, so "invoice line",
+    "InvoiceLine" and "invoice lines" all reach InvoiceLine, and "amount
+    spent" reaches total_amount through the synonym spent -> total. Each
+    word of a question is resolved with one dict lookup; only words that
+    are not in the vocabulary go through the trigram index, which is
+    probed with the rarest trigrams only (prefix filtering), so the cost of
+    a lookup grows with the number of close candidates, not with the size
+    of the schema. Candidates are verified with a bounded edit distance
+    and kept when their score (1 - edits / length) reaches ``min_score``.
+    """
+
+    def __init__(self, synonyms=None, min_score=0.75, min_fuzzy_length=4, max_edits=2, max_window=3,
+                 ignore_words=(), max_cache=10000):
+        """
+        Args:
+            synonyms (dict): Question word -> name word; DEFAULT_SYNONYMS
+                when None
+            min_score (float): Similarity cutoff for typo corrections
+            min_fuzzy_length (int): Shorter words must match exactly
+            max_edits (int): Most typos corrected in one word
+            max_window (int): Longest name, in words, matched in a question
+            ignore_words (iterable): Words never corrected (stop words); a
+                name is not matched across them unless it contains them
+            max_cache (int): Resolved question words remembered
+        """
+        self.synonyms = DEFAULT_SYNONYMS if synonyms is None else synonyms
+        self.min_score = min_score
+        self.min_fuzzy_length = min_fuzzy_length
+        self.max_edits = max_edits
+        self.max_window = max_window
+        self.ignore_words = frozenset(ignore_words)
+        self.max_cache = max_cache
+
+        # word -> tuple of name words it stands for
+        self._vocabulary = {}
+        # trigram -> {word length: words of the vocabulary containing it}
+        self._postings = {}
+        # word -> its trigrams
+        self._grams = {}
+        # frozenset of name words -> payloads
+        self._bags = {}
+        # vocabulary entry -> payloads of the name it spells on its own
+        self._single = {}
+        self._cache = {}
+
+    def build(self, names, phrases=None):
+        """
+        (Re)build the index
+
+        Args:
+            names (iterable): (name, payload) pairs, e.g. ('total_amount',
+                ('column', 'total_amount', 'orders'))
+            phrases (dict): Extra phrase -> name words, e.g. {'amount
+                spent': 'total amount'}
+        """
+        vocabulary = {}
+        bags = {}
+        for name, payload in names:
+            words = name_words(name)
+            if not words:
+                continue
+            payloads = bags.setdefault(frozenset(words), [])
+            if payload not in payloads:
+                payloads.append(payload)
+            for word in words:
+                vocabulary[word] = (word,)
+            if len(words) > 1 and not any(char.isspace() for char in name):
+                # The name typed as one word: "invoiceline"
+                vocabulary[''.join(words)] = words
+        for word, target in self.synonyms.items():
+            target = stem(target)
+            if target in vocabulary:
+                vocabulary[stem(word)] = (target,)
+        for phrase, target in (phrases or {}).items():
+            words = tuple(stem(word) for word in QUESTION_WORD_PATTERN.findall(phrase.lower()))
+            if len(words) == 1:
+                vocabulary[words[0]] = tuple(stem(word) for word in target.split())
+
+        postings = {}
+        grams = {}
+        for word in vocabulary:
+            if len(word) >= self.min_fuzzy_length:
+                grams[word] = frozenset(trigrams(word))
+                for gram in grams[word]:
+                    postings.setdefault(gram, {}).setdefault(len(word), []).append(word)
+
+        self._vocabulary = vocabulary
+        self._postings = postings
+        self._grams = grams
+        self._bags = bags
+        self._single = {words: bags[frozenset(words)] for words in set(vocabulary.values())
+                        if frozenset(words) in bags}
+        self._cache = {}
+
+    def resolve(self, word):
+        """
+        Map a question word to the name words it stands for
+
+        Returns:
+            tuple: (name words, score), or None
+        """
+        cached = self._cache.get(word, False)
+        if cached is not False:
+            return cached
+        result = None
+        stemmed = stem(word)
+        words = self._vocabulary.get(stemmed) or self._vocabulary.get(word)
+        if words is not None:
+            result = (words, 1.0)
+        elif len(stemmed) >= self.min_fuzzy_length and word not in self.ignore_words:
+            result = self._correct(stemmed)
+        if len(self._cache) >= self.max_cache:
+            self._cache.clear()
+        self._cache[word] = result
+        return result
+
+    def _correct(self, word):
+        """Closest vocabulary word within the score cutoff"""
+        max_edits = min(self.max_edits, int(len(word) * (1 - self.min_score)))
+        if max_edits < 1:
+            return None
+        lengths = range(len(word) - max_edits, len(word) + max_edits + 1)
+        word_grams = trigrams(word)
+        postings = [self._postings.get(gram, {}) for gram in word_grams]
+        postings.sort(key=lambda by_length: sum(len(by_length.get(length, ())) for length in lengths))
+        # One edit changes at most 4 trigrams (a transposition), so a word
+        # within max_edits edits appears in the postings of any
+        # 4 * max_edits + 1 of them: probe the rarest ones, and only the
+        # words of a compatible length
+        candidates = set()
+        for by_length in postings[:4 * max_edits + 1]:
+            for length in lengths:
+                candidates.update(by_length.get(length, ()))
+
+        # Most shared trigrams first: the likely answer lowers the edit
+        # limit early, and the count filter then rejects most of the rest
+        ranked = sorted(((len(word_grams & self._grams[candidate]), candidate) for candidate in candidates),
+                        reverse=True)
+        best = None
+        limit = max_edits
+        for shared, candidate in ranked:
+            if abs(len(candidate) - len(word)) > limit:
+                continue
+            if shared < max(len(word_grams), len(self._grams[candidate])) - 4 * limit:
+                continue
+            distance = bounded_distance(word, candidate, limit)
+            if distance > limit:
+                continue
+            if best is None or distance < limit or candidate < best:
+                best, limit = candidate, distance
+        if best is None:
+            return None
+        best_distance = limit
+        score = 1 - best_distance / max(len(word), len(best))
+        if score < self.min_score:
+            return None
+        return self._vocabulary[best], score
+
+    def find(self, text, words=None):
+        """
+        Find table and column names in a normalized question
+
+        Args:
+            text (str): The normalized question
+            words (list): Its (start, end, word) [a-z]+ words, when already
+                lexed (see lexer.Lexer.words)
+
+        Returns:
+            list: (start, end, payload, score) tuples; windows of up to
+                max_window consecutive words are matched longest first
+        """
+        if words is None:
+            words = [(match.start(), match.end(), match.group()) for match in QUESTION_WORD_PATTERN.finditer(text)]
+        cache = self._cache
+        resolved = []
+        for _, _, word in words:
+            result = cache.get(word, False)
+            resolved.append(self.resolve(word) if result is False else result)
+
+        bags, single = self._bags, self._single
+        n = len(resolved)
+        matches = []
+        i = 0
+        while i < n:
+            # Windows stop at words that resolve to nothing
+            size = 0
+            while size < self.max_window and i + size < n and resolved[i + size] is not None:
+                size += 1
+            while size:
+                window = resolved[i:i + size]
+                if size == 1:
+                    payloads = single.get(window[0][0])
+                else:
+                    payloads = bags.get(frozenset(word for names, _ in window for word in names))
+                if payloads:
+                    score = min(score for _, score in window)
+                    start, end = words[i][0], words[i + size - 1][1]
+                    for payload in payloads:
+                        matches.append((start, end, payload, score))
+                    break
+                size -= 1
+            i += size or 1
+        return matches
+
+    def stats(self):
+        return {'vocabulary': len(self._vocabulary), 'names': len(self._bags),
+                'trigrams': len(self._postings)}
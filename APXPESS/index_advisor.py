@@ -0,0 +1,366 @@
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+# Statements the generator produces: SELECT <columns> FROM <table> [JOIN ...] [WHERE ...]
+SELECT_PATTERN = re.compile(r'^\s*SELECT\s+(.*?)\s+FROM\s+(\w+)(.*)$', re.IGNORECASE | re.DOTALL)
+JOIN_PATTERN = re.compile(r'\bJOIN\s+(\w+)\s+ON\s+(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)', re.IGNORECASE)
+WHERE_PATTERN = re.compile(r'\bWHERE\s+(.*?)(?:\s+LIMIT\b|\s+--|$)', re.IGNORECASE | re.DOTALL)
+PREDICATE_PATTERN = re.compile(
+    r"(?:(\w+)\.)?(\w+)\s*(=|!=|<=|>=|<|>|LIKE)\s*(?:\?|'%'\s*\|\|\s*\?)", re.IGNORECASE)
+# EXPLAIN QUERY PLAN details: "SCAN products", "SEARCH t USING INDEX i (c=?)",
+# "SCAN TABLE products" on older sqlite versions
+PLAN_PATTERN = re.compile(r'^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)(.*)$', re.IGNORECASE)
+
+INDEX_PREFIX = 'auto_idx_'
+RANGE_OPERATORS = {'<', '>', '<=', '>='}
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def parse_predicates(sql_query):
+    """
+    Find the columns a generated SELECT filters and joins on
+
+    Returns:
+        list: (table, key columns, covered columns) per table that an index
+            could serve; key columns put equality predicates before at most
+            one range predicate, and covered columns are the other selected
+            columns of that table
+    """
+    match = SELECT_PATTERN.match(sql_query)
+    if not match:
+        return []
+    select_list, main_table, rest = match.groups()
+    tables = [main_table]
+    joined_on = {}
+    for table, left_table, left_column, right_table, right_column in JOIN_PATTERN.findall(rest):
+        tables.append(table)
+        column = left_column if left_table.lower() == table.lower() else right_column
+        joined_on.setdefault(table.lower(), []).append(column)
+
+    by_lower = {table.lower(): table for table in tables}
+    equality = {}
+    ranges = {}
+    where = WHERE_PATTERN.search(rest)
+    if where:
+        for table, column, operator in PREDICATE_PATTERN.findall(where.group(1)):
+            table = by_lower.get((table or main_table).lower())
+            if table is None:
+                continue
+            if operator == '=':
+                equality.setdefault(table, []).append(column)
+            elif operator in RANGE_OPERATORS:
+                ranges.setdefault(table, []).append(column)
+
+    selected = {}
+    if select_list.strip() != '*':
+        for item in select_list.split(','):
+            parts = item.strip().split('.')
+            table = by_lower.get(parts[0].lower(), main_table) if len(parts) == 2 else main_table
+            selected.setdefault(table, []).append(parts[-1])
+
+    candidates = []
+    for table in tables:
+        keys = []
+        for column in joined_on.get(table.lower(), []) + equality.get(table, []):
+            if column not in keys:
+                keys.append(column)
+        # Only the first range column can use the index; it goes last
+        for column in ranges.get(table, [])[:1]:
+            if column not in keys:
+                keys.append(column)
+        if not keys:
+            continue
+        covered = [column for column in selected.get(table, []) if column not in keys]
+        candidates.append((table, tuple(keys), tuple(dict.fromkeys(covered))))
+    return candidates
+
+
+class IndexAdvisor:
+    """
+    Recommends (and optionally creates) indexes for the executed workload
+
+    Every executed generated SELECT is recorded with its latency; the
+    columns it filters or joins on are counted per table. Once a column
+    set has been used ``min_uses`` times, a background thread checks with
+    ``EXPLAIN QUERY PLAN`` whether sqlite scans that table, and if so
+    recommends a covering index. With ``create=True`` the index is built,
+    the affected statements are timed again, and the index is dropped if it
+    did not make them faster. The number and estimated size of the indexes
+    the advisor creates are capped.
+    """
+
+    def __init__(self, database, min_uses=50, create=False, max_indexes=10,
+                 max_index_bytes=256 * 1024 * 1024, max_index_columns=5, timing_runs=3,
+                 max_shapes=10000, governor=None, timing_rows=1000, timing_timeout=1.0):
+        """
+        Args:
+            database (str): Path of the sqlite database
+            min_uses (int): Uses of a column set before it is evaluated
+            create (bool): Create recommended indexes instead of only
+                reporting them
+            max_indexes (int): Maximum number of advisor-created indexes
+            max_index_bytes (int): Maximum estimated size of all of them
+            max_index_columns (int): Covered columns are dropped from an
+                index that would exceed this width
+            timing_runs (int): Runs per statement when measuring latency
+            max_shapes (int): Distinct statements tracked; new ones are
+                ignored beyond this
+            governor (QueryGovernor): Runs the timed statements; a default
+                one is used when None
+            timing_rows (int): Rows read per timed run
+            timing_timeout (float): Seconds after which a timed run is
+                interrupted
+        """
+        self.database = database
+        self.min_uses = min_uses
+        self.create = create
+        self.max_indexes = max_indexes
+        self.max_index_bytes = max_index_bytes
+        self.max_index_columns = max_index_columns
+        self.timing_runs = timing_runs
+        self.max_shapes = max_shapes
+        if governor is None:
+            # query_governor imports this module
+            from query_governor import QueryGovernor
+            governor = QueryGovernor()
+        self.governor = governor
+        # Timed statements are user statements re-run in the background:
+        # they get the governor's budget, cut to a sample of the rows
+        self.timing_budget = governor.default_budget.tightened(max_rows=timing_rows,
+                                                              timeout=timing_timeout)
+
+        # sql -> {'candidates', 'uses', 'seconds', 'params'}, None when unindexable
+        self._shapes = {}
+        # (table, keys, covered) -> candidate dict (see report())
+        self._candidates = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._conn = None
+        # Handles inherited over fork(), kept open but never used
+        self._inherited = []
+        self._stats = {'recorded': 0, 'evaluated': 0, 'created': 0, 'dropped': 0}
+
+    def record(self, sql_query, params, seconds):
+        """
+        Count the predicate columns of an executed statement
+
+        Cheap enough to call on every execution: each distinct statement
+        shape is parsed once, and evaluation happens on a background thread.
+        """
+        with self._lock:
+            shape = self._shapes.get(sql_query, False)
+            if shape is False:
+                if len(self._shapes) >= self.max_shapes:
+                    return
+                candidates = parse_predicates(sql_query)
+                shape = {'candidates': candidates, 'uses': 0, 'seconds': 0.0,
+                         'params': ()} if candidates else None
+                self._shapes[sql_query] = shape
+            if shape is None:
+                return
+            self._stats['recorded'] += 1
+            shape['uses'] += 1
+            shape['seconds'] += seconds
+            shape['params'] = tuple(params)
+            for table, keys, covered in shape['candidates']:
+                if len(keys) + len(covered) > self.max_index_columns:
+                    covered = ()
+                key = (table, keys, covered)
+                candidate = self._candidates.get(key)
+                if candidate is None:
+                    candidate = self._candidates[key] = {
+                        'table': table, 'columns': list(keys), 'covering': list(covered),
+                        'uses': 0, 'statements': set(), 'status': 'observing',
+                    }
+                candidate['uses'] += 1
+                candidate['statements'].add(sql_query)
+                if candidate['status'] == 'observing' and candidate['uses'] >= self.min_uses:
+                    candidate['status'] = 'pending'
+                    self._queue.put(key)
+                    self._start_worker()
+
+    def after_fork(self):
+        """
+        Reset the connection and the evaluation thread in a forked child
+
+        Candidates the parent had queued are evaluated again by the first
+        worker that sees them used.
+        """
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        if self._conn is not None:
+            self._inherited.append(self._conn)
+            self._conn = None
+        for candidate in self._candidates.values():
+            if candidate['status'] == 'pending':
+                candidate['status'] = 'observing'
+
+    def _start_worker(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='index-advisor', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            try:
+                self.evaluate(key)
+            except Exception as e:
+                self._update(key, status='failed', reason=str(e))
+
+    def _update(self, key, **fields):
+        with self._lock:
+            self._candidates[key].update(fields)
+
+    def _connection(self):
+        """Read-only unless indexes are created; never creates a missing database"""
+        if self._conn is None:
+            mode = 'rw' if self.create else 'ro'
+            self._conn = sqlite3.connect(f'file:{self.database}?mode={mode}', uri=True, timeout=30.0,
+                                         check_same_thread=False)
+        return self._conn
+
+    def evaluate(self, key):
+        """Decide on one candidate; runs on the advisor thread"""
+        table, keys, covered = key
+        conn = self._connection()
+        with self._lock:
+            self._stats['evaluated'] += 1
+            statements = sorted(self._candidates[key]['statements'],
+                                key=lambda sql: -self._shapes[sql]['uses'])[:5]
+            samples = [(sql, self._shapes[sql]['params']) for sql in statements]
+
+        name = INDEX_PREFIX + re.sub(r'\W', '_', f"{table}_{'_'.join(keys + covered)}").lower()
+        ddl = (f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} "
+               f"({', '.join(quote(column) for column in keys + covered)})")
+        self._update(key, index=name, ddl=ddl)
+
+        if not any(self._scans(conn, sql, params, table) for sql, params in samples):
+            self._update(key, status='not_needed', reason='sqlite already searches this table')
+            return
+
+        estimated_bytes = self._estimate_bytes(conn, table, keys + covered)
+        created = self._created_indexes(conn)
+        if len(created) >= self.max_indexes:
+            self._update(key, status='rejected', estimated_bytes=estimated_bytes,
+                         reason=f'index cap of {self.max_indexes} reached')
+            return
+        total_bytes = sum(self._estimate_bytes(conn, t, c) for t, c in created.values())
+        if total_bytes + estimated_bytes > self.max_index_bytes:
+            self._update(key, status='rejected', estimated_bytes=estimated_bytes,
+                         reason=f'index size cap of {self.max_index_bytes} bytes reached')
+            return
+
+        before_ms = self._time_statements(conn, samples)
+        if not self.create:
+            self._update(key, status='recommended', estimated_bytes=estimated_bytes, before_ms=before_ms)
+            return
+
+        with conn:
+            conn.execute(ddl)
+        conn.execute('PRAGMA optimize')
+        after_ms = self._time_statements(conn, samples)
+        if sum(after_ms.values()) >= 0.9 * sum(before_ms.values()):
+            # Not worth its write and space overhead
+            with conn:
+                conn.execute(f'DROP INDEX IF EXISTS {quote(name)}')
+            with self._lock:
+                self._stats['dropped'] += 1
+            self._update(key, status='dropped', estimated_bytes=estimated_bytes,
+                         before_ms=before_ms, after_ms=after_ms, reason='no measurable speedup')
+            return
+        with self._lock:
+            self._stats['created'] += 1
+        self._update(key, status='created', estimated_bytes=estimated_bytes,
+                     before_ms=before_ms, after_ms=after_ms)
+
+    def _scans(self, conn, sql_query, params, table):
+        """True if the plan reads every row of table (or builds an automatic index)"""
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {sql_query}', params):
+            match = PLAN_PATTERN.match(row[-1])
+            if not match or match.group(2).lower() != table.lower():
+                continue
+            operation, detail = match.group(1).upper(), match.group(3).upper()
+            if 'AUTOMATIC' in detail or (operation == 'SCAN' and 'INDEX' not in detail):
+                return True
+        return False
+
+    def _row_count(self, conn, table):
+        """Rows of a table from sqlite_stat1 after ANALYZE, else its largest rowid"""
+        try:
+            row = conn.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1', (table,)).fetchone()
+        except sqlite3.OperationalError:
+            # No ANALYZE has been run on this database
+            row = None
+        if row is not None and row[0]:
+            return int(row[0].split()[0])
+        try:
+            return conn.execute(f'SELECT MAX(rowid) FROM {quote(table)}').fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID table: nothing cheaper than counting
+            return conn.execute(f'SELECT COUNT(*) FROM {quote(table)}').fetchone()[0]
+
+    def _estimate_bytes(self, conn, table, columns):
+        """Rows times the average width of the indexed values plus the rowid"""
+        count = self._row_count(conn, table)
+        if not count:
+            return 0
+        widths = ', '.join(f'AVG(LENGTH({quote(column)}))' for column in columns)
+        sample = conn.execute(f'SELECT {widths} FROM (SELECT * FROM {quote(table)} LIMIT 1000)').fetchone()
+        return int(count * (sum(width or 0 for width in sample) + 8 + len(columns)))
+
+    def _created_indexes(self, conn):
+        """Return {name: (table, columns)} of indexes this advisor created"""
+        indexes = {}
+        for name, table in conn.execute("SELECT name, tbl_name FROM sqlite_master "
+                                        "WHERE type = 'index' AND name LIKE ?", (INDEX_PREFIX + '%',)):
+            columns = tuple(row[2] for row in conn.execute(f'PRAGMA index_info({quote(name)})'))
+            indexes[name] = (table, columns)
+        return indexes
+
+    def _time_statements(self, conn, samples):
+        """
+        Median latency in milliseconds of each sample statement, reading at
+        most timing_rows rows for at most timing_timeout seconds
+        """
+        timings = {}
+        for sql_query, params in samples:
+            runs = []
+            for _ in range(self.timing_runs):
+                query = self.governor.execute(conn, sql_query, params, self.timing_budget)
+                runs.append(query.elapsed * 1000)
+            timings[sql_query] = sorted(runs)[len(runs) // 2]
+        return timings
+
+    def wait(self):
+        """Block until every pending candidate was evaluated (for scripts and benchmarks)"""
+        while True:
+            with self._lock:
+                busy = any(c['status'] == 'pending' for c in self._candidates.values())
+            if not busy:
+                return
+            time.sleep(0.05)
+
+    def report(self):
+        """Return every candidate with its status, ordered by use"""
+        with self._lock:
+            candidates = [dict(candidate, statements=len(candidate['statements']))
+                          for candidate in self._candidates.values()]
+        return sorted(candidates, key=lambda candidate: -candidate['uses'])
+
+    def stats(self):
+        """Return counters for /metrics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['shapes'] = len(self._shapes)
+            stats['candidates'] = len(self._candidates)
+            stats['recommended'] = sum(1 for c in self._candidates.values() if c['status'] == 'recommended')
+        return stats
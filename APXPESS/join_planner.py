@@ -0,0 +1,379 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Columns that look like foreign keys by naming convention: customer_id, CustomerId
+FK_NAME_PATTERN = re.compile(r'^(\w+?)_?id$', re.IGNORECASE)
+
+# FROM clauses rendered by JoinPlan.from_clause: FROM a JOIN b ON b.x = a.y ...
+JOINED_FROM_PATTERN = re.compile(r'\bFROM (\w+)((?: JOIN \w+ ON \w+\.\w+ = \w+\.\w+)+)')
+JOIN_STEP_PATTERN = re.compile(r' JOIN (\w+) ON (\w+)\.(\w+) = (\w+)\.(\w+)')
+AGGREGATE_PATTERN = re.compile(r'\b(?:COUNT|SUM|AVG|MIN|MAX)\(', re.IGNORECASE)
+
+
+class JoinPlan:
+    """Result of planning a join over a set of tables"""
+
+    def __init__(self, tables, joins, unreachable, estimated_rows=None):
+        # Tables in join order; joins[i] describes how tables[i + 1] is attached
+        self.tables = tables
+        # (table, on_table, table_column, on_column)
+        self.joins = joins
+        self.unreachable = unreachable
+        self.estimated_rows = estimated_rows
+
+    def from_clause(self):
+        """Render the FROM ... JOIN ... ON part of a statement"""
+        sql = self.tables[0]
+        for table, on_table, column, on_column in self.joins:
+            sql += f" JOIN {table} ON {table}.{column} = {on_table}.{on_column}"
+        return sql
+
+
+class JoinPlanner:
+    """
+    Plans JOIN ... ON clauses over the foreign-key graph
+
+    Edges come from the declared foreign keys of a SchemaCatalog plus
+    columns that follow the ``<table>_id`` / ``<Table>Id`` naming
+    convention. The graph and the shortest paths found in it are cached
+    until the schema changes. Plans are built by growing a tree from the
+    first detected table, attaching every other table through its shortest
+    path (e.g. Customer -> Invoice -> InvoiceLine -> Track), so no
+    Cartesian product is ever generated.
+    """
+
+    def __init__(self, catalog=None, database=None, max_estimated_rows=None, guard='limit',
+                 count_ttl=300.0):
+        """
+        Args:
+            catalog (SchemaCatalog): Source of declared foreign keys
+            database (str): Database used for row estimates; no estimates
+                (and no guard) when None
+            max_estimated_rows (int): Plans estimated above this are limited
+                or refused; no guard when None
+            guard (str): 'limit' to cap such plans with LIMIT, 'refuse' to
+                not run them at all
+            count_ttl (float): Seconds a cached row count or index
+                statistic stays valid
+        """
+        self.catalog = catalog
+        self.database = database
+        self.max_estimated_rows = max_estimated_rows
+        self.guard = guard
+        self.count_ttl = count_ttl
+
+        self._graph = None
+        # The schema dict and catalog tables the graph was built from; held
+        # (not their ids, which are reused once they are freed) and
+        # compared by identity
+        self._graph_key = None
+        # (source, target) -> path in self._graph
+        self._paths = {}
+        # table -> (rows, measured at), (averages, measured at)
+        self._counts = {}
+        self._averages = {}
+        self._conn = None
+        self._lock = threading.Lock()
+        # Handles inherited over fork(), kept open but never used
+        self._inherited = []
+
+    def graph(self, db_schema):
+        """
+        Return the (cached) undirected join graph for a schema
+
+        Returns:
+            dict: table -> list of (neighbour, column, neighbour column)
+        """
+        tables = self.catalog.tables if self.catalog is not None else None
+        with self._lock:
+            if (self._graph_key is not None and self._graph_key[0] is db_schema
+                    and self._graph_key[1] is tables):
+                return self._graph
+
+        graph = {table: [] for table in db_schema or {}}
+        seen = set()
+
+        def add_edge(table, column, ref_table, ref_column):
+            if table not in graph or ref_table not in graph or table == ref_table:
+                return
+            edge = (table, column, ref_table, ref_column)
+            if edge in seen:
+                return
+            seen.add(edge)
+            seen.add((ref_table, ref_column, table, column))
+            graph[table].append((ref_table, column, ref_column))
+            graph[ref_table].append((table, ref_column, column))
+
+        # Declared foreign keys
+        if self.catalog is not None:
+            for table, neighbours in self.catalog.fk_graph().items():
+                for ref_table, column, ref_column in neighbours:
+                    add_edge(table, column, ref_table, ref_column)
+
+        # Naming convention: orders.customer_id -> customers.id
+        by_name = {}
+        for table in graph:
+            by_name[table.lower()] = table
+        for table, columns in (db_schema or {}).items():
+            for column in columns:
+                match = FK_NAME_PATTERN.match(column)
+                if not match:
+                    continue
+                stem = match.group(1).lower()
+                ref_table = by_name.get(stem) or by_name.get(stem + 's') or by_name.get(stem + 'es')
+                if ref_table is None or ref_table == table:
+                    continue
+                ref_columns = db_schema[ref_table]
+                if column in ref_columns:
+                    add_edge(table, column, ref_table, column)
+                elif 'id' in ref_columns:
+                    add_edge(table, column, ref_table, 'id')
+
+        with self._lock:
+            self._graph = graph
+            self._graph_key = (db_schema, tables)
+            self._paths = {}
+        return graph
+
+    def shortest_path(self, graph, source, target):
+        """
+        Breadth-first shortest path between two tables
+
+        Returns:
+            list: (table, on_table, table_column, on_column) steps from
+                source to target, or None when they are not connected
+        """
+        key = (source, target)
+        with self._lock:
+            # Paths are cached for the current graph only
+            if graph is self._graph and key in self._paths:
+                return self._paths[key]
+
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            table = queue.popleft()
+            if table == target:
+                break
+            for neighbour, column, neighbour_column in graph.get(table, ()):
+                if neighbour not in previous:
+                    previous[neighbour] = (table, column, neighbour_column)
+                    queue.append(neighbour)
+
+        path = None
+        if target in previous:
+            path = []
+            table = target
+            while previous[table] is not None:
+                on_table, on_column, column = previous[table]
+                path.append((table, on_table, column, on_column))
+                table = on_table
+            path.reverse()
+        with self._lock:
+            if graph is self._graph:
+                self._paths[key] = path
+        return path
+
+    def plan(self, tables, db_schema):
+        """
+        Plan the joins needed to query several tables together
+
+        Args:
+            tables (list): Detected tables; the first one is the main table
+            db_schema (dict): The translator's schema
+
+        Returns:
+            JoinPlan
+        """
+        graph = self.graph(db_schema)
+        joined = [tables[0]]
+        joins = []
+        unreachable = []
+        for target in tables[1:]:
+            if target in joined:
+                continue
+            # Attach through the shortest path from any table already joined
+            best = None
+            for source in joined:
+                path = self.shortest_path(graph, source, target)
+                if path is not None and (best is None or len(path) < len(best)):
+                    best = path
+            if best is None:
+                unreachable.append(target)
+                continue
+            for step in best:
+                if step[0] not in joined:
+                    joined.append(step[0])
+                    joins.append(step)
+
+        return JoinPlan(joined, joins, unreachable)
+
+    def parse_plan(self, sql_query):
+        """
+        The join plan of a generated statement, read back from its FROM
+        clause (see JoinPlan.from_clause)
+
+        Returns:
+            JoinPlan: None when the statement does not join
+        """
+        match = JOINED_FROM_PATTERN.search(sql_query)
+        if match is None:
+            return None
+        joins = JOIN_STEP_PATTERN.findall(match.group(2))
+        tables = [match.group(1)] + [join[0] for join in joins]
+        # ON a.x = b.y names the attached table first
+        return JoinPlan(tables, [(table, on_table, column, on_column)
+                                 for table, _, column, on_table, on_column in joins], [])
+
+    def estimate_rows(self, plan):
+        """
+        Estimate the row count of a plan
+
+        Starts from the rows of the first table and multiplies by the
+        fan-out of every join: the average number of rows of the attached
+        table per value of its join column. Returns None when no database
+        is configured or a table size is unknown.
+        """
+        if self.database is None:
+            return None
+        rows = self.row_count(plan.tables[0])
+        for table, on_table, column, on_column in plan.joins:
+            fanout = self.fanout(table, column, on_table)
+            if rows is None or fanout is None:
+                return None
+            rows *= fanout
+        return None if rows is None else int(rows)
+
+    def fanout(self, table, column, on_table):
+        """
+        Average rows of table per value of column
+
+        1 for a primary key, the sqlite_stat1 average of an index on the
+        column when ANALYZE has run, else the size ratio of the two tables
+        (every row of on_table matching the same share of table).
+        """
+        info = self.catalog.tables.get(table) if self.catalog is not None else None
+        if info is not None:
+            keys = [entry['name'] for entry in info['columns'] if entry['pk']]
+            if keys == [column]:
+                return 1
+        averages = self._index_averages(table)
+        if averages is not None and column.lower() in averages:
+            return averages[column.lower()]
+        rows, on_rows = self.row_count(table), self.row_count(on_table)
+        if rows is None or on_rows is None:
+            return None
+        return max(1.0, rows / max(1, on_rows))
+
+    def after_fork(self):
+        """Drop the parent's estimate connection in a forked child process"""
+        self._lock = threading.Lock()
+        if self._conn is not None:
+            self._inherited.append(self._conn)
+            self._conn = None
+
+    def _connection(self):
+        """Read-only connection for estimates; caller holds the lock"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True, check_same_thread=False)
+        return self._conn
+
+    def _stat(self, table):
+        """sqlite_stat1 rows of a table as {index: stat}, {} before ANALYZE"""
+        try:
+            return dict(self._connection().execute('SELECT idx, stat FROM sqlite_stat1 WHERE tbl = ?',
+                                                   (table,)).fetchall())
+        except sqlite3.OperationalError:
+            # No ANALYZE has been run on this database
+            return {}
+
+    def _index_averages(self, table):
+        """{first indexed column: average rows per value} from sqlite_stat1, or None"""
+        now = time.monotonic()
+        cached = self._averages.get(table)
+        if cached is not None and now - cached[1] < self.count_ttl:
+            return cached[0]
+        averages = {}
+        with self._lock:
+            try:
+                for index, stat in self._stat(table).items():
+                    fields = (stat or '').split()
+                    if index is None or len(fields) < 2:
+                        continue
+                    quoted = index.replace('"', '""')
+                    first = self._connection().execute(f'PRAGMA index_info("{quoted}")').fetchone()
+                    if first is not None and first[2] is not None:
+                        averages.setdefault(first[2].lower(), int(fields[1]))
+            except sqlite3.Error:
+                return None
+        self._averages[table] = (averages, now)
+        return averages
+
+    def row_count(self, table):
+        """
+        Row count from sqlite_stat1, else MAX(rowid); never a full COUNT(*)
+
+        MAX(rowid) is one b-tree descent and overestimates a table that
+        had rows deleted. Returns None for a WITHOUT ROWID table that was
+        never analyzed.
+        """
+        now = time.monotonic()
+        cached = self._counts.get(table)
+        if cached is not None and now - cached[1] < self.count_ttl:
+            return cached[0]
+
+        with self._lock:
+            try:
+                count = None
+                for stat in self._stat(table).values():
+                    if stat:
+                        count = int(stat.split()[0])
+                        break
+                if count is None:
+                    quoted = table.replace('"', '""')
+                    count = self._connection().execute(f'SELECT MAX(rowid) FROM "{quoted}"').fetchone()[0] or 0
+            except sqlite3.Error:
+                return None
+
+        self._counts[table] = (count, now)
+        return count
+
+    def check(self, plan):
+        """
+        Apply the row-count guard to a plan
+
+        Returns:
+            tuple: (action, limit) where action is 'ok', 'limit' or 'refuse'
+                and limit is the row limit the plan went over
+        """
+        if (self.max_estimated_rows is None or plan.estimated_rows is None
+                or plan.estimated_rows <= self.max_estimated_rows):
+            return 'ok', None
+        if self.guard == 'refuse':
+            return 'refuse', self.max_estimated_rows
+        return 'limit', self.max_estimated_rows
+
+    def check_statement(self, sql_query):
+        """
+        Apply the row-count guard to a statement about to run
+
+        The estimate is taken at execution time, so a cached translation
+        follows its tables as they grow. Aggregates stay small however many
+        rows they join, so they are only ever refused, never limited.
+
+        Returns:
+            tuple: (action, limit, estimated rows); see check()
+        """
+        if self.max_estimated_rows is None or self.database is None:
+            return 'ok', None, None
+        plan = self.parse_plan(sql_query)
+        if plan is None:
+            return 'ok', None, None
+        plan.estimated_rows = self.estimate_rows(plan)
+        action, limit = self.check(plan)
+        if action == 'limit' and AGGREGATE_PATTERN.search(sql_query[:sql_query.find(' FROM ')]):
+            return 'ok', None, plan.estimated_rows
+        return action, limit, plan.estimated_rows
@@ -0,0 +1,147 @@
+import re
+
+from fuzzy_matcher import QUESTION_WORD_PATTERN
+
+# Characters replaced by spaces when a question is normalized: everything
+# but word characters, whitespace and basic punctuation
+NORMALIZE_PATTERN = re.compile(r'[^\w\s.,?]')
+
+# Numbers (incl. decimals) stay whole, like NLTK's word_tokenize
+TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)*|\w+|[^\w\s]")
+
+# Numeric literals in a normalized question; they become bound parameters
+NUMBER_PATTERN = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+class Run:
+    """
+    Analysis of one whitespace-separated run of a question ("customers,",
+    "3.5", "total_amount")
+
+    Offsets are relative to the start of the run. Runs are cached by their
+    text, so a word is analyzed once however many questions contain it.
+    """
+
+    __slots__ = ('text', 'tokens', 'kept', 'words', 'numbers')
+
+    def __init__(self, text, tokens, kept, words, numbers):
+        self.text = text
+        # Every token, and the tokens that are not stop words
+        self.tokens = tokens
+        self.kept = kept
+        # (start, end, word) for each [a-z]+ word, as the fuzzy matcher sees them
+        self.words = words
+        # (start, end, literal) for each number
+        self.numbers = numbers
+
+
+class Lexer:
+    """
+    Single-pass front end of the translator
+
+    A normalized question is split into whitespace-separated runs with
+    str.split, which is several times cheaper than a regex pass; each distinct run is tokenized, stop-word filtered and
+    searched for words and numbers once and then reused from a cache.
+    Query-type keywords are looked up in a dict built once. Since every
+    pattern involved stops at whitespace, analyzing runs one at a time gives
+    the same tokens as scanning the whole question.
+    """
+
+    def __init__(self, keywords=None, stop_words=(), max_cache=50000):
+        """
+        Args:
+            keywords (dict): Query type -> trigger words; the first type
+                (in dict order) with a word in the question wins
+            stop_words (iterable): Tokens dropped from ``kept``
+            max_cache (int): Distinct runs remembered
+        """
+        self.keywords = keywords or {}
+        self.stop_words = frozenset(stop_words)
+        self.max_cache = max_cache
+        # word -> position of its query type in keywords
+        self._ranks = {}
+        for rank, words in enumerate(self.keywords.values()):
+            for word in words:
+                self._ranks.setdefault(word, rank)
+        self._types = list(self.keywords)
+        self._cache = {}
+
+    def _analyze(self, text):
+        tokens = tuple(TOKEN_PATTERN.findall(text))
+        run = Run(text, tokens,
+                  tuple(token for token in tokens if token not in self.stop_words),
+                  tuple((m.start(), m.end(), m.group()) for m in QUESTION_WORD_PATTERN.finditer(text)),
+                  tuple((m.start(), m.end(), m.group()) for m in NUMBER_PATTERN.finditer(text)))
+        if len(self._cache) >= self.max_cache:
+            self._cache.clear()
+        self._cache[text] = run
+        return run
+
+    def lex(self, query):
+        """
+        Split a normalized question into runs
+
+        Returns:
+            list: (start offset, Run) pairs in order
+        """
+        cache = self._cache
+        runs = []
+        end = 0
+        for text in query.split():
+            # Runs are in order, so each starts at its first occurrence
+            # after the previous one
+            start = query.find(text, end)
+            end = start + len(text)
+            runs.append((start, cache.get(text) or self._analyze(text)))
+        return runs
+
+    def tokens(self, runs, keep_stop_words=False):
+        """Flatten the tokens of lexed runs, without stop words by default"""
+        if keep_stop_words:
+            return [token for _, run in runs for token in run.tokens]
+        return [token for _, run in runs for token in run.kept]
+
+    def words(self, runs):
+        """(start, end, word) of every [a-z]+ word, with offsets in the question"""
+        return [(offset + start, offset + end, word)
+                for offset, run in runs for start, end, word in run.words]
+
+    def numbers(self, runs):
+        """(start, end, literal) of every number, with offsets in the question"""
+        return [(offset + start, offset + end, literal)
+                for offset, run in runs for start, end, literal in run.numbers]
+
+    def query_type(self, tokens, default='select'):
+        """The first query type (in keyword table order) with a word in tokens"""
+        ranks = self._ranks
+        best = None
+        for token in tokens:
+            rank = ranks.get(token)
+            if rank is not None and (best is None or rank < best):
+                best = rank
+        return default if best is None else self._types[best]
+
+
+class PhraseTable:
+    """Whole-token lookup of (possibly multiword) phrases in a token list"""
+
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+        # first token -> remaining tokens of each phrase starting with it
+        self._heads = {}
+        for phrase in self.phrases:
+            first, *rest = phrase.split()
+            self._heads.setdefault(first, []).append((tuple(rest), phrase))
+
+    def find(self, tokens):
+        """
+        Returns:
+            set: The phrases occurring in tokens
+        """
+        found = set()
+        heads = self._heads
+        for i, token in enumerate(tokens):
+            for rest, phrase in heads.get(token, ()):
+                if not rest or tuple(tokens[i + 1:i + 1 + len(rest)]) == rest:
+                    found.add(phrase)
+        return found
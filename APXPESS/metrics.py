@@ -0,0 +1,230 @@
+import bisect
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency bucket upper bounds in seconds: 10us .. ~84s, doubling each time
+LATENCY_BUCKETS = tuple(0.00001 * 2 ** i for i in range(24))
+
+
+def statement_kind(sql_query):
+    """Label a generated statement by its leading keyword (select, insert, ...)"""
+    head = (sql_query or '').lstrip()[:6].lower()
+    return head if head in ('select', 'insert', 'update', 'delete') else 'other'
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram
+
+    Observing is one bisect and two additions under a lock, so it is cheap
+    enough to wrap every pipeline stage. Percentiles are interpolated from
+    the buckets, which bounds their error by the bucket width.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def percentile(self, q, snapshot=None):
+        """Estimate the q-th quantile (0 < q < 1) from the buckets"""
+        counts, count, _ = snapshot or self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Per-stage, per-query-type latency histograms plus scraped gauges"""
+
+    def __init__(self, namespace='nl2sql'):
+        self.namespace = namespace
+        # (stage, query_type) -> Histogram
+        self._histograms = {}
+        self._lock = threading.Lock()
+        # name -> callable returning {metric: value}
+        self._gauge_sources = {}
+
+    def histogram(self, stage, query_type='all'):
+        key = (stage, query_type)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, stage, seconds, query_type='all'):
+        self.histogram(stage, query_type).observe(seconds)
+
+    def observe_many(self, timings, query_type='all'):
+        """Record a list of (stage, seconds) measured for one request"""
+        for stage, seconds in timings:
+            self.histogram(stage, query_type).observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, query_type='all'):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, query_type)
+
+    def add_gauges(self, name, source):
+        """
+        Export the numeric values of a stats() dict on every scrape
+
+        Args:
+            name (str): Metric name prefix, e.g. 'pool'
+            source (callable): Returns a dict of counters and gauges
+        """
+        self._gauge_sources[name] = source
+
+    def summary(self):
+        """Return p50/p95/p99 per stage and query type as a dict"""
+        result = {}
+        for (stage, query_type), histogram in sorted(self._histograms.items()):
+            snapshot = histogram.snapshot()
+            result.setdefault(stage, {})[query_type] = {
+                'count': snapshot[1],
+                'p50': histogram.percentile(0.50, snapshot),
+                'p95': histogram.percentile(0.95, snapshot),
+                'p99': histogram.percentile(0.99, snapshot),
+            }
+        return result
+
+    def render_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        ns = self.namespace
+        lines = [
+            f'# HELP {ns}_stage_latency_seconds Latency of each translation and serving stage',
+            f'# TYPE {ns}_stage_latency_seconds histogram',
+        ]
+        quantile_lines = [
+            f'# HELP {ns}_stage_latency_quantile_seconds Estimated latency percentiles per stage',
+            f'# TYPE {ns}_stage_latency_quantile_seconds gauge',
+        ]
+        for (stage, query_type), histogram in sorted(self._histograms.items()):
+            counts, count, total = snapshot = histogram.snapshot()
+            labels = f'stage="{stage}",query_type="{query_type}"'
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{ns}_stage_latency_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'{ns}_stage_latency_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{ns}_stage_latency_seconds_sum{{{labels}}} {total:.9f}')
+            lines.append(f'{ns}_stage_latency_seconds_count{{{labels}}} {count}')
+            for q in (0.5, 0.95, 0.99):
+                quantile_lines.append(f'{ns}_stage_latency_quantile_seconds{{{labels},quantile="{q}"}} '
+                                      f'{histogram.percentile(q, snapshot):.9f}')
+        lines.extend(quantile_lines)
+
+        for name, source in sorted(self._gauge_sources.items()):
+            try:
+                values = source()
+            except Exception:
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f'# TYPE {ns}_{name}_{key} gauge')
+                lines.append(f'{ns}_{name}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in sampling profiler for slow requests
+
+    A sampled fraction of requests runs under cProfile; when one takes
+    longer than the threshold its profile is written as a ``.prof`` file,
+    which pstats, snakeviz and flameprof (flamegraph SVGs) can read.
+    Written profiles are counted in stats(), for export with the other
+    gauges (see MetricsRegistry.add_gauges).
+    """
+
+    def __init__(self, threshold_seconds, output_dir, sample_rate=1.0, max_dumps=1000):
+        self.threshold_seconds = threshold_seconds
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.max_dumps = max_dumps
+        self.dumps = 0
+        self.last_profile = None
+        self._profiled = 0
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def start(self):
+        """Return a running profiler for this request, or None if not sampled"""
+        if self.dumps >= self.max_dumps or random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        with self._lock:
+            self._profiled += 1
+        return profiler, time.perf_counter()
+
+    def stop(self, handle, label='request'):
+        """
+        Stop a profiler returned by start() and dump it if the request was slow
+
+        Returns:
+            str: Path of the written profile, or None
+        """
+        if handle is None:
+            return None
+        profiler, start = handle
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        if elapsed < self.threshold_seconds:
+            return None
+        safe_label = ''.join(ch if ch.isalnum() else '_' for ch in label)[:40]
+        path = os.path.join(self.output_dir,
+                            f'{time.strftime("%Y%m%d-%H%M%S")}-{int(elapsed * 1000)}ms-{safe_label}-{os.getpid()}.prof')
+        profiler.dump_stats(path)
+        with self._lock:
+            self.dumps += 1
+            self.last_profile = path
+        return path
+
+    def stats(self):
+        """Return profiled request and written profile counts, and the last profile's path"""
+        with self._lock:
+            return {
+                'profiled': self._profiled,
+                'dumps': self.dumps,
+                'max_dumps': self.max_dumps,
+                'last_profile': self.last_profile,
+            }
+
+
+# Shared by the translator and the web handlers
+registry = MetricsRegistry()
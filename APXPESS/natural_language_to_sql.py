@@ -1,17 +1,166 @@
 import re
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+import os
+import sys
+import json
+import time
+import copy
+import hashlib
+import threading
+from entity_matcher import EntityMatcher
+from fuzzy_matcher import FuzzyMatcher, name_words
+from translation_cache import TranslationCache
+from join_planner import JoinPlanner
+from select_statement import SelectStatement
+from lexer import Lexer, PhraseTable, NORMALIZE_PATTERN, NUMBER_PATTERN, TOKEN_PATTERN
 
-# Download necessary NLTK data
-try:
-    nltk.download('punkt', quiet=True)
-    nltk.download('stopwords', quiet=True)
-except:
-    print("Note: NLTK data download failed, but we'll continue")
+# NLTK is optional and loaded on first use. Importing this module never
+# touches the network; when NLTK or its data files are missing, the
+# built-in tokenizer and stopword list below are used instead. Call
+# download_nltk_data() once at deploy time to use NLTK's resources.
+_tokenizer = None
+_stop_words = None
+
+# Dates written as YYYY-MM-DD
+DATE_PATTERN = re.compile(r'\b\d{4}-\d{1,2}-\d{1,2}\b')
+
+# Words and phrases that introduce a date condition
+DATE_PHRASES = [
+    'before', 'after', 'between', 'since',
+    'from', 'to', 'earlier than', 'later than',
+    'today', 'yesterday', 'last week', 'last month',
+    'this year', 'previous year'
+]
+
+# Follow-up questions that refine the previous answer of a conversation:
+# "only the ones from canada", "sort those by price", "top 5 by total"
+FOLLOW_UP_PATTERN = re.compile(
+    r'^\s*(?:only|just|and|but|now|then|also|sort|order|rank|filter|keep|limit|top|first|among)\b'
+    r'|\b(?:those|these|them|the ones|ones|the results?)\b')
+# "sort those by", "ordered by", "top 5 by"; the column follows
+SORT_PATTERN = re.compile(
+    r'\b(?:sort(?:ed)?|order(?:ed)?|rank(?:ed)?|top\s+\d+|first\s+\d+)\b(?:\s+\w+){0,3}?\s+by\s+')
+DESCENDING_PATTERN = re.compile(r'\b(?:desc|descending|highest|largest|biggest|most|decreasing|reverse|top)\b')
+LIMIT_PATTERN = re.compile(r'\b(?:top|first)\s+(\d+)\b')
+
+# Aggregate questions: "how many tracks per genre", "average price by
+# category", "sum of total_amount". "count" is also a common word inside
+# names, so it only counts at the start of a question or in "count of".
+# The loose words are also plain adjectives and column names ("orders
+# with total amount over 100"), so they only aggregate when the question
+# also groups ("total sales per country", "highest price by category").
+AGGREGATE_PATTERN = re.compile(
+    r'\b(?:(?P<COUNT>how many|number of|^\s*count|count of)|(?P<SUM>sum)|(?P<AVG>average|avg|mean)'
+    r'|(?P<MAX>maximum|max)|(?P<MIN>minimum|min)'
+    r'|(?P<loose_SUM>total)|(?P<loose_MAX>highest|largest)|(?P<loose_MIN>lowest|smallest))\b')
+# Introduces what an aggregate is grouped by; the names follow
+GROUP_PATTERN = re.compile(r'\b(?:per|by|for each|for every|each)\s+')
+# What may separate two grouping names: "by country and genre"
+GROUP_SEPARATOR_PATTERN = re.compile(r'(?:\s|,|\band\b|\bthe\b)*\Z')
+# Declared types of columns that can be summed and averaged
+NUMERIC_TYPES = ('INT', 'REAL', 'FLOA', 'DOUB', 'NUM', 'DEC')
+
+BUILTIN_STOP_WORDS = frozenset(['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 
+    "you're", "you've", "you'll", "you'd", 'your', 'yours', 'yourself', 
+    'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 'her', 
+    'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 
+    'their', 'theirs', 'themselves', 'what', 'which', 'who', 'whom', 
+    'this', 'that', "that'll", 'these', 'those', 'am', 'is', 'are', 'was',
+    'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do', 
+    'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 
+    'because', 'as', 'until', 'while', 'of', 'at', 'by', 'for', 'with', 
+    'about', 'against', 'between', 'into', 'through', 'during', 'before', 
+    'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 
+    'on', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 
+    'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both', 
+    'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 
+    'not', 'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 
+    'can', 'will', 'just', 'don', "don't", 'should', "should've", 'now', 
+    'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't", 
+    'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', 
+    "hadn't", 'hasn', "hasn't", 'haven', "haven't", 'isn', "isn't", 'ma', 
+    'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan', 
+    "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 
+    'won', "won't", 'wouldn', "wouldn't"])
+
+def _nltk_data_installed(*resources):
+    """
+    Check NLTK's default data directories for any of the given resources
+    
+    Done without importing nltk, which alone takes hundreds of
+    milliseconds, so hosts without the data never pay for it.
+    """
+    paths = [p for p in os.environ.get('NLTK_DATA', '').split(os.pathsep) if p]
+    paths.append(os.path.expanduser('~/nltk_data'))
+    for prefix in (sys.prefix, '/usr/share', '/usr/local/share', '/usr/lib', '/usr/local/lib'):
+        paths.append(os.path.join(prefix, 'nltk_data'))
+    paths.extend(os.path.join(sys.prefix, sub, 'nltk_data') for sub in ('share', 'lib'))
+    return any(os.path.exists(os.path.join(path, resource)) or
+               os.path.exists(os.path.join(path, resource + '.zip'))
+               for path in paths for resource in resources)
+
+def builtin_tokenize(text):
+    """Regex tokenizer used when NLTK's punkt data is not available"""
+    return TOKEN_PATTERN.findall(text)
+
+def get_tokenizer():
+    """Return NLTK's word_tokenize if its data is installed, else builtin_tokenize"""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = builtin_tokenize
+        if not _nltk_data_installed('tokenizers/punkt_tab', 'tokenizers/punkt'):
+            return _tokenizer
+        try:
+            from nltk.tokenize import word_tokenize
+            # Raises LookupError when the punkt data is not installed
+            word_tokenize('probe')
+            _tokenizer = word_tokenize
+        except Exception:
+            _tokenizer = builtin_tokenize
+    return _tokenizer
+
+def get_stop_words():
+    """Return NLTK's English stopwords if installed, else BUILTIN_STOP_WORDS"""
+    global _stop_words
+    if _stop_words is None:
+        _stop_words = BUILTIN_STOP_WORDS
+        if not _nltk_data_installed('corpora/stopwords'):
+            return _stop_words
+        try:
+            from nltk.corpus import stopwords
+            _stop_words = frozenset(stopwords.words('english'))
+        except Exception:
+            _stop_words = BUILTIN_STOP_WORDS
+    return _stop_words
+
+def download_nltk_data():
+    """Fetch the NLTK data files; meant for deploy time, not for startup"""
+    global _tokenizer, _stop_words
+    import nltk
+    for package in ('punkt', 'punkt_tab', 'stopwords'):
+        nltk.download(package, quiet=True)
+    _tokenizer = None
+    _stop_words = None
+
+def parse_number(text):
+    """Convert a numeric literal from a question to the int or float to bind"""
+    if '.' in text:
+        return float(text)
+    number = int(text)
+    # sqlite integers are 64-bit; it reads larger literals as REAL too
+    return number if -2 ** 63 <= number < 2 ** 63 else float(number)
+
+# Translator owned by each process-pool worker of generate_sql_batch
+_worker_translator = None
+
+def _init_batch_worker(db_schema):
+    global _worker_translator
+    _worker_translator = NaturalLanguageToSQL(db_schema=db_schema, translation_cache=False)
+
+def _translate_batch_chunk(items):
+    return [_worker_translator._translate_normalized(shape, query) for shape, query in items]
 
 class NaturalLanguageToSQL:
-    def __init__(self, db_schema=None):
+    def __init__(self, db_schema=None, translation_cache=None):
         """
         Initialize the NL to SQL converter with optional database schema
         
@@ -21,34 +170,42 @@ class NaturalLanguageToSQL:
                     'customers': ['id', 'name', 'email', 'signup_date'],
                     'orders': ['id', 'customer_id', 'order_date', 'total_amount']
                 }
+            translation_cache (TranslationCache): Cache for generated SQL;
+                an in-memory cache is created when None, pass False to disable
         """
-        self.db_schema = db_schema
-        try:
-            self.stop_words = set(stopwords.words('english'))
-        except:
-            # Fallback if NLTK download failed
-            self.stop_words = set(['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 
-                               "you're", "you've", "you'll", "you'd", 'your', 'yours', 'yourself', 
-                               'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 'her', 
-                               'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 
-                               'their', 'theirs', 'themselves', 'what', 'which', 'who', 'whom', 
-                               'this', 'that', "that'll", 'these', 'those', 'am', 'is', 'are', 'was',
-                               'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do', 
-                               'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 
-                               'because', 'as', 'until', 'while', 'of', 'at', 'by', 'for', 'with', 
-                               'about', 'against', 'between', 'into', 'through', 'during', 'before', 
-                               'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 
-                               'on', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 
-                               'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both', 
-                               'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 
-                               'not', 'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 
-                               'can', 'will', 'just', 'don', "don't", 'should', "should've", 'now', 
-                               'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't", 
-                               'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', 
-                               "hadn't", 'hasn', "hasn't", 'haven', "haven't", 'isn', "isn't", 'ma', 
-                               'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan', 
-                               "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 
-                               'won', "won't", 'wouldn', "wouldn't"])
+        if translation_cache is None:
+            translation_cache = TranslationCache()
+        self.translation_cache = translation_cache or None
+        self.schema_version = None
+
+        # Precompiled matcher over table names, column names and condition
+        # phrases; kept in sync with the schema by the db_schema setter
+        self._entity_matcher = EntityMatcher()
+        self._entity_order = {}
+        self._schema_entities = set()
+        self._db_schema = None
+        # Guards the references to the schema and its matchers, which a
+        # refresh replaces (never mutates) so questions can be matched
+        # outside the lock; _update_lock serializes the refreshes
+        self._schema_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        # Introspected SchemaCatalog (column types, foreign keys), if any
+        self.catalog = None
+        # Column values (e.g. 'Canada') resolved to "column = value"; see
+        # set_value_index
+        self._value_entities = set()
+        self.value_version = None
+        # Plans JOINs when a question touches several tables
+        self.join_planner = JoinPlanner()
+        # Typo- and synonym-tolerant second pass over table and column
+        # names ("emial", "invoice lines", "amount spent"); None disables it
+        self.fuzzy_matcher = FuzzyMatcher()
+
+        self._stop_words = None
+        # MetricsRegistry receiving per-stage latencies, if any
+        self.metrics = None
+        # QueryGovernor bounding execute_query / iter_query, if any
+        self.governor = None
         
         # Keywords for query type detection
         self.query_keywords = {
@@ -85,93 +242,307 @@ class NaturalLanguageToSQL:
             'begins with': 'LIKE',
             'ends with': 'LIKE'
         }
+
+        for condition_phrase, operator in self.condition_mapping.items():
+            self._entity_matcher.add(condition_phrase, ('condition', condition_phrase, operator))
+
+        # Tokenizes questions once per distinct word; rebuilt when the stop
+        # words change
+        self.lexer = Lexer(self.query_keywords, self.stop_words)
+        self._date_phrases = PhraseTable(DATE_PHRASES)
+
+        # Words that never name a table or column, so they are not corrected
+        self.fuzzy_matcher.ignore_words = frozenset(BUILTIN_STOP_WORDS).union(
+            *self.query_keywords.values(),
+            *(phrase.split() for phrase in self.condition_mapping))
+
+        self.db_schema = db_schema
+
+    @property
+    def stop_words(self):
+        if self._stop_words is None:
+            return get_stop_words()
+        return self._stop_words
+
+    @stop_words.setter
+    def stop_words(self, stop_words):
+        self._stop_words = stop_words
+        self.lexer = Lexer(self.query_keywords, self.stop_words)
+
+    @property
+    def db_schema(self):
+        return self._db_schema
+
+    @db_schema.setter
+    def db_schema(self, db_schema):
+        with self._update_lock:
+            self._update_entity_matcher(db_schema)
+        self._update_schema_version()
+
+    def _update_schema_version(self):
+        # Translations are keyed on the schema version, so changing the
+        # schema (or the indexed values) makes every cached translation
+        # unreachable
+        key = self._db_schema if self.value_version is None else [self._db_schema, self.value_version]
+        self.schema_version = hashlib.sha1(
+            json.dumps(key, default=str).encode('utf-8')).hexdigest()[:16]
+        if self.translation_cache is not None:
+            self.translation_cache.invalidate(self.schema_version)
+
+    def set_catalog(self, catalog):
+        """
+        Use an introspected SchemaCatalog as the schema
+        
+        The catalog's tables and columns become db_schema, and its column
+        types and foreign-key graph are available to the generator through
+        self.catalog.
+        """
+        self.catalog = catalog
+        if self.join_planner is not None:
+            self.join_planner.catalog = catalog
+        self.db_schema = catalog.as_db_schema()
+        
+    def set_value_index(self, value_index):
+        """
+        Resolve the values of a ValueIndex to "column = value" predicates
+        
+        Values are added to the entity matcher, so they are found in the
+        same pass as tables and columns; only values that were added or
+        removed since the last call touch the automaton. Values that
+        normalize to fewer than three characters (unless they are
+        abbreviations such as 'UK'), contain digits (those become
+        parameters), or are stop words or schema names are skipped.
+        """
+        schema_names = {payload[1].lower() for payload in self._schema_entities}
+        stop_words = self.stop_words
+        entities = set()
+        for (table, column), values in value_index.values.items():
+            for value in values:
+                pattern = self.normalize_query(value).strip()
+                if ((len(pattern) < 3 and not (len(pattern) == 2 and value.isupper()))
+                        or NUMBER_PATTERN.search(pattern)
+                        or pattern in stop_words or pattern in schema_names):
+                    continue
+                entities.add((pattern, ('value', table, column, value)))
+        
+        with self._update_lock:
+            matcher = self._entity_matcher.copy()
+            for pattern, payload in self._value_entities - entities:
+                matcher.remove(pattern, payload)
+            for pattern, payload in entities - self._value_entities:
+                matcher.add(pattern, payload)
+            matcher.build()
+            with self._schema_lock:
+                self._entity_matcher = matcher
+            self._value_entities = entities
+        self.value_version = value_index.version
+        self._update_schema_version()
+        
+    def _update_entity_matcher(self, db_schema):
+        """
+        Publish a schema together with matchers built for it
+
+        Only patterns for tables and columns that were added or removed
+        since the last call touch (a copy of) the automaton; the
+        registration order used to keep entity output stable is rebuilt
+        from the schema. Caller holds _update_lock.
+        """
+        order = {}
+        for table, columns in (db_schema or {}).items():
+            order.setdefault(('table', table, table), len(order))
+            for column in columns:
+                order.setdefault(('column', column, table), len(order))
+
+        entities = set(order)
+        matcher = self._entity_matcher.copy()
+        for payload in self._schema_entities - entities:
+            matcher.remove(payload[1].lower(), payload)
+        for payload in entities - self._schema_entities:
+            matcher.add(payload[1].lower(), payload)
+        matcher.build()
+        fuzzy_matcher = self.fuzzy_matcher
+        if fuzzy_matcher is not None:
+            # Columns are also reachable through their table: "track name".
+            # build() replaces the whole index, so a shallow copy keeps the
+            # settings without sharing anything build() changes
+            names = [(payload[1], payload) for payload in order]
+            names.extend((f'{payload[2]} {payload[1]}', payload) for payload in order if payload[0] == 'column')
+            fuzzy_matcher = copy.copy(fuzzy_matcher)
+            fuzzy_matcher.build(names)
+
+        # Conditions always come after schema entities, in mapping order
+        for condition_phrase, operator in self.condition_mapping.items():
+            order[('condition', condition_phrase, operator)] = len(order)
+
+        with self._schema_lock:
+            self._db_schema = db_schema
+            self._entity_matcher = matcher
+            self.fuzzy_matcher = fuzzy_matcher
+            self._entity_order = order
+        self._schema_entities = entities
+
+    def normalize_query(self, natural_query):
+        """Lowercase the query and strip special characters"""
+        # Lowercase, and remove special characters but keep some basic
+        # punctuation
+        return NORMALIZE_PATTERN.sub(' ', natural_query.lower())
+        
+    def lex(self, natural_query):
+        """
+        Normalize a query and split it into lexed runs (see lexer.Lexer)
+        
+        Returns:
+            tuple: (normalized query, list of (offset, Run))
+        """
+        query = self.normalize_query(natural_query)
+        return query, self.lexer.lex(query)
         
     def preprocess_query(self, natural_query):
         """Clean and normalize the natural language query"""
-        # Convert to lowercase
-        query = natural_query.lower()
+        query, runs = self.lex(natural_query)
+        return query, self._filtered_tokens(query, runs)
         
-        # Remove special characters, but keep some basic punctuation
-        query = re.sub(r'[^\w\s.,?]', ' ', query)
+    def _filtered_tokens(self, query, runs):
+        """The tokens of a query without stop words"""
+        tokenizer = get_tokenizer()
+        if tokenizer is builtin_tokenize:
+            # Same tokens, already split and filtered by the lexer
+            return self.lexer.tokens(runs)
         
         # Tokenize and remove stop words for analysis
         try:
-            tokens = word_tokenize(query)
+            tokens = tokenizer(query)
         except:
             # Fallback tokenization if NLTK fails
             tokens = query.split()
-            
-        filtered_tokens = [word for word in tokens if word not in self.stop_words]
-        
-        return query, filtered_tokens
+        return [word for word in tokens if word not in self.stop_words]
         
     def detect_query_type(self, tokens):
         """Determine the likely SQL query type based on the natural language"""
-        for query_type, keywords in self.query_keywords.items():
-            if any(keyword in tokens for keyword in keywords):
-                return query_type
-        return 'select'  # Default to SELECT if no clear indicator
+        # Default to SELECT if no clear indicator
+        return self.lexer.query_type(tokens, 'select')
         
-    def identify_entities(self, query):
+    def identify_entities(self, query, runs=None):
         """
         Identify entities (tables, columns, values) from the query
         This is a simple implementation - a real system would use NER
+        
+        Args:
+            query (str): The normalized query
+            runs (list): The query's lexed runs, when already computed
         """
+        if runs is None:
+            runs = self.lexer.lex(query)
         entities = {
             'tables': [],
             'columns': [],
             'conditions': [],
-            'values': []
+            'values': [],
+            'value_spans': [],
+            'literals': [],
+            'spans': [],
+            'column_tables': {}
         }
-        
+
+        # Single pass over the query finds every table, column and
+        # condition phrase together with its character offsets
+        hits = {}
+        # (start, end) -> value payloads found there
+        value_hits = {}
+        spans = entities['spans']
+        # One consistent set of schema and matchers; a refresh publishes new
+        # ones instead of changing these, so matching needs no lock
+        with self._schema_lock:
+            has_schema = bool(self._db_schema)
+            entity_order = self._entity_order
+            matcher = self._entity_matcher
+            fuzzy_matcher = self.fuzzy_matcher
+        for start, end, pattern in matcher.find_in_runs(query, runs):
+            for payload in matcher.payloads(pattern):
+                kind = payload[0]
+                if kind == 'value':
+                    # Values must be whole words: 'usa' but not 'usage'
+                    if has_schema and ((start == 0 or not query[start - 1].isalnum())
+                                       and (end == len(query) or not query[end].isalnum())):
+                        value_hits.setdefault((start, end), []).append(payload)
+                    continue
+                if kind != 'condition' and not has_schema:
+                    continue
+                spans.append((start, end, kind, payload[1]))
+                if payload not in hits:
+                    hits[payload] = start
+        # Names the exact pass missed: typos, plurals, spaced or
+        # synonymous spellings
+        if fuzzy_matcher is not None and has_schema:
+            for start, end, payload, _ in fuzzy_matcher.find(query, self.lexer.words(runs)):
+                if payload not in hits:
+                    spans.append((start, end, payload[0], payload[1]))
+                    hits[payload] = start
+
         # If no schema is provided, we'll have to make our best guess
-        if not self.db_schema:
+        if not has_schema:
             return entities
-            
-        # Check each table in the schema
-        for table, columns in self.db_schema.items():
-            # Check if table name is in the query
-            if table.lower() in query:
-                if table not in entities['tables']:
-                    entities['tables'].append(table)
-                
-            # Check for column names
-            for column in columns:
-                if column.lower() in query:
-                    if column not in entities['columns']:
-                        entities['columns'].append(column)
-                    if table not in entities['tables']:
-                        entities['tables'].append(table)
-        
+
+        # Emit entities in schema order so the generated SQL is stable
+        for payload in sorted(hits, key=entity_order.__getitem__):
+            kind, name, extra = payload
+            if kind == 'table':
+                if name not in entities['tables']:
+                    entities['tables'].append(name)
+            elif kind == 'column':
+                if name not in entities['columns']:
+                    entities['columns'].append(name)
+                entities['column_tables'].setdefault(name, []).append(extra)
+                if extra not in entities['tables']:
+                    entities['tables'].append(extra)
+            else:
+                entities['conditions'].append((name, extra))
+
+        # Values become "column = value", preferably on a table the question
+        # mentions; otherwise the value's table is added (and joined). Longer
+        # values win over values and schema names they overlap.
+        taken = [(start, end) for start, end, kind, _ in spans if kind != 'condition'] if value_hits else []
+        mentioned = list(entities['tables'])
+        for start, end in sorted(value_hits, key=lambda span: (span[0], span[0] - span[1])):
+            if any(s < end and start < e for s, e in taken):
+                continue
+            payloads = sorted(value_hits[(start, end)])
+            chosen = [payload for payload in payloads if payload[1] in mentioned] or payloads
+            _, table, column, value = chosen[0]
+            if table not in entities['tables']:
+                entities['tables'].append(table)
+            entities['literals'].append((table, column, value))
+            entities['spans'].append((start, end, 'value', f'{table}.{column}'))
+            taken.append((start, end))
+
         # Extract potential numeric values
-        numbers = re.findall(r'\b\d+(?:\.\d+)?\b', query)
-        if numbers:
-            entities['values'].extend(numbers)
-            
-        # Look for condition keywords
-        for condition_phrase, operator in self.condition_mapping.items():
-            if condition_phrase in query:
-                entities['conditions'].append((condition_phrase, operator))
-                
+        for start, end, literal in self.lexer.numbers(runs):
+            entities['values'].append(literal)
+            entities['value_spans'].append((start, end))
+
         return entities
+
+    def extract_date_conditions(self, query, runs=None):
+        """
+        Extract date-related conditions from query
         
-    def extract_date_conditions(self, query):
-        """Extract date-related conditions from query"""
+        Args:
+            query (str): The normalized query
+            runs (list): Its lexed runs, when already computed; the runs of
+                its parameterized shape do as well (phrases have no digits)
+        """
         date_conditions = []
         
         # Check for date patterns (YYYY-MM-DD)
-        dates = re.findall(r'\b\d{4}-\d{1,2}-\d{1,2}\b', query)
-        
-        # Look for date-related phrases
-        date_phrases = [
-            'before', 'after', 'between', 'since', 
-            'from', 'to', 'earlier than', 'later than',
-            'today', 'yesterday', 'last week', 'last month',
-            'this year', 'previous year'
-        ]
-        
-        for phrase in date_phrases:
-            if phrase in query:
+        dates = DATE_PATTERN.findall(query)
+        
+        # Look for date-related phrases, as whole words
+        if runs is None:
+            runs = self.lexer.lex(query)
+        found = self._date_phrases.find(self.lexer.tokens(runs, keep_stop_words=True))
+        
+        for phrase in DATE_PHRASES:
+            if phrase in found:
                 # If we find both a date phrase and dates, pair them
                 if dates:
                     for date in dates:
@@ -181,58 +552,457 @@ class NaturalLanguageToSQL:
                     
         return date_conditions
     
+    def parse_refinement(self, natural_query, tables, columns=()):
+        """
+        Read a follow-up question as a refinement of the previous answer
+        
+        "only the ones from canada", "only those with price over 500",
+        "sort those by price descending" and "top 3 by total amount" narrow
+        or reorder the previous result instead of asking a new question.
+        Columns are resolved against the tables of the previous question.
+        
+        Args:
+            natural_query (str): The follow-up question
+            tables (list): Tables of the previous question
+            columns (list): Columns the previous question selected; a lone
+                one is the subject of a bare "only those over 500". Names
+                no previous table has are aggregate outputs ("count"),
+                found in the question by name and returned with table None
+        
+        Returns:
+            dict: {'filters': [(table, column, operator, value)],
+                'order': (table, column, descending) or None,
+                'limit': int or None}, or None when the question is not a
+                follow-up or names something the previous tables lack
+        """
+        query, runs = self.lex(natural_query)
+        if not FOLLOW_UP_PATTERN.search(query) or not self.db_schema:
+            return None
+        entities = self.identify_entities(query, runs)
+        schema = self.db_schema
+        
+        def owner(column, candidates=()):
+            # The previous table that has the column
+            for table in list(candidates) + list(tables):
+                if table in tables and column in schema.get(table, ()):
+                    return table
+            return None
+        
+        # A question about a table of its own starts over
+        for _, _, kind, name in entities['spans']:
+            if kind == 'table' and name not in tables:
+                return None
+        
+        # Aggregate outputs named in the question: "only those with count
+        # over 3" compares with the count, not with the grouped column
+        outputs = [column for column in columns
+                   if not any(column in schema.get(table, ()) for table in tables)]
+        spans = list(entities['spans'])
+        for column in outputs:
+            for match in re.finditer(rf'\b{re.escape(column.lower())}s?\b', query):
+                spans.append((match.start(), match.end(), 'column', column))
+        spans.sort()
+        
+        def resolve(column):
+            if column in outputs:
+                return None, True
+            table = owner(column, entities['column_tables'].get(column, ()))
+            return table, table is not None
+        
+        refinement = {'filters': [], 'order': None, 'limit': None}
+        used = set()
+        limit = LIMIT_PATTERN.search(query)
+        if limit:
+            refinement['limit'] = int(limit.group(1))
+            used.add(limit.start(1))
+        sort = SORT_PATTERN.search(query)
+        if sort:
+            for start, _, kind, name in spans:
+                if kind == 'column' and start >= sort.end():
+                    table, found = resolve(name)
+                    if not found:
+                        return None
+                    descending = bool(DESCENDING_PATTERN.search(query))
+                    refinement['order'] = (table, name, descending)
+                    used.add(start)
+                    break
+            else:
+                return None
+        
+        # Values from the value index: "from canada", "the pending ones"
+        for table, column, value in entities['literals']:
+            table = owner(column, [table])
+            if table is None:
+                return None
+            refinement['filters'].append((table, column, '=', value))
+        
+        # Numbers compare with the closest column mentioned before them,
+        # else with the previous question's only column
+        column_spans = [(start, end, name) for start, end, kind, name in spans
+                        if kind == 'column' and start not in used]
+        for value, (value_start, _) in zip(entities['values'], entities['value_spans']):
+            if value_start in used:
+                continue
+            before = [span for span in column_spans if span[1] <= value_start]
+            if before:
+                column_start, column_end, column = before[-1]
+            elif len(columns) == 1:
+                column_start, column_end, column = 0, 0, columns[0]
+            else:
+                return None
+            table, found = resolve(column)
+            if not found:
+                return None
+            operator = '='
+            between = query[column_end:value_start]
+            for condition_text, op in entities['conditions']:
+                if condition_text in between:
+                    operator = op
+                    break
+            refinement['filters'].append((table, column, operator, parse_number(value)))
+        
+        if not refinement['filters'] and refinement['order'] is None and refinement['limit'] is None:
+            return None
+        return refinement
+        
+    def detect_aggregate(self, query, entities):
+        """
+        Find the aggregate a question asks for and what it is grouped by
+        
+        "total sales per country" sums Invoice.Total by BillingCountry and
+        "how many tracks per genre" counts Track rows by genre. A table
+        named as the grouping is grouped by its key and shown by the
+        columns naming its rows (Name, Title, FirstName / LastName). A
+        grouping column is looked for in the aggregated table first, also
+        under a longer name ending the same way (country -> BillingCountry).
+        
+        Args:
+            query (str): The normalized question
+            entities (dict): Its entities (see identify_entities)
+        
+        Returns:
+            dict: {'function': 'COUNT', 'SUM', 'AVG', 'MAX' or 'MIN',
+                'table': the aggregated table,
+                'measure': (table, column), None for COUNT(*),
+                'groups': [(table, key column, shown columns)]}, or None
+                when the question is not an aggregate
+        """
+        match = AGGREGATE_PATTERN.search(query)
+        if match is None or not self.db_schema:
+            return None
+        function = match.lastgroup.rsplit('_', 1)[-1]
+        marker = GROUP_PATTERN.search(query, match.end())
+        if match.lastgroup.startswith('loose') and marker is None:
+            return None
+        column_tables = entities['column_tables']
+        
+        # Tables and columns in question order, each once
+        spans = sorted({(start, end, kind, name) for start, end, kind, name in entities['spans']
+                        if kind in ('table', 'column')})
+        end = marker.start() if marker is not None else len(query)
+        mentioned = [name for start, _, kind, name in spans if kind == 'table' and start < end]
+        
+        # The names right after "per" / "by", separated by "and" or commas
+        grouped = []
+        if marker is not None:
+            position = marker.end()
+            for start, stop, kind, name in spans:
+                if start < position:
+                    continue
+                if not GROUP_SEPARATOR_PATTERN.match(query, position, start):
+                    break
+                grouped.append((kind, name))
+                position = stop
+            if not grouped:
+                return None
+        
+        # What is summed, averaged...: the first numeric column after the
+        # function word, else the one it is part of ("total" is a column)
+        measure = None
+        if function != 'COUNT':
+            def numeric(name):
+                return any(self._is_numeric(table, name) for table in column_tables.get(name, ()))
+            after = [name for start, _, kind, name in spans
+                     if kind == 'column' and match.end() <= start < end and numeric(name)]
+            within = [name for start, stop, kind, name in spans
+                      if kind == 'column' and start < match.end() and stop > match.start() and numeric(name)]
+            if not after and not within:
+                return None
+            measure = (after or within)[0]
+        
+        graph = self.join_planner.graph(self.db_schema) if self.join_planner is not None else {}
+        
+        def nearest(candidates, targets):
+            # The candidate table with the fewest joins to any of targets
+            def distance(table):
+                lengths = [0 if table == target else len(self.join_planner.shortest_path(graph, table, target) or graph)
+                           for target in targets] if graph else []
+                return min(lengths, default=0)
+            return min(candidates, key=distance)
+        
+        group_tables = [name for kind, name in grouped if kind == 'table']
+        if measure is not None:
+            owners = column_tables[measure]
+            table = next((owner for owner in owners if owner in mentioned), None)
+            if table is None:
+                table = nearest(owners, group_tables) if group_tables else owners[0]
+            measure = (table, measure)
+        else:
+            table = next((name for name in mentioned if name not in group_tables), None)
+            if table is None:
+                first_columns = [name for kind, name in grouped if kind == 'column']
+                if not first_columns:
+                    return None
+                table = column_tables[first_columns[0]][0]
+        
+        groups = []
+        for kind, name in grouped:
+            if kind == 'table':
+                key = self._key_column(name)
+                group = (name, key, self._label_columns(name) or [key])
+            else:
+                group = self._group_column(name, table, mentioned, column_tables.get(name, []), nearest)
+            if group not in groups:
+                groups.append(group)
+        return {'function': function, 'table': table, 'measure': measure, 'groups': groups}
+        
+    def _group_column(self, column, table, mentioned, owners, nearest):
+        """(table, column, [column]) grouping by a column, preferring the aggregated table"""
+        if table in owners:
+            return (table, column, [column])
+        words = name_words(column)
+        for candidate in self.db_schema.get(table, ()):
+            candidate_words = name_words(candidate)
+            if len(candidate_words) > len(words) and candidate_words[-len(words):] == words:
+                return (table, candidate, [candidate])
+        owner = next((owner for owner in owners if owner in mentioned), None) or nearest(owners, [table])
+        return (owner, column, [column])
+        
+    def _is_numeric(self, table, column):
+        """False when the catalog declares a column with a non-numeric type"""
+        if self.catalog is None:
+            return True
+        declared = self.catalog.column_types(table).get(column)
+        return not declared or any(numeric in declared for numeric in NUMERIC_TYPES)
+        
+    def _key_column(self, table):
+        """The primary key of a table, else its id column, else its first column"""
+        if self.catalog is not None:
+            for column in self.catalog.tables.get(table, {}).get('columns', []):
+                if column['pk'] == 1:
+                    return column['name']
+        columns = self.db_schema.get(table, [])
+        return 'id' if 'id' in columns else columns[0]
+        
+    def _label_columns(self, table):
+        """Up to two columns naming the rows of a table (Name, Title, FirstName and LastName)"""
+        return [column for column in self.db_schema.get(table, [])
+                if {'name', 'title'} & set(name_words(column))][:2]
+        
+    def _where_clauses(self, query, entities, column_names, plan):
+        """
+        WHERE conditions of a SELECT from the numbers and values of a question
+        
+        Args:
+            column_names (dict): Mentioned column -> its reference in the
+                statement
+            plan (JoinPlan): Tables joined, None for a single table
+        
+        Returns:
+            tuple: (conditions, params)
+        """
+        where_clauses = []
+        params = []
+        
+        # Each number compares with the closest column mentioned before it
+        # ("stock less than 10"), else the closest one after it; of the
+        # columns matched at that mention, the longest match wins
+        # (BillingPostalCode over PostalCode), then the one named exactly
+        # as written (InvoiceLineId over a fuzzy InvoiceId). The query is lowercased, so
+        # mixed-case column names are located through the matcher spans.
+        # Only the order of the mentions counts, which is the same in the
+        # question and in its shape (see parameterize_query), so the
+        # translation of a shape holds for all of its questions.
+        column_spans = sorted((start, end, name) for start, end, kind, name in entities['spans']
+                              if kind == 'column' and name in column_names)
+        
+        def longest_at(closest, spans):
+            return max((span for span in spans if span[0] < closest[1] and closest[0] < span[1]),
+                       key=lambda span: (span[1] - span[0], query[span[0]:span[1]] == span[2].lower()))
+        
+        for value, (value_start, value_end) in zip(entities['values'], entities['value_spans']):
+            before = [span for span in column_spans if span[1] <= value_start]
+            after = [span for span in column_spans if span[0] >= value_end]
+            if before:
+                _, column_end, column = longest_at(max(before, key=lambda span: span[1]), before)
+                between = query[column_end:value_start]
+            elif after:
+                column_start, _, column = longest_at(min(after), after)
+                between = query[value_end:column_start]
+            else:
+                continue
+            
+            # Determine the operator (default to = if unclear)
+            operator = '='
+            for condition_text, op in entities['conditions']:
+                if condition_text in between:
+                    operator = op
+                    break
+                    
+            # For LIKE conditions, add wildcards
+            if operator == 'LIKE':
+                where_clauses.append(f"{column_names[column]} LIKE '%' || ? || '%'")
+            else:
+                where_clauses.append(f"{column_names[column]} {operator} ?")
+            params.append(parse_number(value))
+        
+        # Values recognised by the value index
+        for table, column, value in entities['literals']:
+            if plan is not None and table not in plan.tables:
+                continue
+            qualified = f"{table}.{column}" if plan is not None and len(plan.tables) > 1 else column
+            where_clauses.append(f"{qualified} = ?")
+            params.append(value)
+        return where_clauses, params
+        
+    def _aggregate_sql(self, query, entities, aggregate):
+        """
+        Generate the GROUP BY statement of an aggregate question
+        
+        The aggregated table comes first in FROM, followed by the tables
+        of the groups and of recognised values, joined along foreign keys.
+        
+        Returns:
+            tuple: (SelectStatement, params)
+        """
+        tables = [aggregate['table']]
+        for table, _, _ in aggregate['groups']:
+            if table not in tables:
+                tables.append(table)
+        for table, _, _ in entities['literals']:
+            if table not in tables:
+                tables.append(table)
+        
+        plan = None
+        from_clause = ', '.join(tables)
+        if len(tables) > 1 and self.join_planner is not None:
+            plan = self.join_planner.plan(tables, self.db_schema)
+            from_clause = plan.from_clause()
+            tables = plan.tables
+        qualify = len(tables) > 1
+        
+        def reference(table, column):
+            return f"{table}.{column}" if qualify else column
+        
+        shown, subjects, keys = [], [], []
+        for table, key, labels in aggregate['groups']:
+            if table not in tables:
+                continue
+            for label in labels:
+                if reference(table, label) not in shown:
+                    shown.append(reference(table, label))
+                    subjects.append(label)
+            if reference(table, key) not in keys:
+                keys.append(reference(table, key))
+        # Follow-ups on a grouped answer filter and sort through HAVING and
+        # ORDER BY on these expressions
+        aggregates = {}
+        if aggregate['measure'] is None:
+            shown.append('COUNT(*) AS count')
+            if keys:
+                subjects.append('count')
+                aggregates[(None, 'count')] = 'COUNT(*)'
+        else:
+            table, column = aggregate['measure']
+            expression = f"{aggregate['function']}({reference(table, column)})"
+            shown.append(f"{expression} AS {aggregate['function'].lower()}_{column}")
+            subjects.append(column)
+            if keys:
+                aggregates[(table if qualify else None, column)] = aggregates[(None, column)] = expression
+        
+        # Mentioned columns compare with the question's numbers, through the
+        # table they were resolved to
+        resolved = {}
+        if aggregate['measure'] is not None:
+            resolved[aggregate['measure'][1]] = aggregate['measure']
+        for table, key, labels in aggregate['groups']:
+            resolved.setdefault(key, (table, key))
+        column_names = {}
+        for column in entities['columns']:
+            table, name = resolved.get(column, (None, column))
+            if table is None or table not in tables:
+                table = next((owner for owner in entities['column_tables'].get(column, []) if owner in tables), None)
+            if table is not None:
+                column_names[column] = reference(table, name)
+        where_clauses, params = self._where_clauses(query, entities, column_names, plan)
+        note = None
+        if plan is not None and plan.unreachable:
+            note = f"No join path to {', '.join(plan.unreachable)}"
+        statement = SelectStatement(shown, from_clause, tables, subjects, where_clauses, keys,
+                                    aggregates=aggregates, note=note)
+        return statement, tuple(params)
+        
     def rule_based_sql_generation(self, query, entities, query_type):
         """
         Generate SQL using rule-based approach
+        
+        Values taken from the question are never spliced into the SQL text;
+        they are returned separately to be bound to the ``?`` placeholders.
+        
+        Returns:
+            tuple: (sql_query, params)
+        """
+        sql_query, params, _ = self._generate(query, entities, query_type)
+        return sql_query, params
+        
+    def _generate(self, query, entities, query_type):
+        """
+        rule_based_sql_generation, also returning the SelectStatement the
+        SQL of a SELECT was rendered from (None for other statements)
         """
         if query_type == 'select':
-            # Determine what columns to select
-            if entities['columns']:
-                columns_str = ', '.join(entities['columns'])
-            else:
-                columns_str = '*'  # Select all columns if none specified
+            # "total sales per country", "how many tracks by genre"
+            aggregate = self.detect_aggregate(query, entities)
+            if aggregate is not None:
+                statement, params = self._aggregate_sql(query, entities, aggregate)
+                return statement.sql(), params, statement
             
             # Determine which tables to query
             if entities['tables']:
                 tables_str = ', '.join(entities['tables'])
-                main_table = entities['tables'][0]  # Use first table as main reference
+                tables = entities['tables']
             else:
                 # If no tables detected, we can't create a valid query
-                return "SELECT * FROM [table_name] -- Unable to determine table"
-            
-            # Start building the query
-            sql = f"SELECT {columns_str} FROM {tables_str}"
-            
-            # Add WHERE clause if we have conditions
-            where_clauses = []
+                return "SELECT * FROM [table_name] -- Unable to determine table", (), None
             
-            # Handle direct column comparisons to values
-            for column in entities['columns']:
-                for value in entities['values']:
-                    # Check if this column and value are related in the query
-                    # Simple proximity check - better NLP would improve this
-                    column_idx = query.find(column)
-                    value_idx = query.find(value)
-                    
-                    if abs(column_idx - value_idx) < 50:  # If they're close together
-                        # Determine the operator (default to = if unclear)
-                        operator = '='
-                        for condition_text, op in entities['conditions']:
-                            if condition_text in query[min(column_idx, value_idx):max(column_idx, value_idx)]:
-                                operator = op
-                                break
-                                
-                        # For LIKE conditions, add wildcards
-                        if operator == 'LIKE':
-                            where_clauses.append(f"{column} LIKE '%{value}%'")
-                        else:
-                            where_clauses.append(f"{column} {operator} {value}")
-            
-            # Add WHERE clause if we found conditions
-            if where_clauses:
-                sql += " WHERE " + " AND ".join(where_clauses)
+            # Several tables are joined along foreign keys rather than
+            # producing a Cartesian product
+            plan = None
+            column_names = {column: column for column in entities['columns']}
+            if len(entities['tables']) > 1 and self.join_planner is not None:
+                # The row guard applies when the statement runs (see
+                # JoinPlanner.check_statement), not to the cached text
+                plan = self.join_planner.plan(entities['tables'], self.db_schema)
+                tables_str = plan.from_clause()
+                tables = plan.tables
                 
-            return sql
+                # Qualify columns with a joined table that has them; drop the
+                # ones that only exist in tables we could not join
+                column_names = {}
+                for column in entities['columns']:
+                    owners = [table for table in entities['column_tables'].get(column, [])
+                              if table in plan.tables]
+                    if owners:
+                        column_names[column] = f"{owners[0]}.{column}" if len(plan.tables) > 1 else column
+            
+            # Select the mentioned columns, all columns (*) if none
+            where_clauses, params = self._where_clauses(query, entities, column_names, plan)
+            note = None
+            if plan is not None and plan.unreachable:
+                note = f"No join path to {', '.join(plan.unreachable)}"
+            statement = SelectStatement(list(column_names.values()), tables_str, tables, list(column_names),
+                                        where_clauses, note=note)
+            return statement.sql(), tuple(params), statement
             
         elif query_type == 'insert':
             # Simple INSERT statement
@@ -242,11 +1012,11 @@ class NaturalLanguageToSQL:
                 if entities['columns']:
                     columns_str = ', '.join(entities['columns'])
                     values_str = ', '.join(['?' for _ in entities['columns']])
-                    return f"INSERT INTO {table} ({columns_str}) VALUES ({values_str})"
+                    return f"INSERT INTO {table} ({columns_str}) VALUES ({values_str})", (), None
                 else:
-                    return f"INSERT INTO {table} VALUES (?) -- Unable to determine columns"
+                    return f"INSERT INTO {table} VALUES (?) -- Unable to determine columns", (), None
             else:
-                return "INSERT INTO [table_name] VALUES (?) -- Unable to determine table"
+                return "INSERT INTO [table_name] VALUES (?) -- Unable to determine table", (), None
                 
         elif query_type == 'update':
             # Simple UPDATE statement
@@ -256,59 +1026,282 @@ class NaturalLanguageToSQL:
                 if entities['columns']:
                     sets = [f"{col} = ?" for col in entities['columns']]
                     sets_str = ', '.join(sets)
-                    return f"UPDATE {table} SET {sets_str} WHERE condition"
+                    return f"UPDATE {table} SET {sets_str} WHERE condition", (), None
                 else:
-                    return f"UPDATE {table} SET column = value WHERE condition -- Unable to determine columns"
+                    return f"UPDATE {table} SET column = value WHERE condition -- Unable to determine columns", (), None
             else:
-                return "UPDATE [table_name] SET column = value WHERE condition -- Unable to determine table"
+                return "UPDATE [table_name] SET column = value WHERE condition -- Unable to determine table", (), None
                 
         elif query_type == 'delete':
             # Simple DELETE statement
             if entities['tables']:
                 table = entities['tables'][0]
-                return f"DELETE FROM {table} WHERE condition"
+                return f"DELETE FROM {table} WHERE condition", (), None
             else:
-                return "DELETE FROM [table_name] WHERE condition -- Unable to determine table"
+                return "DELETE FROM [table_name] WHERE condition -- Unable to determine table", (), None
                 
-        return "SELECT * FROM table -- Unable to generate query"
+        return "SELECT * FROM table -- Unable to generate query", (), None
             
+    def parameterize_query(self, query):
+        """
+        Replace the numbers of a normalized query by their position
+        
+        "price over 150 and stock under 3" becomes the shape "price over 0
+        and stock under 1" with literals ['150', '3']. Questions differing
+        only in their numbers share a shape, hence one cached translation
+        and one prepared statement. Translating a shape yields the literal
+        positions as parameters, which bind_parameters maps back.
+        
+        Returns:
+            tuple: (shape, literals), or (query, None) when the shape would
+                not re-tokenize to the same literals (e.g. "1.5.2")
+        """
+        literals = []
+        
+        def position(match):
+            literals.append(match.group())
+            return str(len(literals) - 1)
+        
+        shape = NUMBER_PATTERN.sub(position, query)
+        if NUMBER_PATTERN.findall(shape) != [str(i) for i in range(len(literals))]:
+            return query, None
+        return shape, literals
+        
+    def bind_parameters(self, slots, literals):
+        """
+        Turn the parameters of a translated shape into the values to bind
+        
+        Integer slots are literal positions; strings (values resolved by
+        the value index) are part of the shape and bound as they are.
+        """
+        if literals is None:
+            return tuple(slots)
+        return tuple(parse_number(literals[slot]) if isinstance(slot, int) else slot for slot in slots)
+        
     def generate_sql(self, natural_query):
         """
         Convert natural language query to SQL
+        
+        Returns:
+            tuple: (sql_query, params) where params are bound to the ``?``
+                placeholders of sql_query
         """
-        # Preprocess the query
-        query, tokens = self.preprocess_query(natural_query)
+        sql_query, params, _ = self.generate_statement(natural_query)
+        return sql_query, params
+        
+    def generate_statement(self, natural_query):
+        """
+        generate_sql, also returning the parts of a generated SELECT
+        
+        Returns:
+            tuple: (sql_query, params, SelectStatement or None)
+        """
+        query = self.normalize_query(natural_query)
+        shape, literals = self.parameterize_query(query)
+        
+        # Serve repeated question shapes from the translation cache
+        if self.translation_cache is not None:
+            start = time.perf_counter()
+            cached = self.translation_cache.get(self.schema_version, shape)
+            # The query type is not known before translating; hits and
+            # misses are counted by the cache's own stats
+            if self.metrics is not None:
+                self.metrics.observe('cache_lookup', time.perf_counter() - start)
+            if cached is not None:
+                return self._bind_translation(cached, literals)
+
+        translation, error, elapsed = self._translate_normalized(shape, query)
+        if error is not None:
+            raise error
+        if self.metrics is not None:
+            self.metrics.observe('translate', elapsed)
+        
+        if self.translation_cache is not None:
+            self.translation_cache.put(self.schema_version, shape, translation)
+        
+        return self._bind_translation(translation, literals)
+        
+    def _bind_translation(self, translation, literals):
+        sql_query, slots = translation[:2]
+        # Entries cached before statements were kept have no parts
+        parts = translation[2] if len(translation) > 2 else None
+        statement = None if parts is None else SelectStatement.from_dict(parts)
+        return sql_query, self.bind_parameters(slots, literals), statement
+        
+    def _translate_normalized(self, shape, query=None):
+        """
+        Run the translation pipeline on an already parameterized query
+        
+        Returns:
+            tuple: ((sql_query, params, statement parts), exception or None,
+                elapsed seconds)
+        """
+        start = time.perf_counter()
+        try:
+            translation = self._run_pipeline(shape, query)
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+        return translation, None, time.perf_counter() - start
+        
+    def _run_pipeline(self, query, original_query=None):
+        # Stage boundaries are always taken (a few perf_counter calls) and
+        # only recorded when a metrics registry is attached
+        clock = time.perf_counter
+        t0 = clock()
+        
+        # Preprocess the query: one lexing pass shared by every stage
+        query, runs = self.lex(query)
+        tokens = self._filtered_tokens(query, runs)
+        t1 = clock()
         
         # Detect the query type
         query_type = self.detect_query_type(tokens)
+        t2 = clock()
         
         # Identify entities in the query
-        entities = self.identify_entities(query)
+        entities = self.identify_entities(query, runs)
+        t3 = clock()
+        
+        # Extract any date conditions (from the real numbers, not the shape)
+        date_conditions = self.extract_date_conditions(original_query or query, runs)
+        t4 = clock()
+        
+        # Generate SQL using rule-based approach; the parts of a SELECT are
+        # kept (as JSON, like the rest of a cached translation) for follow-ups
+        sql_query, params, statement = self._generate(query, entities, query_type)
+        translation = (sql_query, params, None if statement is None else statement.as_dict())
+        
+        if self.metrics is not None:
+            self.metrics.observe_many((
+                ('preprocess', t1 - t0),
+                ('detect_query_type', t2 - t1),
+                ('identify_entities', t3 - t2),
+                ('extract_date_conditions', t4 - t3),
+                ('sql_generation', clock() - t4),
+            ), query_type)
+        return translation
+        
+    def generate_sql_batch(self, natural_queries, processes=None, chunk_size=256):
+        """
+        Convert many natural language queries to SQL in one call
+        
+        Questions are normalized and parameterized up front and each
+        question shape is translated only once; cached translations are
+        served from the translation cache. The remaining distinct questions
+        share the precompiled entity matcher and, when processes > 1 and
+        there is enough work, are split across a process pool whose workers
+        build their translator once.
+        
+        Args:
+            natural_queries (list): The questions to translate
+            processes (int): Worker processes for large batches; None or 1
+                translates in this process
+            chunk_size (int): Questions sent to a worker at a time
+            
+        Returns:
+            list: One dict per question, in input order, with 'sql_query',
+                'params', 'error' (None on success), 'cached' and 'elapsed_ms'
+        """
+        results = [None] * len(natural_queries)
+        
+        # shape -> (normalized query, [(index, literals)] of the questions sharing it)
+        pending = {}
+        for i, natural_query in enumerate(natural_queries):
+            if not isinstance(natural_query, str) or not natural_query:
+                results[i] = {'sql_query': None, 'params': None, 'error': 'No query provided',
+                              'cached': False, 'elapsed_ms': 0.0}
+                continue
+            query = self.normalize_query(natural_query)
+            shape, literals = self.parameterize_query(query)
+            if shape in pending:
+                pending[shape][1].append((i, literals))
+                continue
+            cached = None
+            if self.translation_cache is not None:
+                cached = self.translation_cache.get(self.schema_version, shape)
+            if cached is not None:
+                sql_query, slots = cached[:2]
+                results[i] = {'sql_query': sql_query, 'params': self.bind_parameters(slots, literals),
+                              'error': None, 'cached': True, 'elapsed_ms': 0.0}
+            else:
+                pending[shape] = (query, [(i, literals)])
         
-        # Extract any date conditions
-        date_conditions = self.extract_date_conditions(query)
+        distinct = [(shape, query) for shape, (query, _) in pending.items()]
+        if processes and processes > 1 and len(distinct) > chunk_size:
+            # Imported here: multiprocessing adds noticeably to import time
+            from concurrent.futures import ProcessPoolExecutor
+            chunks = [distinct[i:i + chunk_size] for i in range(0, len(distinct), chunk_size)]
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_batch_worker,
+                                     initargs=(self.db_schema,)) as executor:
+                translations = [t for chunk in executor.map(_translate_batch_chunk, chunks) for t in chunk]
+        else:
+            translations = [self._translate_normalized(shape, query) for shape, query in distinct]
         
-        # Generate SQL using rule-based approach
-        sql_query = self.rule_based_sql_generation(query, entities, query_type)
+        for (shape, _), (translation, error, elapsed) in zip(distinct, translations):
+            if error is None and self.translation_cache is not None:
+                self.translation_cache.put(self.schema_version, shape, translation)
+            sql_query, slots = translation[:2] if error is None else (None, None)
+            for i, literals in pending[shape][1]:
+                results[i] = {
+                    'sql_query': sql_query,
+                    'params': self.bind_parameters(slots, literals) if error is None else None,
+                    'error': None if error is None else str(error),
+                    'cached': False,
+                    'elapsed_ms': elapsed * 1000
+                }
         
-        return sql_query
+        return results
         
-    def execute_query(self, sql_query, database_connection):
+    def execute_query(self, sql_query, database_connection, params=()):
         """
         Execute the SQL query on the provided database connection
         
         Args:
             sql_query (str): The SQL query to execute
             database_connection: A database connection object (e.g., SQLAlchemy engine)
+            params (tuple): Values bound to the query's placeholders
             
         Returns:
-            The query results
+            The query results, cut at the governor's row limit if one is set
         """
         try:
+            if self.governor is not None:
+                return self.governor.execute(database_connection, sql_query, params).rows
             # Connect to the database and execute the query
             cursor = database_connection.cursor()
-            cursor.execute(sql_query)
+            cursor.execute(sql_query, params)
             results = cursor.fetchall()
             return results
         except Exception as e:
-            return f"Error executing query: {str(e)}"
\ No newline at end of file
+            return f"Error executing query: {str(e)}"
+            
+    def iter_query(self, sql_query, database_connection, batch_size=500, params=()):
+        """
+        Execute the SQL query and yield its rows in batches
+        
+        Unlike execute_query, at most batch_size rows are held in memory at
+        a time, so arbitrarily large results can be consumed.
+        
+        Args:
+            sql_query (str): The SQL query to execute
+            database_connection: A DB-API connection object
+            batch_size (int): Number of rows fetched per batch
+            params (tuple): Values bound to the query's placeholders
+            
+        Yields:
+            list: The next batch of rows
+        """
+        if self.governor is not None:
+            with self.governor.run(database_connection, sql_query, params) as query:
+                yield from query.batches(batch_size)
+            return
+        cursor = database_connection.cursor()
+        try:
+            cursor.execute(sql_query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
\ No newline at end of file
@@ -0,0 +1,319 @@
+"""
+Pre-forking multi-process server for the SQL assistant
+
+The Flask app in app.py is GIL-bound: one process keeps one core busy with
+tokenization and JSON encoding. This server imports the app once in a
+parent process, builds the schema catalog, value index and translator
+indexes there, and then forks N workers that inherit all of it
+copy-on-write. The workers accept connections from one shared listening
+socket and open the database read-only through a memory map (DB_MMAP_SIZE),
+so its pages live once in the OS page cache however many workers read them.
+
+The parent watches the database file. When it changes (or on SIGHUP) the
+parent refreshes its catalog and indexes, forks a new generation of
+workers, and then stops the old ones gracefully: they finish the requests
+they are serving before exiting. SIGTERM / SIGINT stop the server the same
+way. Workers that die are replaced.
+
+POSIX only (fork). Usage:
+    python prefork.py [--workers 4] [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+
+class ActiveRequests:
+    """WSGI middleware counting the requests in progress, for graceful stops"""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        # Streamed bodies are consumed by the server after this returns;
+        # the request ends when the server closes the body
+        return _Body(body, self._done)
+
+    def _done(self):
+        with self._lock:
+            self.count -= 1
+
+
+class _Body:
+    """WSGI response iterable that reports the end of its request on close()"""
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is None:
+            return
+        try:
+            # Lets the wrapped app release what it holds for the response
+            # (pooled connections, open cursors)
+            close = getattr(self.iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            on_close()
+
+
+class PreforkServer:
+    """Parent process: owns the listening socket and supervises the workers"""
+
+    def __init__(self, app_module, host='127.0.0.1', port=8000, workers=None, threaded=True,
+                 reload_interval=2.0, graceful_timeout=30.0, backlog=2048):
+        """
+        Args:
+            app_module (module): The imported app module (see app.py)
+            host (str): Address to listen on
+            port (int): Port to listen on
+            workers (int): Worker processes; one per core when None
+            threaded (bool): Serve each request of a worker on its own
+                thread, so slow queries and streams do not block the worker
+            reload_interval (float): Seconds between checks of the
+                database file; 0 disables reloading on change
+            graceful_timeout (float): Seconds a stopping worker gets to
+                finish its requests before it is killed
+            backlog (int): Listen queue length of the shared socket
+        """
+        self.app_module = app_module
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.threaded = threaded
+        self.reload_interval = reload_interval
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+
+        self.socket = None
+        # pid -> generation
+        self._children = {}
+        # pid -> time it was asked to stop
+        self._stopping = {}
+        self._generation = 0
+        self._stop_requested = False
+        self._reload_requested = False
+        self._db_fingerprint = None
+
+    def _database_fingerprint(self):
+        """Size and mtime of the database and its WAL file"""
+        path = self.app_module.DB_PATH
+        fingerprint = []
+        for name in (path, path + '-wal'):
+            try:
+                stat = os.stat(name)
+                fingerprint.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append(None)
+        return fingerprint
+
+    def _prepare(self):
+        """Refresh everything the workers inherit, in the parent"""
+        start = time.perf_counter()
+        self.app_module.warm_up()
+        self._db_fingerprint = self._database_fingerprint()
+        # Move the objects built so far out of the collector's reach; a
+        # collection in a worker would otherwise touch (and copy) every page
+        gc.collect()
+        gc.freeze()
+        print(f"[prefork] catalog and indexes ready in {time.perf_counter() - start:.2f}s "
+              f"({len(self.app_module.nl_to_sql.db_schema or {})} tables)", flush=True)
+
+    def serve(self):
+        """Bind, prepare, fork the workers and supervise them until stopped"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        self.socket.set_inheritable(True)
+        self.port = self.socket.getsockname()[1]
+
+        self._prepare()
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_reload)
+        self._spawn_generation()
+        print(f"[prefork] serving on http://{self.host}:{self.port} with {self.workers} workers", flush=True)
+
+        last_check = time.monotonic()
+        try:
+            while not self._stop_requested:
+                time.sleep(0.2)
+                self._reap()
+                now = time.monotonic()
+                if self.reload_interval and now - last_check >= self.reload_interval:
+                    last_check = now
+                    if self._database_fingerprint() != self._db_fingerprint:
+                        self._reload_requested = True
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self.reload()
+                self._kill_overdue()
+        finally:
+            self.stop()
+
+    def _request_stop(self, signum, frame):
+        self._stop_requested = True
+
+    def _request_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _spawn_generation(self):
+        self._generation += 1
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._run_worker()
+                code = 0
+            except Exception:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self._children[pid] = self._generation
+
+    def reload(self):
+        """Rebuild the inherited state and replace every worker"""
+        print("[prefork] database changed, reloading workers", flush=True)
+        gc.unfreeze()
+        self._prepare()
+        old = list(self._children)
+        self._spawn_generation()
+        for pid in old:
+            self._signal_stop(pid)
+
+    def _signal_stop(self, pid):
+        if pid not in self._stopping:
+            self._stopping[pid] = time.monotonic()
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, since in list(self._stopping.items()):
+            if now - since > self.graceful_timeout:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _reap(self):
+        """Collect exited workers and replace the ones that died unexpectedly"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self._children.pop(pid, None)
+            expected = self._stopping.pop(pid, None) is not None
+            if not expected and not self._stop_requested and generation == self._generation:
+                print(f"[prefork] worker {pid} exited with status {status}, replacing it", flush=True)
+                self._spawn()
+
+    def stop(self):
+        """Stop every worker gracefully, then close the socket"""
+        for pid in list(self._children):
+            self._signal_stop(pid)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self._reap()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _run_worker(self):
+        """Serve requests from the shared socket until asked to stop"""
+        from werkzeug.serving import make_server
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        self.app_module.after_fork()
+
+        app = ActiveRequests(self.app_module.app)
+        server = make_server(self.host, self.port, app, threaded=self.threaded, fd=self.socket.fileno())
+
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever to return, so it cannot
+            # run on the thread executing serve_forever
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        server.serve_forever(poll_interval=0.5)
+
+        # Let requests already accepted finish
+        deadline = time.monotonic() + self.graceful_timeout
+        while app.count and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-forking server for the SQL assistant')
+    parser.add_argument('--host', default=os.environ.get('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', 0)) or None,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--no-threads', action='store_true',
+                        help='serve one request at a time per worker')
+    parser.add_argument('--reload-interval', type=float,
+                        default=float(os.environ.get('RELOAD_INTERVAL', 2.0)),
+                        help='seconds between database change checks, 0 to disable')
+    parser.add_argument('--graceful-timeout', type=float,
+                        default=float(os.environ.get('GRACEFUL_TIMEOUT', 30.0)))
+    parser.add_argument('--read-write', action='store_true',
+                        help='open the database read-write (default: read-only)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Read before app is imported: workers read the database through a
+    # shared memory map, and refreshes happen in the parent, not on threads
+    os.environ.setdefault('DB_READ_ONLY', '0' if args.read_write else '1')
+    os.environ.setdefault('DB_MMAP_SIZE', str(1024 * 1024 * 1024))
+    os.environ['BACKGROUND_REFRESH'] = '0'
+    import app as app_module
+
+    server = PreforkServer(app_module, host=args.host, port=args.port, workers=args.workers,
+                           threaded=not args.no_threads, reload_interval=args.reload_interval,
+                           graceful_timeout=args.graceful_timeout)
+    server.serve()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
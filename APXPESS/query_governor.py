@@ -0,0 +1,425 @@
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from index_advisor import PLAN_PATTERN
+from result_cache import is_read_only
+from result_stream import paginate_sql
+
+
+class QueryBudgetExceeded(Exception):
+    """A statement was refused, or a write aborted, for exceeding its budget"""
+
+
+class JoinRefused(QueryBudgetExceeded):
+    """A join was refused by the join guard for its estimated row count"""
+
+
+def parse_limit(name, value, kind=float):
+    """
+    Validate a limit a request asked for
+
+    Args:
+        name (str): Name of the limit, for the error message
+        value: The requested value (number or numeric string)
+        kind (type): int or float
+
+    Returns:
+        The value converted to kind
+
+    Raises:
+        ValueError: If the value is not a finite positive number
+    """
+    try:
+        value = kind(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'{name} must be a number')
+    if not math.isfinite(value):
+        raise ValueError(f'{name} must be a finite number')
+    if value <= 0:
+        raise ValueError(f'{name} must be positive')
+    return value
+
+
+class QueryBudget:
+    """Limits for one statement; None disables a limit"""
+
+    def __init__(self, max_rows=None, timeout=None, max_steps=None, max_cost=None):
+        """
+        Args:
+            max_rows (int): Rows returned before the result is truncated
+            timeout (float): Wall-clock seconds before the statement is
+                interrupted
+            max_steps (int): sqlite VM instructions before the statement is
+                interrupted
+            max_cost (int): Statements whose estimated number of examined
+                rows exceeds this are not run
+        """
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.max_cost = max_cost
+
+    def tightened(self, **limits):
+        """Return a copy where each given limit replaces a larger (or no) limit"""
+        budget = QueryBudget(self.max_rows, self.timeout, self.max_steps, self.max_cost)
+        for name, value in limits.items():
+            current = getattr(budget, name)
+            if value is not None and (current is None or value < current):
+                setattr(budget, name, value)
+        return budget
+
+    def as_dict(self):
+        return {'max_rows': self.max_rows, 'timeout': self.timeout,
+                'max_steps': self.max_steps, 'max_cost': self.max_cost}
+
+
+class GovernedQuery:
+    """
+    A statement running under a budget
+
+    Rows are read with ``batches()`` (or all at once with ``fetchall()``).
+    When the row limit is reached, or the statement is interrupted by its
+    deadline or step budget, reading stops and ``truncated`` / ``reason``
+    describe why; the rows read so far stay valid. Use as a context manager
+    so the progress handler is removed from the connection afterwards.
+    """
+
+    def __init__(self, governor, conn, sql_query, params, budget, should_abort=None):
+        self.governor = governor
+        self.conn = conn
+        self.sql_query = sql_query
+        self.params = params
+        self.budget = budget
+        self.should_abort = should_abort
+        self.read_only = is_read_only(sql_query)
+
+        self.columns = []
+        self.rows = []
+        self.row_count = 0
+        self.truncated = False
+        # 'max_rows', 'timeout', 'max_steps' or 'cancelled'
+        self.reason = None
+        self.estimated_cost = None
+        self.steps = 0
+        self.elapsed = 0.0
+        self._cursor = None
+        self._deadline = None
+        self._start = None
+        self._handler_installed = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _progress(self):
+        # Called by sqlite every check_interval VM instructions
+        self.steps += self.governor.check_interval
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            self.reason = 'timeout'
+        elif self.budget.max_steps is not None and self.steps > self.budget.max_steps:
+            self.reason = 'max_steps'
+        elif self.should_abort is not None and self.should_abort():
+            self.reason = 'cancelled'
+        return 1 if self.reason is not None else 0
+
+    def start(self):
+        """
+        Estimate the cost and start the statement
+
+        Raises:
+            QueryBudgetExceeded: If the estimated cost is over the budget
+            JoinRefused: If the join guard refuses the statement
+        """
+        budget = self.budget
+        sql_query, params = self.sql_query, self.params
+        if self.read_only and self.governor.join_guard is not None:
+            action, limit, estimated_rows = self.governor.join_guard(sql_query)
+            if action == 'refuse':
+                self.governor._count('refused_joins')
+                raise JoinRefused(f'Join refused: estimated {estimated_rows} rows exceeds the limit of {limit}')
+            if action == 'limit':
+                self.governor._count('limited_joins')
+                budget = self.budget = budget.tightened(max_rows=limit)
+        if budget.max_cost is not None:
+            self.estimated_cost = self.governor.estimate_cost(self.conn, sql_query, params)
+            if self.estimated_cost is not None and self.estimated_cost > budget.max_cost:
+                self.governor._count('refused')
+                raise QueryBudgetExceeded(
+                    f'Query refused: estimated cost of {self.estimated_cost} examined rows exceeds '
+                    f'the budget of {budget.max_cost}')
+        if self.read_only and budget.max_rows is not None:
+            # sqlite stops producing rows at the LIMIT, and can use a top-N
+            # sort; the one look-ahead row tells us the result was cut
+            sql_query, params = paginate_sql(sql_query, budget.max_rows, 0, params)
+
+        self._start = time.perf_counter()
+        if budget.timeout is not None:
+            self._deadline = self._start + budget.timeout
+        if self._deadline is not None or budget.max_steps is not None or self.should_abort is not None:
+            self.conn.set_progress_handler(self._progress, self.governor.check_interval)
+            self._handler_installed = True
+        self.governor._count('statements')
+
+        self._cursor = self.conn.cursor()
+        try:
+            self._cursor.execute(sql_query, params)
+        except Exception as e:
+            if self.reason is None or not isinstance(e, sqlite3.OperationalError):
+                # A real error; leave the connection as it was found
+                self.close()
+                raise
+            self._interrupted()
+            return
+        self.columns = [column[0] for column in self._cursor.description or ()]
+
+    def _interrupted(self):
+        """Turn an interrupt into a truncated result (reads) or an error (writes)"""
+        self.truncated = True
+        self.governor._count(f'truncated_{self.reason}')
+        if not self.read_only:
+            self.close()
+            raise QueryBudgetExceeded(f'Statement aborted: {self.reason} limit reached')
+
+    def batches(self, batch_size=500):
+        """Yield lists of at most batch_size rows until the result or budget ends"""
+        if self._cursor is None or self.truncated:
+            return
+        max_rows = self.budget.max_rows if self.read_only else None
+        while True:
+            size = batch_size if max_rows is None else min(batch_size, max_rows - self.row_count + 1)
+            try:
+                rows = self._cursor.fetchmany(size)
+            except sqlite3.OperationalError:
+                if self.reason is None:
+                    raise
+                self._interrupted()
+                return
+            if not rows:
+                return
+            if max_rows is not None and self.row_count + len(rows) > max_rows:
+                rows = rows[:max_rows - self.row_count]
+                self.truncated = True
+                self.reason = 'max_rows'
+                self.governor._count('truncated_max_rows')
+            self.row_count += len(rows)
+            if rows:
+                yield rows
+            if self.truncated:
+                return
+
+    def fetchall(self):
+        """Read the whole (possibly truncated) result into ``rows``"""
+        for rows in self.batches():
+            self.rows.extend(rows)
+        return self.rows
+
+    def close(self):
+        if self._start is not None:
+            self.elapsed = time.perf_counter() - self._start
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        if self._handler_installed:
+            self.conn.set_progress_handler(None, 0)
+            self._handler_installed = False
+
+
+class QueryGovernor:
+    """
+    Bounds the runtime and result size of generated statements
+
+    Before a statement runs, its ``EXPLAIN QUERY PLAN`` is turned into an
+    estimate of the rows sqlite will examine (table sizes for scans,
+    sqlite_stat1 averages for index searches, multiplied through nested
+    loops), and statements over the cost budget are refused; so are joins
+    the join guard refuses for their estimated size. Read-only
+    statements get a LIMIT one past the row budget; sqlite's progress
+    handler interrupts anything that runs past its deadline or VM-step
+    budget. Reads that hit a limit return the rows produced so far with a
+    truncation reason; writes that hit one raise QueryBudgetExceeded, and
+    the caller must not commit them (ConnectionPool.connection() rolls
+    back when its block raises, and commits writes that completed).
+
+    Cost estimates are cached per statement and database version, so a
+    refusal does not outlive the data it was estimated on.
+    """
+
+    def __init__(self, max_rows=10000, timeout=10.0, max_steps=None, max_cost=None, row_count=None,
+                 check_interval=1000, max_estimates=1024, estimate_ttl=60.0, join_guard=None,
+                 data_version=None):
+        """
+        Args:
+            max_rows (int): Default and maximum rows per result
+            timeout (float): Default and maximum seconds per statement
+            max_steps (int): Default and maximum VM instructions per statement
+            max_cost (int): Estimated examined rows above which a statement
+                is refused
+            row_count (callable): table -> row count, e.g.
+                JoinPlanner.row_count; MAX(rowid) is used when None
+            check_interval (int): VM instructions between progress checks
+            max_estimates (int): Cost estimates cached by statement
+            estimate_ttl (float): Seconds a cached estimate stays valid
+            join_guard (callable): sql -> (action, limit, estimated rows),
+                e.g. JoinPlanner.check_statement; reads it limits get at
+                most limit rows, reads it refuses raise JoinRefused
+            data_version (callable): Returns a value that changes when the
+                database is written, e.g. ResultCache.version; cached
+                estimates are only reused under the same value
+        """
+        self.default_budget = QueryBudget(max_rows, timeout, max_steps, max_cost)
+        self.row_count = row_count
+        self.check_interval = check_interval
+        self.max_estimates = max_estimates
+        self.estimate_ttl = estimate_ttl
+        self.join_guard = join_guard
+        self.data_version = data_version
+
+        # (sql, data version) -> (cost, estimated_at)
+        self._estimates = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'statements': 0, 'refused': 0, 'truncated_max_rows': 0, 'truncated_timeout': 0,
+                       'truncated_max_steps': 0, 'truncated_cancelled': 0, 'estimates': 0,
+                       'estimate_hits': 0, 'refused_joins': 0, 'limited_joins': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def budget(self, overrides=None, base=None):
+        """
+        Budget for one request
+
+        Requests may lower the limits (``max_rows``, ``timeout`` in
+        seconds, ``max_steps``) but never raise them. The default budget
+        object itself is returned when nothing is overridden.
+
+        Raises:
+            ValueError: If an override is not a finite positive number
+        """
+        base = base or self.default_budget
+        limits = {}
+        for name, kind in (('max_rows', int), ('timeout', float), ('max_steps', int)):
+            value = (overrides or {}).get(name)
+            if value is not None:
+                limits[name] = parse_limit(name, value, kind)
+        return base.tightened(**limits) if limits else base
+
+    def run(self, conn, sql_query, params=(), budget=None, should_abort=None):
+        """
+        Start a statement under a budget; use the result as a context manager
+
+        Args:
+            should_abort (callable): Polled by the progress handler; the
+                statement is interrupted when it returns True
+        """
+        return GovernedQuery(self, conn, sql_query, tuple(params), budget or self.default_budget,
+                             should_abort=should_abort)
+
+    def execute(self, conn, sql_query, params=(), budget=None, should_abort=None):
+        """
+        Run a statement and read its whole (possibly truncated) result
+
+        Returns:
+            GovernedQuery: rows, truncated and reason are filled in
+
+        Raises:
+            QueryBudgetExceeded: If the statement was refused or a write aborted
+        """
+        with self.run(conn, sql_query, params, budget, should_abort) as query:
+            query.fetchall()
+        return query
+
+    def estimate_cost(self, conn, sql_query, params=()):
+        """
+        Estimate the rows sqlite examines to run a statement
+
+        Every SCAN or SEARCH in the plan is one loop, nested inside the
+        ones before it; the estimate sums, over the loops, the product of
+        the rows produced per iteration of every enclosing loop.
+
+        Returns:
+            int: Estimated examined rows, or None if there is no plan
+        """
+        now = time.monotonic()
+        key = (sql_query, self.data_version() if self.data_version is not None else None)
+        with self._lock:
+            cached = self._estimates.get(key)
+            if cached is not None and now - cached[1] < self.estimate_ttl:
+                self._estimates.move_to_end(key)
+                self._stats['estimate_hits'] += 1
+                return cached[0]
+            self._stats['estimates'] += 1
+
+        try:
+            plan = conn.execute(f'EXPLAIN QUERY PLAN {sql_query}', params).fetchall()
+        except sqlite3.Error:
+            return None
+        cost = None
+        loops = 1
+        for row in plan:
+            match = PLAN_PATTERN.match(row[-1])
+            if not match:
+                continue
+            operation, table, detail = match.group(1).upper(), match.group(2), match.group(3)
+            rows = self._table_rows(conn, table)
+            if operation == 'SCAN' or 'AUTOMATIC' in detail.upper():
+                per_loop = rows
+            else:
+                per_loop = self._search_rows(conn, rows, detail)
+            loops *= max(1, per_loop)
+            cost = (cost or 0) + loops
+
+        with self._lock:
+            self._estimates[key] = (cost, now)
+            self._estimates.move_to_end(key)
+            while len(self._estimates) > self.max_estimates:
+                self._estimates.popitem(last=False)
+        return cost
+
+    def _table_rows(self, conn, table):
+        if self.row_count is not None:
+            count = self.row_count(table)
+            if count is not None:
+                return count
+        quoted = table.replace('"', '""')
+        try:
+            return conn.execute(f'SELECT MAX(rowid) FROM "{quoted}"').fetchone()[0] or 0
+        except sqlite3.Error:
+            return 0
+
+    def _search_rows(self, conn, table_rows, detail):
+        """Rows produced by one index search, e.g. 'USING INDEX i (a=? AND b>?)'"""
+        if 'PRIMARY KEY' in detail.upper() and '=' in detail and '>' not in detail and '<' not in detail:
+            return 1
+        terms = detail[detail.find('(') + 1:detail.rfind(')')].split(' AND ') if '(' in detail else []
+        equalities = sum(1 for term in terms if '=' in term and not any(op in term for op in '<>'))
+        if not equalities:
+            # Range only: sqlite itself assumes a quarter of the rows
+            return max(1, table_rows // 4)
+        if ' INDEX ' in detail:
+            index = detail.split(' INDEX ', 1)[1].split()[0]
+            try:
+                row = conn.execute('SELECT stat FROM sqlite_stat1 WHERE idx = ? COLLATE NOCASE',
+                                   (index,)).fetchone()
+            except sqlite3.OperationalError:
+                # No ANALYZE has been run on this database
+                row = None
+            if row and row[0]:
+                averages = row[0].split()[1:]
+                if len(averages) >= equalities:
+                    return max(1, int(averages[equalities - 1]))
+        return max(1, table_rows // 10)
+
+    def stats(self):
+        """Return statement, refusal and truncation counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({f'budget_{name}': value for name, value in self.default_budget.as_dict().items()
+                      if value is not None})
+        return stats
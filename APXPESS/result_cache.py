@@ -0,0 +1,248 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Tables referenced by a statement: FROM a, b / JOIN c / UPDATE d / INTO e
+TABLE_REF_PATTERN = re.compile(
+    r'\b(?:from|join|update|into)\s+((?:[\[\]"`\w]+\s*(?:\s+as\s+\w+|\s+\w+)?\s*,\s*)*[\[\]"`\w]+)',
+    re.IGNORECASE)
+IDENTIFIER_PATTERN = re.compile(r'[\[\]"`]?(\w+)[\[\]"`]?')
+READ_ONLY_PATTERN = re.compile(r'^\s*(?:select|with)\b', re.IGNORECASE)
+WRITE_PATTERN = re.compile(r'\b(?:insert|update|delete|replace|create|drop|alter)\b', re.IGNORECASE)
+SQL_KEYWORDS = {'as', 'on', 'where', 'join', 'inner', 'left', 'right', 'outer', 'cross', 'natural'}
+
+
+def is_read_only(sql_query):
+    """Return True for statements that can only read (SELECT / WITH ... SELECT)"""
+    return bool(READ_ONLY_PATTERN.match(sql_query)) and not WRITE_PATTERN.search(sql_query)
+
+
+def referenced_tables(sql_query):
+    """Return the lowercased names of tables a statement reads or writes"""
+    tables = set()
+    for match in TABLE_REF_PATTERN.finditer(sql_query):
+        for part in match.group(1).split(','):
+            name = IDENTIFIER_PATTERN.match(part.strip())
+            if name and name.group(1).lower() not in SQL_KEYWORDS:
+                tables.add(name.group(1).lower())
+    return tables
+
+
+class ResultCache:
+    """
+    Cache of serialized SELECT results keyed on the final SQL text and its
+    bound parameters
+
+    Entries hold the already-encoded JSON bytes of the result rows, so a hit
+    is served without touching sqlite or the JSON encoder. Each entry
+    remembers the tables its statement read; writes that go through the app
+    invalidate those tables, and writes from other connections are detected
+    through sqlite's ``PRAGMA data_version`` and clear the whole cache.
+    Callers take ``version()`` before running a statement and pass it to
+    ``put()``, so a result read before a write is not stored after it.
+    """
+
+    def __init__(self, database=None, max_bytes=64 * 1024 * 1024, max_entry_bytes=None,
+                 data_version_interval=0.5):
+        """
+        Args:
+            database (str): Path of the database to watch for outside writes;
+                no watching is done when None
+            max_bytes (int): Total size budget for cached result bytes
+            max_entry_bytes (int): Results larger than this are not cached;
+                defaults to an eighth of max_bytes
+            data_version_interval (float): Minimum seconds between two
+                data_version checks
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+        self.data_version_interval = data_version_interval
+
+        # (sql, params) -> (payload bytes, tables)
+        self._entries = OrderedDict()
+        # table -> set of keys reading it
+        self._by_table = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bumped on every write seen, through the app or from outside
+        self._generation = 0
+
+        self.database = database
+        self._watcher = None
+        self._data_version = None
+        # Handles inherited over fork(), kept open but never used
+        self._inherited = []
+        self._last_version_check = 0.0
+
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'external_writes': 0,
+            'too_large': 0,
+            'stale_puts': 0,
+        }
+
+    def after_fork(self):
+        """Open a fresh data_version watcher in a forked child process"""
+        self._lock = threading.Lock()
+        if self._watcher is not None:
+            # data_version is per connection, so the baseline is re-read too
+            self._inherited.append(self._watcher)
+            self._watcher = None
+            self._open_watcher()
+
+    def _open_watcher(self):
+        """Open the read-only connection used to poll data_version"""
+        try:
+            # mode=ro so that watching never creates a missing database
+            self._watcher = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True,
+                                            check_same_thread=False)
+        except sqlite3.Error:
+            return
+        self._data_version = self._read_data_version()
+
+    def _read_data_version(self):
+        try:
+            return self._watcher.execute('PRAGMA data_version').fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def _check_external_writes(self):
+        """Clear everything if the database changed behind our back; caller holds the lock"""
+        if self.database is None:
+            return
+        if self._watcher is None:
+            self._open_watcher()
+            if self._watcher is None:
+                return
+        now = time.monotonic()
+        if now - self._last_version_check < self.data_version_interval:
+            return
+        self._last_version_check = now
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self._generation += 1
+            if self._entries:
+                self._stats['external_writes'] += 1
+                self._clear()
+
+    def get(self, sql_query, params=(), encoding='json'):
+        """
+        Return the cached JSON bytes for a statement in an encoding, or None
+        """
+        key = (sql_query, tuple(params), encoding)
+        with self._lock:
+            self._check_external_writes()
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, sql_query, payload, params=(), encoding='json', version=None):
+        """
+        Cache the encoded results of a read-only statement
+
+        Args:
+            sql_query (str): The executed SQL text
+            payload (bytes): The JSON-encoded result rows
+            params (tuple): The values bound to the statement
+            encoding (str): Shape of the payload ('json' or 'columnar');
+                each shape is cached separately
+            version (int): version() taken before the statement ran; the
+                result is not cached if a write was seen since
+        """
+        if not is_read_only(sql_query):
+            return
+        size = len(payload)
+        key = (sql_query, tuple(params), encoding)
+        with self._lock:
+            if version is not None:
+                self._check_external_writes()
+                if version != self._generation:
+                    self._stats['stale_puts'] += 1
+                    return
+            if size > self.max_entry_bytes:
+                self._stats['too_large'] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+
+            tables = referenced_tables(sql_query)
+            self._entries[key] = (payload, tables)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def _remove(self, key):
+        payload, tables = self._entries.pop(key)
+        self._bytes -= len(payload)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def _clear(self):
+        self._stats['invalidations'] += len(self._entries)
+        self._entries.clear()
+        self._by_table.clear()
+        self._bytes = 0
+
+    def invalidate_tables(self, tables):
+        """Drop every entry that read any of the given tables"""
+        with self._lock:
+            self._generation += 1
+            for table in tables:
+                for key in list(self._by_table.get(table.lower(), ())):
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+            # data_version is left to the next poll: it moves once per
+            # check however many connections committed since, so our own
+            # write cannot be told from an outside one made meanwhile, and
+            # the poll clears the cache for both
+
+    def note_statement(self, sql_query):
+        """Invalidate the tables touched by a statement if it can write"""
+        if not is_read_only(sql_query):
+            self.invalidate_tables(referenced_tables(sql_query))
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._generation += 1
+            self._clear()
+
+    def version(self):
+        """
+        A counter that changes whenever results read earlier may be stale
+
+        Lets other holders of query results (see sessions.py) tell whether
+        the database was written since, the same way this cache does.
+        """
+        with self._lock:
+            self._check_external_writes()
+            return self._generation
+
+    def stats(self):
+        """Return hit/miss counters and memory use"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
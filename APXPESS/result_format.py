@@ -0,0 +1,173 @@
+"""
+Response encodings for query results
+
+``json`` is the original shape: one object per row, column names repeated
+on every row. The other encodings are columnar: column names once, then
+one array of values per column, built straight from cursor batches
+without a dict per row.
+
+- ``columnar``: JSON, ``"results": {"columns": [...], "values": [[...], ...]}``
+- ``msgpack``: the same document as MessagePack (needs ``msgpack``)
+- ``arrow``: an Arrow IPC stream with one record batch; the other response
+  fields are JSON in the schema metadata under ``meta`` (needs ``pyarrow``)
+
+The encoding is picked from a ``format`` request field, else from the
+Accept header.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'columnar': 'application/json',
+    'msgpack': 'application/msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Accept header media types -> encoding; columnar JSON is asked for with
+# ``application/json; format=columnar``
+ACCEPTED_TYPES = {
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+}
+
+
+def available_formats():
+    """Encodings whose libraries are installed"""
+    formats = ['json', 'columnar']
+    if msgpack is not None:
+        formats.append('msgpack')
+    if pyarrow is not None:
+        formats.append('arrow')
+    return formats
+
+
+def negotiate_format(requested=None, accept=None):
+    """
+    Pick the encoding of a response
+
+    Args:
+        requested (str): The request's ``format`` field; wins when given
+        accept (str): The Accept header; unsupported or unavailable types
+            in it are skipped
+
+    Returns:
+        str: 'json', 'columnar', 'msgpack' or 'arrow'
+
+    Raises:
+        ValueError: If the requested format is unknown or not installed
+    """
+    if requested:
+        if requested not in MEDIA_TYPES:
+            raise ValueError(f"Unknown format '{requested}' (expected one of {', '.join(MEDIA_TYPES)})")
+        if requested not in available_formats():
+            raise ValueError(f"Format '{requested}' is not available on this server")
+        return requested
+
+    best, best_quality = 'json', 0.0
+    available = available_formats()
+    for entry in (accept or '').split(','):
+        media_type, *options = [part.strip() for part in entry.split(';')]
+        options = dict(option.partition('=')[::2] for option in options)
+        try:
+            quality = float(options.get('q', 1))
+        except ValueError:
+            continue
+        if media_type.lower() == 'application/json':
+            fmt = 'columnar' if options.get('format') == 'columnar' else 'json'
+        else:
+            fmt = ACCEPTED_TYPES.get(media_type.lower())
+        if fmt in available and quality > best_quality:
+            best, best_quality = fmt, quality
+    return best
+
+
+def collect_columns(batches, n_columns, limit=None):
+    """
+    Transpose cursor batches into one list of values per column
+
+    Args:
+        batches (iterable): Lists of rows (tuples or sqlite3.Row)
+        n_columns (int): Columns of the result
+        limit (int): Keep at most this many rows
+
+    Returns:
+        tuple: (list of value lists, True when rows beyond limit were seen)
+    """
+    values = [[] for _ in range(n_columns)]
+    count = 0
+    for rows in batches:
+        more = limit is not None and count + len(rows) > limit
+        if more:
+            # The look-ahead row only signals another page
+            rows = rows[:limit - count]
+        count += len(rows)
+        for column, batch in zip(values, zip(*rows)):
+            column.extend(batch)
+        if more:
+            return values, True
+    return values, False
+
+
+def encode_columnar_json(columns, values, dumps=json.dumps):
+    """The ``results`` member of a columnar JSON response, as bytes"""
+    return dumps({'columns': columns, 'values': values}, separators=(',', ':')).encode('utf-8')
+
+
+def encode_msgpack(document, columns, values):
+    """
+    A MessagePack map of the document's fields plus columnar ``results``
+
+    Args:
+        document (dict): The other response fields
+        columns (list): Column names
+        values (list): One list of values per column
+    """
+    packer = msgpack.Packer(use_bin_type=True)
+    body = [packer.pack_map_header(len(document) + 1)]
+    for key, value in document.items():
+        body.append(packer.pack(key))
+        body.append(packer.pack(value))
+    body.append(packer.pack('results'))
+    body.append(packer.pack({'columns': columns, 'values': values}))
+    return b''.join(body)
+
+
+def _arrow_array(column):
+    # sqlite columns are dynamically typed; a column mixing types (e.g.
+    # numbers and text) is sent as text
+    try:
+        return pyarrow.array(column)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        return pyarrow.array([None if value is None else str(value) for value in column],
+                             type=pyarrow.string())
+
+
+def encode_arrow(document, columns, values):
+    """
+    An Arrow IPC stream of the results, with the document's fields as
+    JSON in the schema metadata under ``meta``
+
+    Args:
+        document (dict): The other response fields
+        columns (list): Column names
+        values (list): One list of values per column
+    """
+    batch = pyarrow.RecordBatch.from_arrays([_arrow_array(column) for column in values], names=columns)
+    batch = batch.replace_schema_metadata({'meta': json.dumps(document, separators=(',', ':'))})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
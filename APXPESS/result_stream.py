@@ -0,0 +1,155 @@
+import base64
+import json
+import re
+
+# Notes the generator appends ("-- No join path to ...")
+TRAILING_COMMENT_PATTERN = re.compile(r'\s+--[^\n]*$')
+# A LIMIT ending a statement: LIMIT 3, LIMIT ? OFFSET ?
+TRAILING_LIMIT_PATTERN = re.compile(r'\s+LIMIT\s+(\d+|\?)(?:\s+OFFSET\s+(\d+|\?))?\s*$', re.IGNORECASE)
+
+
+def encode_cursor(offset):
+    """Encode a row offset as an opaque pagination cursor"""
+    return base64.urlsafe_b64encode(f'o:{offset}'.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        kind, offset = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split(':', 1)
+        offset = int(offset)
+    except Exception:
+        raise ValueError('Invalid pagination cursor')
+    if kind != 'o' or offset < 0:
+        raise ValueError('Invalid pagination cursor')
+    return offset
+
+
+def parse_page(data, max_limit=10000):
+    """
+    Read the ``limit`` / ``after`` pagination fields of a request
+
+    Returns:
+        tuple: (limit or None, offset)
+
+    Raises:
+        ValueError: If either field is invalid
+    """
+    limit = data.get('limit')
+    after = data.get('after')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError('limit must be an integer')
+        if limit <= 0:
+            raise ValueError('limit must be positive')
+        limit = min(limit, max_limit)
+    offset = decode_cursor(after) if after else 0
+    return limit, offset
+
+
+def paginate_sql(sql_query, limit, offset, params=()):
+    """
+    Limit a SELECT to one page plus one look-ahead row
+
+    The extra row tells the caller whether a next page exists without a
+    separate COUNT query. The LIMIT is added to the statement itself: in a
+    ``SELECT * FROM (...)`` wrapper sqlite renames the duplicate column
+    names of joins ("id:1"). A LIMIT the statement already ends with (a
+    "top 3", or an earlier page) is folded into the new one, and trailing
+    ``--`` notes are dropped. LIMIT and OFFSET are bound, so every page
+    reuses one prepared statement.
+
+    Returns:
+        tuple: (sql_query, params)
+    """
+    params = tuple(params)
+    sql_query = TRAILING_COMMENT_PATTERN.sub('', sql_query.rstrip()).rstrip().rstrip(';')
+    count, skip = int(limit) + 1, int(offset)
+    previous = TRAILING_LIMIT_PATTERN.search(sql_query)
+    if previous:
+        bound = params
+        values = []
+        for value in reversed(previous.groups()):
+            if value == '?':
+                value, bound = bound[-1], bound[:-1]
+            values.insert(0, value)
+        previous_limit, previous_offset = (int(value) if value is not None else None for value in values)
+        if previous_limit >= 0:
+            # Rows skip .. skip + count of the previous window
+            count = max(0, min(count, previous_limit - skip))
+        skip += previous_offset or 0
+        sql_query, params = sql_query[:previous.start()], bound
+    return f'{sql_query} LIMIT ? OFFSET ?', params + (count, skip)
+
+
+def ndjson_stream(pool, sql_query, meta, batch_size=500, limit=None, offset=0, dumps=json.dumps,
+                  params=(), governor=None, budget=None, columnar=False):
+    """
+    Execute a statement and yield its results as newline-delimited JSON
+
+    Lines are ``{"meta": ...}`` first, then ``{"columns": [...]}``, then one
+    ``{"rows": [[...], ...]}`` line per fetchmany batch (``{"values": [[...],
+    ...]}``, one array per column, when columnar), and finally
+    ``{"end": {"row_count": n, "next": cursor, "truncated": bool}}`` or
+    ``{"error": "..."}``; a truncated stream also carries
+    ``truncated_reason``. Only one batch of rows is held in memory at a
+    time, and the pooled connection is released as soon as the generator
+    finishes or is closed because the client went away.
+
+    Args:
+        pool (ConnectionPool): Pool to check a connection out of
+        sql_query (str): The statement to run (already paginated if needed)
+        meta (dict): Fields to send before any rows
+        batch_size (int): Rows per fetchmany call and per emitted line
+        limit (int): Page size when the statement was built by paginate_sql
+        offset (int): Offset of the first row, used for the next cursor
+        dumps (callable): JSON encoder
+        params (tuple): Values bound to the statement's placeholders
+        governor (QueryGovernor): Runs the statement under budget; an
+            unlimited governor is used when None
+        budget (QueryBudget): Limits for this statement
+        columnar (bool): Send each batch as column arrays
+    """
+    if governor is None:
+        # Imported here: query_governor imports this module
+        from query_governor import QueryGovernor
+        governor = QueryGovernor(max_rows=None, timeout=None)
+    yield dumps({'meta': meta}) + '\n'
+
+    count = 0
+    more = False
+    try:
+        with pool.connection() as conn, governor.run(conn, sql_query, params, budget) as query:
+            yield dumps({'columns': query.columns}) + '\n'
+
+            for rows in query.batches(batch_size):
+                if limit is not None and count + len(rows) > limit:
+                    # The look-ahead row only signals another page
+                    rows = rows[:limit - count]
+                    more = True
+                count += len(rows)
+                if rows and columnar:
+                    yield dumps({'values': list(zip(*rows))}) + '\n'
+                elif rows:
+                    yield dumps({'rows': [tuple(row) for row in rows]}) + '\n'
+                if more:
+                    break
+    except Exception as e:
+        yield dumps({'error': str(e)}) + '\n'
+        return
+
+    end = {
+        'row_count': count,
+        'next': encode_cursor(offset + count) if more else None,
+        'truncated': query.truncated
+    }
+    if query.truncated:
+        end['truncated_reason'] = query.reason
+    yield dumps({'end': end}) + '\n'
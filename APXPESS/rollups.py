@@ -0,0 +1,661 @@
+"""
+Materialized rollups of aggregate questions
+
+Dashboard questions ("total sales per country", "how many tracks per
+genre") aggregate a whole fact table every time they are asked. The
+aggregate statements the app executes are recorded by their shape: the
+aggregated (fact) table, the measure column and the fact columns the
+statement groups, filters or joins by. Once a shape has run ``min_uses``
+times, the fact table is summarized into a rollup table with one row per
+distinct value of those key columns:
+
+    rollup_<id>(<key columns>, _rollup_count, _rollup_values, _rollup_sum,
+                _rollup_min, _rollup_max)
+
+Statements of that shape, or of a coarser one (fewer keys), then read the
+rollup instead of the fact table: it takes the fact table's place in FROM
+under the fact table's name, so joins, WHERE and GROUP BY stay as they
+are, and COUNT, SUM, AVG, MIN and MAX are computed from the per-key
+counts, sums and extremes.
+
+Rollups are refreshed incrementally by triggers on the fact table, within
+the transaction of every write, whichever connection makes it: inserts
+and deletes add to and subtract from their key's row, updates do both,
+and only removing a key's current minimum or maximum rescans that key.
+Keys without rows left are deleted. Sums kept this way may differ from a
+fresh SUM by floating point rounding.
+
+``INSERT OR REPLACE`` (and ``UPDATE OR REPLACE``) deletes the rows it
+replaces without firing delete triggers, unless recursive_triggers is on,
+so the rollup would silently drift. Guard triggers therefore flag a rollup
+stale in the catalog whenever a write collides with an existing row on its
+rowid or a unique key. A plain conflicting INSERT aborts and takes the
+flag with it; whatever resolves the conflict instead (REPLACE, IGNORE,
+an upsert) leaves it set. A stale rollup is no longer served from the next
+statement on, it is dropped and its shape is not rolled up again by this
+process. Fact tables with a unique index on an expression, where
+collisions cannot be checked, are not rolled up.
+
+Rollup tables live in the database, so they survive restarts and serve
+every process; they are described in the rollup_catalog table and hidden
+from the schema catalog.
+"""
+import hashlib
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from schema_catalog import ROLLUP_CATALOG_TABLE as CATALOG_TABLE
+
+ROLLUP_PREFIX = 'rollup_'
+
+# Aggregate statements as NaturalLanguageToSQL generates them (and sessions
+# narrow them): SELECT ... FROM t [JOIN u ON u.a = t.b ...] [WHERE ...]
+# [GROUP BY ... [HAVING ...]] [ORDER BY ...] [LIMIT n]
+STATEMENT_PATTERN = re.compile(
+    r'^SELECT (?P<select>.+?) FROM (?P<from>\w+(?: JOIN \w+ ON \w+\.\w+ = \w+\.\w+)*)'
+    r'(?P<rest>(?: (?:WHERE|GROUP BY|ORDER BY|LIMIT) .*)?)$', re.DOTALL)
+JOIN_PATTERN = re.compile(r' JOIN (\w+) ON ')
+AGGREGATE_CALL_PATTERN = re.compile(r'\b(COUNT|SUM|AVG|MIN|MAX)\((?:(\w+)\.)?(\w+|\*)\)', re.IGNORECASE)
+QUALIFIED_PATTERN = re.compile(r'\b(\w+)\.(\w+)\b')
+ALIAS_PATTERN = re.compile(r'\bAS \w+', re.IGNORECASE)
+WORD_PATTERN = re.compile(r'\b[A-Za-z_]\w*\b')
+
+# What each aggregate of the fact table becomes over a rollup; {q} is the
+# table qualifier, if the statement uses one
+REWRITES = {
+    'COUNT(*)': 'COALESCE(SUM({q}_rollup_count), 0)',
+    'COUNT': 'COALESCE(SUM({q}_rollup_values), 0)',
+    'SUM': '(CASE WHEN SUM({q}_rollup_values) > 0 THEN SUM({q}_rollup_sum) END)',
+    'AVG': '(CAST(SUM({q}_rollup_sum) AS REAL) / SUM({q}_rollup_values))',
+    'MIN': 'MIN({q}_rollup_min)',
+    'MAX': 'MAX({q}_rollup_max)',
+}
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class RollupManager:
+    """
+    Builds, maintains and answers from materialized rollups
+
+    ``record`` counts the shapes of executed aggregate statements and
+    queues those used ``min_uses`` times for a background build; a rollup
+    is only kept when its fact table has at least ``min_rows`` rows and it
+    has at most ``max_ratio`` times as many. ``rewrite`` turns a statement
+    into one reading a rollup, when one fits.
+    """
+
+    def __init__(self, database, min_uses=3, create=True, max_rollups=20, min_rows=10000,
+                 max_ratio=0.1, max_shapes=10000, check_interval=1.0):
+        """
+        Args:
+            database (str): Path of the sqlite database
+            min_uses (int): Executions of a shape before it is rolled up
+            create (bool): Build rollups; when False existing ones are used
+                and new shapes only reported
+            max_rollups (int): Most rollups kept
+            min_rows (int): Smaller fact tables are scanned directly
+            max_ratio (float): Rollups larger than this fraction of their
+                fact table are not worth keeping
+            max_shapes (int): Distinct statements tracked
+            check_interval (float): Minimum seconds between two checks for
+                rollups built or dropped by other processes
+        """
+        self.database = database
+        self.min_uses = min_uses
+        self.create = create
+        self.max_rollups = max_rollups
+        self.min_rows = min_rows
+        self.max_ratio = max_ratio
+        self.max_shapes = max_shapes
+        self.check_interval = check_interval
+
+        # sql -> shape (table, measure, keys), None when not an aggregate
+        self._shapes = {}
+        # shape -> {'uses', 'seconds', 'status', ...} (see report())
+        self._candidates = {}
+        # name -> {'table', 'measure', 'keys', 'rows', ...}
+        self._rollups = {}
+        # table -> [columns], from PRAGMA table_info
+        self._columns = {}
+        self._schema_version = None
+        self._data_version = None
+        # Rollup triggers present at the last schema check
+        self._triggers = set()
+        # Rollups found stale by this process
+        self._stale = set()
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._reader = None
+        self._writer = None
+        # Handles inherited over fork(), kept open but never used
+        self._inherited = []
+        self._stats = {'recorded': 0, 'rewritten': 0, 'built': 0, 'rejected': 0, 'dropped': 0, 'stale': 0}
+
+    def after_fork(self):
+        """Reset the connections and the build thread in a forked child process"""
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        for conn in (self._reader, self._writer):
+            if conn is not None:
+                self._inherited.append(conn)
+        self._reader = None
+        self._writer = None
+        # data_version is per connection
+        self._data_version = None
+        for candidate in self._candidates.values():
+            if candidate['status'] == 'pending':
+                candidate['status'] = 'observing'
+
+    def _read_connection(self):
+        """Read-only connection for the catalog; caller holds the lock"""
+        if self._reader is None:
+            self._reader = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True,
+                                           check_same_thread=False)
+        return self._reader
+
+    def _sync(self):
+        """
+        Reload the rollups when the schema or the data changed; caller
+        holds the lock
+
+        The schema is checked every check_interval seconds. PRAGMA
+        data_version moves with every commit of another connection, so a
+        rollup flagged stale by a write is never served after it.
+        """
+        now = time.monotonic()
+        try:
+            conn = self._read_connection()
+            changed = False
+            if now - self._last_check >= self.check_interval:
+                self._last_check = now
+                schema_version = conn.execute('PRAGMA schema_version').fetchone()[0]
+                if schema_version != self._schema_version:
+                    self._schema_version = schema_version
+                    self._columns = {}
+                    self._triggers = {name for (name,) in conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ? ESCAPE '\\'",
+                        (ROLLUP_PREFIX.replace('_', '\\_') + '%',))}
+                    changed = True
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if not changed and data_version == self._data_version:
+                return
+            self._data_version = data_version
+            rollups = {}
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (CATALOG_TABLE,)).fetchone():
+                for name, definition in conn.execute(f'SELECT name, definition FROM {CATALOG_TABLE}'):
+                    rollup = json.loads(definition)
+                    rollup['keys'] = tuple(rollup['keys'])
+                    if rollup.get('stale'):
+                        self._retire(name, rollup)
+                    # A rollup whose triggers are gone (its fact table was
+                    # dropped) no longer follows the data; one built before
+                    # guard triggers existed may have drifted unnoticed
+                    elif rollup.get('guarded') and all(
+                            f'{name}_{event}' in self._triggers for event in ('insert', 'delete', 'update')):
+                        rollups[name] = rollup
+            self._rollups = rollups
+        except sqlite3.Error:
+            self._rollups = {}
+
+    def _retire(self, name, rollup):
+        """
+        Stop using a rollup flagged stale: its fact table was written with
+        OR REPLACE (or a write resolved a conflict otherwise); caller holds
+        the lock
+        """
+        if name in self._stale:
+            return
+        self._stale.add(name)
+        self._stats['stale'] += 1
+        candidate = self._candidates.get((rollup['table'], rollup['measure'], rollup['keys']))
+        if candidate is not None:
+            # Rebuilding would only drift again
+            candidate.update(status='rejected', reason='fact table written with OR REPLACE')
+        if self.create:
+            self._submit(('drop', name))
+
+    def _submit(self, task):
+        """Queue a task for the builder thread; caller holds the lock"""
+        self._queue.put(task)
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='rollup-builder', daemon=True)
+            self._worker.start()
+
+    def _table_columns(self, table):
+        """Columns of a table; caller holds the lock"""
+        columns = self._columns.get(table)
+        if columns is None:
+            quoted = table.replace('"', '""')
+            columns = self._columns[table] = [
+                row[1] for row in self._read_connection().execute(f'PRAGMA table_info("{quoted}")')]
+        return columns
+
+    def _shape(self, sql_query):
+        """
+        The shape of an aggregate statement; caller holds the lock
+
+        Returns:
+            tuple: (fact table, measure column or None, sorted key
+                columns), or None when the statement cannot be answered
+                from a rollup
+        """
+        if sql_query in self._shapes:
+            return self._shapes[sql_query]
+        shape = None
+        match = STATEMENT_PATTERN.match(sql_query)
+        calls = AGGREGATE_CALL_PATTERN.findall(sql_query) if match and '--' not in sql_query else []
+        if calls:
+            try:
+                shape = self._parse(match, calls)
+            except sqlite3.Error:
+                shape = None
+        if len(self._shapes) < self.max_shapes:
+            self._shapes[sql_query] = shape
+        return shape
+
+    def _parse(self, match, calls):
+        from_clause = match.group('from')
+        tables = [from_clause.split(' ', 1)[0]] + JOIN_PATTERN.findall(from_clause)
+        if len(set(tables)) != len(tables) or any(
+                table == CATALOG_TABLE or table in self._rollups for table in tables):
+            return None
+        qualified = len(tables) > 1
+
+        measures = {(table or tables[0], column) for _, table, column in calls if column != '*'}
+        if len(measures) > 1:
+            return None
+        if measures:
+            table, measure = measures.pop()
+        else:
+            # COUNT(*) only: the largest table is the one worth summarizing
+            measure = None
+            conn = self._read_connection()
+            table = max(tables, key=lambda name: conn.execute(
+                f'SELECT COALESCE(MAX(rowid), 0) FROM {quote(name)}').fetchone()[0])
+        columns = self._table_columns(table)
+        if table not in tables or (measure is not None and measure not in columns):
+            return None
+
+        # Every other use of a fact column makes it a key
+        rest = AGGREGATE_CALL_PATTERN.sub('', f"{match.group('select')} {from_clause}{match.group('rest')}")
+        keys = set()
+        rest = ALIAS_PATTERN.sub('', rest)
+        if qualified:
+            for reference_table, column in QUALIFIED_PATTERN.findall(rest):
+                if reference_table == table:
+                    if column not in columns:
+                        return None
+                    keys.add(column)
+            # A bare name could be a fact column not counted as a key
+            if any(word in columns for word in WORD_PATTERN.findall(QUALIFIED_PATTERN.sub('', rest))):
+                return None
+        else:
+            keys.update(word for word in WORD_PATTERN.findall(rest) if word in columns)
+        return (table, measure, tuple(sorted(keys)))
+
+    def record(self, sql_query, seconds):
+        """
+        Count an executed statement read from its fact table
+
+        Cheap enough to call on every execution: each distinct statement is
+        parsed once, and rollups are built on a background thread.
+        """
+        with self._lock:
+            self._sync()
+            shape = self._shape(sql_query)
+            if shape is None:
+                return
+            self._stats['recorded'] += 1
+            candidate = self._candidates.get(shape)
+            if candidate is None:
+                if len(self._candidates) >= self.max_shapes:
+                    return
+                table, measure, keys = shape
+                candidate = self._candidates[shape] = {
+                    'table': table, 'measure': measure, 'keys': list(keys),
+                    'uses': 0, 'seconds': 0.0, 'status': 'observing',
+                }
+            candidate['uses'] += 1
+            candidate['seconds'] += seconds
+            if (candidate['status'] == 'observing' and candidate['uses'] >= self.min_uses
+                    and self._find(shape) is None):
+                if not self.create:
+                    candidate['status'] = 'recommended'
+                    return
+                candidate['status'] = 'pending'
+                self._submit(('build', shape))
+
+    def _find(self, shape):
+        """The smallest rollup that can answer a shape; caller holds the lock"""
+        table, measure, keys = shape
+        best = None
+        for name, rollup in self._rollups.items():
+            if (rollup['table'] == table and (measure is None or rollup['measure'] == measure)
+                    and set(keys) <= set(rollup['keys'])
+                    and (best is None or rollup['rows'] < self._rollups[best]['rows'])):
+                best = name
+        return best
+
+    def rewrite(self, sql_query):
+        """
+        Rewrite an aggregate statement to read a rollup
+
+        Returns:
+            str: The statement over the rollup (same parameters, same
+                result columns), or None when no rollup fits
+        """
+        with self._lock:
+            self._sync()
+            if not self._rollups:
+                return None
+            shape = self._shape(sql_query)
+            name = self._find(shape) if shape is not None else None
+            if name is None:
+                return None
+            self._stats['rewritten'] += 1
+        table = shape[0]
+        match = STATEMENT_PATTERN.match(sql_query)
+        qualifier = f'{table}.' if JOIN_PATTERN.search(match.group('from')) else ''
+
+        def aggregate(call):
+            function, _, column = call.groups()
+            template = REWRITES['COUNT(*)' if column == '*' else function.upper()]
+            return template.format(q=qualifier)
+
+        from_clause = match.group('from')
+        if from_clause.split(' ', 1)[0] == table:
+            from_clause = f'{name} AS {table}' + from_clause[len(table):]
+        else:
+            from_clause = from_clause.replace(f' JOIN {table} ON ', f' JOIN {name} AS {table} ON ', 1)
+        return (f"SELECT {AGGREGATE_CALL_PATTERN.sub(aggregate, match.group('select'))} "
+                f"FROM {from_clause}{AGGREGATE_CALL_PATTERN.sub(aggregate, match.group('rest'))}")
+
+    def _run(self):
+        while True:
+            action, argument = self._queue.get()
+            try:
+                if action == 'build':
+                    self.build(*argument)
+                else:
+                    self.drop(argument)
+            except Exception as e:
+                if action == 'build':
+                    self._update(argument, status='failed', reason=str(e))
+                else:
+                    print(f"Note: dropping rollup {argument} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _update(self, shape, **fields):
+        with self._lock:
+            self._candidates.setdefault(shape, {
+                'table': shape[0], 'measure': shape[1], 'keys': list(shape[2]),
+                'uses': 0, 'seconds': 0.0}).update(fields)
+
+    def build(self, table, measure, keys):
+        """
+        Materialize the rollup of a shape and install its triggers
+
+        Runs on the builder thread; callable directly from scripts. The
+        rollup is filled and its triggers created in one transaction, so
+        no write to the fact table is missed.
+
+        Returns:
+            str: The rollup's name, or None when it was not worth building
+        """
+        shape = (table, measure, tuple(keys))
+        name = ROLLUP_PREFIX + hashlib.sha1(json.dumps(shape).encode('utf-8')).hexdigest()[:10]
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.database, timeout=30.0, isolation_level=None,
+                                           check_same_thread=False)
+        conn = self._writer
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} '
+                         f'(name TEXT PRIMARY KEY, definition TEXT NOT NULL)')
+            existing = conn.execute(f'SELECT definition FROM {CATALOG_TABLE} WHERE name = ?', (name,)).fetchone()
+            if existing is not None:
+                existing = json.loads(existing[0])
+                if existing.get('guarded') and not existing.get('stale'):
+                    # Built by another process meanwhile
+                    conn.execute('COMMIT')
+                    self._update(shape, status='created', rollup=name)
+                    return name
+                # Stale, or built without guards: start over from the fact table
+                self._drop_objects(conn, name)
+            if conn.execute(f'SELECT COUNT(*) FROM {CATALOG_TABLE}').fetchone()[0] >= self.max_rollups:
+                return self._reject(conn, shape, f'rollup cap of {self.max_rollups} reached')
+
+            guards = self._guards(conn, name, table)
+            if guards is None:
+                return self._reject(conn, shape, 'a unique index on an expression hides OR REPLACE writes')
+            fact_rows = conn.execute(f'SELECT COUNT(*) FROM {quote(table)}').fetchone()[0]
+            if fact_rows < self.min_rows:
+                return self._reject(conn, shape, f'{fact_rows} rows are scanned fast enough')
+            key_list = ', '.join(quote(key) for key in keys)
+            group_by = f' GROUP BY {key_list}' if keys else ''
+            rows = conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM {quote(table)}{group_by})').fetchone()[0]
+            if rows > self.max_ratio * fact_rows:
+                return self._reject(conn, shape, f'{rows} keys for {fact_rows} rows')
+
+            # Keys and extremes keep the declared types (and so the
+            # comparison rules) of the fact columns
+            types = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info({quote(table)})')}
+            measure_type = types.get(measure, '') if measure is not None else ''
+            columns = [f'{quote(key)} {types.get(key, "")}'.rstrip() for key in keys]
+            columns += ['_rollup_count INTEGER NOT NULL', '_rollup_values INTEGER NOT NULL', '_rollup_sum',
+                        f'_rollup_min {measure_type}'.rstrip(), f'_rollup_max {measure_type}'.rstrip()]
+            conn.execute(f'CREATE TABLE {name} ({", ".join(columns)})')
+            value = quote(measure) if measure is not None else 'NULL'
+            start = time.perf_counter()
+            conn.execute(f'INSERT INTO {name} SELECT {key_list + ", " if keys else ""}COUNT(*), '
+                         f'COUNT({value}), SUM({value}), MIN({value}), MAX({value}) '
+                         f'FROM {quote(table)}{group_by}')
+            conn.execute(f'DELETE FROM {name} WHERE _rollup_count = 0')
+            if keys:
+                conn.execute(f'CREATE UNIQUE INDEX {name}_keys ON {name} ({key_list})')
+            for statement in self._maintenance_triggers(name, table, measure, keys) + guards:
+                conn.execute(statement)
+            definition = {'table': table, 'measure': measure, 'keys': list(keys), 'rows': rows,
+                          'fact_rows': fact_rows, 'build_seconds': time.perf_counter() - start,
+                          'created_at': time.time(), 'guarded': True}
+            conn.execute(f'INSERT INTO {CATALOG_TABLE} (name, definition) VALUES (?, ?)',
+                         (name, json.dumps(definition)))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._lock:
+            self._stats['built'] += 1
+            # Seen at once by this process, not after check_interval
+            self._last_check = 0.0
+        self._update(shape, status='created', rollup=name, rows=rows, fact_rows=fact_rows)
+        return name
+
+    def _reject(self, conn, shape, reason):
+        conn.execute('COMMIT')
+        with self._lock:
+            self._stats['rejected'] += 1
+        self._update(shape, status='rejected', reason=reason)
+        return None
+
+    def _maintenance_triggers(self, name, table, measure, keys):
+        """CREATE TRIGGER statements keeping a rollup in step with its fact table"""
+        value = quote(measure) if measure is not None else 'NULL'
+
+        def measured(row):
+            return f'{row}.{value}' if measure is not None else 'NULL'
+
+        def matching(row):
+            return ' AND '.join(f'{quote(key)} IS {row}.{quote(key)}' for key in keys) or '1'
+
+        def add(row):
+            return (f"INSERT INTO {name} ({''.join(quote(key) + ', ' for key in keys)}_rollup_count, "
+                    f"_rollup_values) SELECT {''.join(f'{row}.{quote(key)}, ' for key in keys)}0, 0 "
+                    f"WHERE NOT EXISTS (SELECT 1 FROM {name} WHERE {matching(row)}); "
+                    f"UPDATE {name} SET _rollup_count = _rollup_count + 1, "
+                    f"_rollup_values = _rollup_values + ({measured(row)} IS NOT NULL), "
+                    f"_rollup_sum = CASE WHEN {measured(row)} IS NULL THEN _rollup_sum "
+                    f"ELSE COALESCE(_rollup_sum, 0) + {measured(row)} END, "
+                    f"_rollup_min = CASE WHEN {measured(row)} IS NOT NULL AND (_rollup_min IS NULL "
+                    f"OR {measured(row)} < _rollup_min) THEN {measured(row)} ELSE _rollup_min END, "
+                    f"_rollup_max = CASE WHEN {measured(row)} IS NOT NULL AND (_rollup_max IS NULL "
+                    f"OR {measured(row)} > _rollup_max) THEN {measured(row)} ELSE _rollup_max END "
+                    f"WHERE {matching(row)};")
+
+        def tied(row):
+            # Another row still holding the removed extreme keeps it
+            return f'SELECT 1 FROM {quote(table)} WHERE {matching(row)} AND {value} = {measured(row)}'
+
+        def remove(row):
+            # The subqueries read the fact table as it is after the write;
+            # a key is rescanned only when its only extreme row went away
+            return (f"UPDATE {name} SET _rollup_count = _rollup_count - 1, "
+                    f"_rollup_values = _rollup_values - ({measured(row)} IS NOT NULL), "
+                    f"_rollup_sum = CASE WHEN {measured(row)} IS NULL THEN _rollup_sum "
+                    f"WHEN _rollup_values = 1 THEN NULL ELSE _rollup_sum - {measured(row)} END, "
+                    f"_rollup_min = CASE WHEN {measured(row)} IS NOT NULL AND {measured(row)} <= _rollup_min "
+                    f"AND NOT EXISTS ({tied(row)}) "
+                    f"THEN (SELECT MIN({value}) FROM {quote(table)} WHERE {matching(row)}) ELSE _rollup_min END, "
+                    f"_rollup_max = CASE WHEN {measured(row)} IS NOT NULL AND {measured(row)} >= _rollup_max "
+                    f"AND NOT EXISTS ({tied(row)}) "
+                    f"THEN (SELECT MAX({value}) FROM {quote(table)} WHERE {matching(row)}) ELSE _rollup_max END "
+                    f"WHERE {matching(row)}; "
+                    f"DELETE FROM {name} WHERE {matching(row)} AND _rollup_count = 0;")
+
+        watched = ', '.join(quote(column) for column in dict.fromkeys(
+            list(keys) + ([measure] if measure is not None else [])))
+        return [
+            f'CREATE TRIGGER {name}_insert AFTER INSERT ON {quote(table)} BEGIN {add("NEW")} END',
+            f'CREATE TRIGGER {name}_delete AFTER DELETE ON {quote(table)} BEGIN {remove("OLD")} END',
+            # A table without keys or measure changes nothing on update
+            f'CREATE TRIGGER {name}_update AFTER UPDATE OF {watched} ON {quote(table)} '
+            f'BEGIN {remove("OLD")} {add("NEW")} END' if watched else
+            f'CREATE TRIGGER {name}_update AFTER UPDATE ON {quote(table)} WHEN 0 BEGIN SELECT 1; END',
+        ]
+
+    def _guards(self, conn, name, table):
+        """
+        CREATE TRIGGER statements flagging a rollup stale when a write
+        collides with an existing row of its fact table (see the module
+        docstring)
+
+        Returns:
+            list: The statements, or None when a unique index is on an
+                expression and collisions cannot be checked
+        """
+        quoted = quote(table)
+        unique = []
+        primary = None
+        for _, index, is_unique, origin, _ in conn.execute(f'PRAGMA index_list({quoted})'):
+            if not is_unique:
+                continue
+            columns = [info[2] for info in conn.execute(f'PRAGMA index_info({quote(index)})')]
+            if None in columns:
+                return None
+            unique.append(columns)
+            if origin == 'pk':
+                primary = columns
+        info = list(conn.execute(f'PRAGMA table_info({quoted})'))
+        pk_columns = [row for row in info if row[5]]
+        try:
+            conn.execute(f'SELECT rowid FROM {quoted} LIMIT 0')
+            has_rowid = True
+        except sqlite3.OperationalError:
+            has_rowid = False
+
+        def collides(columns, row):
+            return ' AND '.join(f'_other.{quote(column)} = {row}.{quote(column)}' for column in columns)
+
+        def other_row():
+            # Not the row being updated
+            if has_rowid:
+                return '_other.rowid != OLD.rowid'
+            return 'NOT (' + ' AND '.join(f'_other.{quote(column)} IS OLD.{quote(column)}'
+                                         for column in primary) + ')'
+
+        mark = (f"UPDATE {CATALOG_TABLE} SET definition = json_set(definition, '$.stale', json('true')) "
+                f"WHERE name = '{name}';")
+        on_insert = [f'EXISTS (SELECT 1 FROM {quoted} AS _other WHERE {collides(columns, "NEW")})'
+                     for columns in unique]
+        on_update = [f'EXISTS (SELECT 1 FROM {quoted} AS _other WHERE {collides(columns, "NEW")} '
+                     f'AND {other_row()})' for columns in unique]
+        watched = [column for columns in unique for column in columns]
+        if has_rowid:
+            on_insert.append(f'EXISTS (SELECT 1 FROM {quoted} AS _other WHERE _other.rowid = NEW.rowid)')
+            # An INTEGER PRIMARY KEY is the rowid
+            if len(pk_columns) == 1 and pk_columns[0][2].upper() == 'INTEGER':
+                watched.append(pk_columns[0][1])
+                on_update.append(f'(NEW.rowid != OLD.rowid AND EXISTS '
+                                 f'(SELECT 1 FROM {quoted} AS _other WHERE _other.rowid = NEW.rowid))')
+        guards = [f"CREATE TRIGGER {name}_guard_insert BEFORE INSERT ON {quoted} "
+                  f"WHEN {' OR '.join(on_insert)} BEGIN {mark} END"] if on_insert else []
+        if watched:
+            guards.append(f"CREATE TRIGGER {name}_guard_update BEFORE UPDATE OF "
+                          f"{', '.join(quote(column) for column in dict.fromkeys(watched))} ON {quoted} "
+                          f"WHEN {' OR '.join(on_update)} BEGIN {mark} END")
+        return guards
+
+    def _drop_objects(self, conn, name):
+        """Drop a rollup's table, triggers and catalog entry; caller is in a transaction"""
+        for event in ('insert', 'delete', 'update', 'guard_insert', 'guard_update'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}_{event}')
+        conn.execute(f'DROP TABLE IF EXISTS {name}')
+        conn.execute(f'DELETE FROM {CATALOG_TABLE} WHERE name = ?', (name,))
+
+    def drop(self, name):
+        """Drop a rollup, its triggers and its catalog entry"""
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.database, timeout=30.0, isolation_level=None,
+                                           check_same_thread=False)
+        conn = self._writer
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._drop_objects(conn, name)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        with self._lock:
+            self._stats['dropped'] += 1
+            self._last_check = 0.0
+
+    def wait(self):
+        """Block until every pending rollup was built or dropped (for scripts and benchmarks)"""
+        while True:
+            with self._lock:
+                busy = (self._queue.unfinished_tasks
+                        or any(c['status'] == 'pending' for c in self._candidates.values()))
+            if not busy:
+                return
+            time.sleep(0.05)
+
+    def report(self):
+        """Return the rollups and the observed shapes, most used first"""
+        with self._lock:
+            self._sync()
+            rollups = [dict(rollup, name=name, keys=list(rollup['keys']))
+                       for name, rollup in self._rollups.items()]
+            candidates = sorted((dict(candidate) for candidate in self._candidates.values()),
+                                key=lambda candidate: -candidate['uses'])
+        return {'rollups': rollups, 'candidates': candidates}
+
+    def stats(self):
+        """Return counters for /metrics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['rollups'] = len(self._rollups)
+            stats['rollup_rows'] = sum(rollup['rows'] for rollup in self._rollups.values())
+            stats['shapes'] = len(self._shapes)
+        return stats
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SNAPSHOT_VERSION = 1
+
+# Lists the rollup tables rollups.py maintains; it and the tables it lists
+# are hidden from the catalog
+ROLLUP_CATALOG_TABLE = 'rollup_catalog'
+
+
+class SchemaCatalog:
+    """
+    Introspected description of a sqlite database
+
+    Tables, column types and foreign keys are read from ``sqlite_master``
+    and ``PRAGMA table_info`` / ``PRAGMA foreign_key_list``. A JSON snapshot
+    is persisted next to the database so startup can load it without
+    introspecting, and refreshes only re-read tables whose DDL changed.
+    The ``tables`` dict is replaced as a whole on refresh, never mutated,
+    so readers on other threads always see a consistent catalog.
+    """
+
+    def __init__(self, database, snapshot_path=None):
+        """
+        Args:
+            database (str): Path of the sqlite database to describe
+            snapshot_path (str): Where to persist the catalog; no snapshot is
+                written when None
+        """
+        self.database = database
+        self.snapshot_path = snapshot_path
+        # table -> {'ddl_hash', 'columns': [...], 'foreign_keys': [...]}
+        self.tables = {}
+        self.schema_version = None
+        self.refreshed_at = None
+        self._refresh_lock = threading.Lock()
+        self._fk_graph = None
+        # Set once tables are known, from a snapshot or a refresh
+        self.ready = threading.Event()
+
+    def load(self):
+        """
+        Load the persisted snapshot
+
+        Returns:
+            bool: True if a usable snapshot was loaded
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return False
+        if snapshot.get('database') != os.path.abspath(self.database):
+            return False
+        self.schema_version = snapshot.get('schema_version')
+        self.refreshed_at = snapshot.get('refreshed_at')
+        self._set_tables(snapshot.get('tables', {}))
+        return True
+
+    def save(self):
+        """Write the snapshot atomically"""
+        if not self.snapshot_path:
+            return
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'database': os.path.abspath(self.database),
+            'schema_version': self.schema_version,
+            'refreshed_at': self.refreshed_at,
+            'tables': self.tables,
+        }
+        tmp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, self.snapshot_path)
+
+    def refresh(self):
+        """
+        Bring the catalog up to date with the database
+
+        ``PRAGMA schema_version`` is checked first so an unchanged database
+        costs a single query; otherwise only tables whose CREATE statement
+        changed are introspected again.
+
+        Returns:
+            bool: True if the catalog changed
+        """
+        if not os.path.exists(self.database):
+            return False
+
+        with self._refresh_lock:
+            conn = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True)
+            try:
+                schema_version = conn.execute('PRAGMA schema_version').fetchone()[0]
+                if schema_version == self.schema_version and self.tables:
+                    return False
+
+                hidden = self._rollup_tables(conn)
+                tables = {}
+                changed = False
+                for name, sql in conn.execute(
+                        "SELECT name, sql FROM sqlite_master "
+                        "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+                    if name in hidden:
+                        continue
+                    ddl_hash = hashlib.sha1((sql or '').encode('utf-8')).hexdigest()
+                    previous = self.tables.get(name)
+                    if previous is not None and previous['ddl_hash'] == ddl_hash:
+                        tables[name] = previous
+                    else:
+                        tables[name] = self._introspect_table(conn, name, ddl_hash)
+                        changed = True
+                changed = changed or set(tables) != set(self.tables)
+            finally:
+                conn.close()
+
+            self.schema_version = schema_version
+            self.refreshed_at = time.time()
+            if changed:
+                self._set_tables(tables)
+            self.save()
+            return changed
+
+    @staticmethod
+    def _rollup_tables(conn):
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (ROLLUP_CATALOG_TABLE,)).fetchone():
+            return set()
+        return {ROLLUP_CATALOG_TABLE} | {
+            name for (name,) in conn.execute(f'SELECT name FROM {ROLLUP_CATALOG_TABLE}')}
+
+    def _introspect_table(self, conn, name, ddl_hash):
+        quoted = name.replace('"', '""')
+        columns = [{
+            'name': row[1],
+            'type': (row[2] or '').upper(),
+            'notnull': bool(row[3]),
+            'pk': row[5],
+        } for row in conn.execute(f'PRAGMA table_info("{quoted}")')]
+        foreign_keys = [{
+            'column': row[3],
+            'ref_table': row[2],
+            'ref_column': row[4],
+        } for row in conn.execute(f'PRAGMA foreign_key_list("{quoted}")')]
+        return {'ddl_hash': ddl_hash, 'columns': columns, 'foreign_keys': foreign_keys}
+
+    def _set_tables(self, tables):
+        self._fk_graph = None
+        self.tables = tables
+        if tables:
+            self.ready.set()
+
+    def refresh_in_background(self, on_change=None, interval=None):
+        """
+        Refresh on a daemon thread so startup and requests never wait for it
+
+        Args:
+            on_change (callable): Called with the catalog when it changed
+            interval (float): Keep polling every interval seconds; refresh
+                once when None
+        """
+        def run():
+            while True:
+                try:
+                    if self.refresh() and on_change is not None:
+                        on_change(self)
+                except Exception as e:
+                    print(f"Note: schema refresh failed: {e}")
+                if interval is None:
+                    return
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='schema-catalog-refresh', daemon=True)
+        thread.start()
+        return thread
+
+    def as_db_schema(self):
+        """Return the catalog in NaturalLanguageToSQL's db_schema format"""
+        return {table: [column['name'] for column in info['columns']]
+                for table, info in self.tables.items()}
+
+    def column_types(self, table):
+        """Return {column: declared type} for a table"""
+        info = self.tables.get(table)
+        if info is None:
+            return {}
+        return {column['name']: column['type'] for column in info['columns']}
+
+    def foreign_keys(self, table):
+        """Return the foreign keys declared on a table"""
+        info = self.tables.get(table)
+        return info['foreign_keys'] if info else []
+
+    def fk_graph(self):
+        """
+        Return the undirected foreign-key graph
+
+        Returns:
+            dict: table -> list of (neighbour table, local column, neighbour column)
+        """
+        graph = self._fk_graph
+        if graph is not None:
+            return graph
+        tables = self.tables
+        graph = {table: [] for table in tables}
+        for table, info in tables.items():
+            for fk in info['foreign_keys']:
+                ref_table = fk['ref_table']
+                if ref_table not in graph:
+                    continue
+                ref_column = fk['ref_column'] or self._primary_key(ref_table)
+                graph[table].append((ref_table, fk['column'], ref_column))
+                graph[ref_table].append((table, ref_column, fk['column']))
+        self._fk_graph = graph
+        return graph
+
+    def _primary_key(self, table):
+        for column in self.tables.get(table, {}).get('columns', []):
+            if column['pk'] == 1:
+                return column['name']
+        return 'rowid'
+
+    def summary(self):
+        """Return a JSON-serializable description for diagnostics"""
+        return {
+            'database': self.database,
+            'schema_version': self.schema_version,
+            'refreshed_at': self.refreshed_at,
+            'tables': {table: {
+                'columns': {column['name']: column['type'] for column in info['columns']},
+                'foreign_keys': info['foreign_keys'],
+            } for table, info in self.tables.items()},
+        }
@@ -0,0 +1,92 @@
+class SelectStatement:
+    """
+    A generated SELECT kept as its parts
+
+    The generator renders its statements from these parts, and a follow-up
+    question (see sessions.narrow_sql) adds conditions, an order or a limit
+    to them and renders the statement again, instead of taking the SQL
+    text apart. Parameters are not part of it: WHERE conditions bind theirs
+    before HAVING conditions, in the order of the lists.
+    """
+
+    def __init__(self, columns, from_clause, tables, subjects=(), where=(), group_by=(), having=(),
+                 order=None, limit=None, aggregates=None, note=None):
+        """
+        Args:
+            columns (list): Select list items; an empty list selects *
+            from_clause (str): What follows FROM, joins included
+            tables (list): Tables of the FROM clause, as the schema spells
+                them
+            subjects (list): The column each select item is about: its
+                name, the column an aggregate aggregates, or for a grouped
+                ``COUNT(*) AS count`` its name
+            where (list): Conditions ANDed in the WHERE clause
+            group_by (list): GROUP BY keys
+            having (list): Conditions ANDed in the HAVING clause
+            order (str): The ORDER BY clause, e.g. 'price DESC'
+            limit (int): The LIMIT, None for none
+            aggregates (dict): (table, column) -> aggregate expression of
+                the select list; (None, column) as well, and a count of rows
+                is keyed by its name as (None, name)
+            note (str): Comment appended to the statement
+        """
+        self.columns = list(columns)
+        self.from_clause = from_clause
+        self.tables = list(tables)
+        self.subjects = list(subjects)
+        self.where = list(where)
+        self.group_by = list(group_by)
+        self.having = list(having)
+        self.order = order
+        self.limit = limit
+        self.aggregates = dict(aggregates or {})
+        self.note = note
+
+    def sql(self):
+        """Render the statement"""
+        sql = f"SELECT {', '.join(self.columns) or '*'} FROM {self.from_clause}"
+        if self.where:
+            sql += " WHERE " + " AND ".join(self.where)
+        if self.group_by:
+            sql += " GROUP BY " + ", ".join(self.group_by)
+            if self.having:
+                sql += " HAVING " + " AND ".join(self.having)
+        if self.order is not None:
+            sql += f" ORDER BY {self.order}"
+        if self.limit is not None:
+            sql += f" LIMIT {self.limit}"
+        if self.note:
+            sql += f" -- {self.note}"
+        return sql
+
+    def replace(self, **changes):
+        """A copy of the statement with some parts changed"""
+        parts = self.as_dict()
+        parts['aggregates'] = self.aggregates
+        parts.update(changes)
+        return SelectStatement(**parts)
+
+    def as_dict(self):
+        """JSON-serializable parts, as cached with translations"""
+        return {
+            'columns': self.columns,
+            'from_clause': self.from_clause,
+            'tables': self.tables,
+            'subjects': self.subjects,
+            'where': self.where,
+            'group_by': self.group_by,
+            'having': self.having,
+            'order': self.order,
+            'limit': self.limit,
+            'aggregates': [[table, column, expression]
+                           for (table, column), expression in self.aggregates.items()],
+            'note': self.note,
+        }
+
+    @classmethod
+    def from_dict(cls, parts):
+        """Inverse of as_dict"""
+        parts = dict(parts)
+        parts['aggregates'] = {(table, column): expression
+                               for table, column, expression in parts.get('aggregates', ())}
+        return cls(**parts)
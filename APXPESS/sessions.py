@@ -0,0 +1,369 @@
+"""
+Conversation sessions of POST /query
+
+A session remembers the last answered question of a conversation: its
+statement (the parts the generator rendered its SQL from, see
+select_statement.py) and parameters, the tables and columns it was about and, while they
+are small and fresh, the result rows. A follow-up such as "only the ones
+from canada" or "sort those by price" (see
+NaturalLanguageToSQL.parse_refinement) is then applied to that answer
+instead of being translated from scratch:
+
+- in memory, by filtering, sorting and cutting the remembered rows, when
+  every column involved is in the result and the comparison means the
+  same in Python as in sqlite
+- otherwise by narrowing the previous statement with more WHERE
+  conditions, an ORDER BY or a LIMIT, and rendering it again; on an aggregate ("total sales per country"),
+  conditions on and ordering by the aggregated column, or a count by its
+  name ("only those with count over 3"), apply to the aggregate through
+  HAVING and ORDER BY
+
+Sessions live in the memory of one process. They are evicted after
+SESSION_IDLE_TIMEOUT idle seconds, and beyond SESSION_MAX_SESSIONS the
+least recently used go first. Remembered rows share a byte budget; over
+it, the rows of the least recently used sessions are dropped first and
+those sessions fall back to narrowing SQL.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# Comparisons applied to remembered rows; LIKE is left to sqlite, whose
+# case folding differs from Python's outside ASCII
+OPERATORS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b,
+    '>=': lambda a, b: a >= b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+def _storage_class(value):
+    """sqlite's storage class of a value, in its sort order"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    return 3
+
+
+def _sort_key(value):
+    # NULLs, then numbers, then text, then blobs, like ORDER BY
+    return (0, 0) if value is None else (_storage_class(value), value)
+
+
+def statement_subjects(statement):
+    """
+    The tables and selected columns of a generated SELECT
+
+    Args:
+        statement (SelectStatement): The statement
+
+    Returns:
+        tuple: (tables, columns); tables in name order, columns empty for
+            ``SELECT *``, an aggregate stands for the column it aggregates
+            and, in a grouped statement, ``COUNT(*) AS count`` for its name
+    """
+    return sorted(statement.tables, key=str.lower), list(statement.subjects)
+
+
+def narrow_sql(statement, params, refinement, qualify=False):
+    """
+    Apply a refinement to a generated SELECT
+
+    Filters are ANDed to the WHERE clause, or to the HAVING clause when
+    they are on an aggregated column; a new order replaces the previous
+    one and the lower of the two limits is kept. The generator's note
+    ("No join path to ...") is dropped.
+
+    Args:
+        statement (SelectStatement): The previous statement
+        params (tuple): Its parameters
+        refinement (dict): See NaturalLanguageToSQL.parse_refinement
+        qualify (bool): Write columns as table.column (joined statements)
+
+    Returns:
+        tuple: (SelectStatement, params)
+    """
+    aggregates = statement.aggregates if statement.group_by else {}
+
+    def reference(table, column):
+        aggregate = aggregates.get((table if qualify else None, column))
+        if aggregate is not None:
+            return aggregate
+        return f'{table}.{column}' if qualify else column
+
+    # WHERE parameters come before HAVING ones in the statement
+    where, having = list(statement.where), list(statement.having)
+    having_count = sum(condition.count('?') for condition in having)
+    where_params = list(params[:len(params) - having_count])
+    having_params = list(params[len(where_params):])
+    for table, column, operator, value in refinement['filters']:
+        aggregated = (table if qualify else None, column) in aggregates
+        conditions, condition_params = (having, having_params) if aggregated else (where, where_params)
+        if operator == 'LIKE':
+            conditions.append(f"{reference(table, column)} LIKE '%' || ? || '%'")
+        else:
+            conditions.append(f'{reference(table, column)} {operator} ?')
+        condition_params.append(value)
+    params = where_params + having_params
+
+    order = statement.order
+    if refinement['order'] is not None:
+        table, column, descending = refinement['order']
+        order = f"{reference(table, column)}{' DESC' if descending else ''}"
+    limits = [limit for limit in (statement.limit, refinement['limit']) if limit is not None]
+    narrowed = statement.replace(where=where, having=having, order=order,
+                                 limit=min(limits) if limits else None, note=None)
+    return narrowed, tuple(params)
+
+
+def refine_rows(columns, rows, refinement):
+    """
+    Apply a refinement to remembered result rows
+
+    Args:
+        columns (list): Column names of the rows
+        rows (list): Tuples, as the statement returned them
+        refinement (dict): See NaturalLanguageToSQL.parse_refinement
+
+    Returns:
+        list: The refined rows, or None when sqlite could answer
+            differently: a column missing from (or repeated in) the result,
+            a LIKE filter, or a comparison across storage classes, which
+            sqlite would resolve through column affinity
+    """
+    positions = {}
+    for position, name in enumerate(columns):
+        positions[name] = None if name in positions else position
+
+    filters = []
+    for _, column, operator, value in refinement['filters']:
+        position = positions.get(column)
+        if position is None or operator not in OPERATORS:
+            return None
+        filters.append((position, OPERATORS[operator], value, _storage_class(value)))
+
+    refined = []
+    for row in rows:
+        for position, test, value, storage_class in filters:
+            cell = row[position]
+            if cell is None:
+                # NULL compares as unknown: the row is filtered out
+                break
+            if _storage_class(cell) != storage_class:
+                return None
+            if not test(cell, value):
+                break
+        else:
+            refined.append(row)
+
+    if refinement['order'] is not None:
+        _, column, descending = refinement['order']
+        position = positions.get(column)
+        if position is None:
+            return None
+        refined.sort(key=lambda row: _sort_key(row[position]), reverse=descending)
+    if refinement['limit'] is not None:
+        refined = refined[:refinement['limit']]
+    return refined
+
+
+class Session:
+    """The state of one conversation"""
+
+    __slots__ = ('id', 'natural_query', 'statement', 'params', 'tables', 'columns', 'schema_version',
+                 'result_columns', 'rows', 'rows_bytes', 'result_version', 'last_used', 'turns')
+
+    def __init__(self, session_id):
+        self.id = session_id
+        # The last answered question and its statement (SelectStatement)
+        self.natural_query = None
+        self.statement = None
+        self.params = ()
+        self.tables = []
+        self.columns = []
+        self.schema_version = None
+        # Its complete result, when remembered, and the ResultCache
+        # version it was read at
+        self.result_columns = None
+        self.rows = None
+        self.rows_bytes = 0
+        self.result_version = None
+        self.last_used = time.monotonic()
+        self.turns = 0
+
+
+class SessionStore:
+    """
+    Bounded, idle-expiring store of conversation sessions
+
+    Sessions are kept in least recently used order; every lookup first
+    expires the ones idle for longer than idle_timeout.
+    """
+
+    def __init__(self, max_sessions=10000, idle_timeout=1800.0, max_bytes=64 * 1024 * 1024,
+                 max_rows=10000):
+        """
+        Args:
+            max_sessions (int): Sessions kept; the least recently used are
+                evicted beyond it
+            idle_timeout (float): Seconds after which an unused session
+                expires
+            max_bytes (int): Budget for remembered rows, measured as the
+                size of their encoded JSON
+            max_rows (int): Results with more rows are not remembered
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'created': 0,
+            'expired': 0,
+            'evictions': 0,
+            'rows_dropped': 0,
+            'refined_in_memory': 0,
+            'refined_sql': 0,
+        }
+
+    def _expire(self, now):
+        """Drop sessions idle for too long; caller holds the lock"""
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.idle_timeout:
+                break
+            self._remove(session.id)
+            self._stats['expired'] += 1
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._drop_rows(session)
+
+    def _drop_rows(self, session):
+        self._bytes -= session.rows_bytes
+        session.result_columns = session.rows = session.result_version = None
+        session.rows_bytes = 0
+
+    def get(self, session_id):
+        """
+        Return a live session and mark it used
+
+        Returns:
+            Session: The session, or None if it is unknown or expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def create(self):
+        """Start a new session"""
+        session = Session(secrets.token_urlsafe(16))
+        with self._lock:
+            self._expire(session.last_used)
+            self._sessions[session.id] = session
+            self._stats['created'] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._remove(next(iter(self._sessions)))
+                self._stats['evictions'] += 1
+        return session
+
+    def discard(self, session_id):
+        """End a session; returns False if it did not exist"""
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            return True
+
+    def remember(self, session, natural_query, statement, params, tables, columns, schema_version,
+                 refined=None):
+        """
+        Record the answered question of a session, forgetting older rows
+
+        Args:
+            statement (SelectStatement): The answer's statement; None when
+                it cannot be refined
+            refined (str): 'memory' or 'sql' when the question was a
+                refinement of the previous answer (counted in stats)
+        """
+        with self._lock:
+            session.natural_query = natural_query
+            session.statement = statement
+            session.params = tuple(params)
+            session.tables = list(tables)
+            session.columns = list(columns)
+            session.schema_version = schema_version
+            session.turns += 1
+            self._drop_rows(session)
+            if refined:
+                self._stats['refined_in_memory' if refined == 'memory' else 'refined_sql'] += 1
+
+    def remembered(self, session):
+        """
+        Returns:
+            tuple: (columns, rows, ResultCache version) of the session's
+                remembered result, or None
+        """
+        with self._lock:
+            if session.rows is None:
+                return None
+            return session.result_columns, session.rows, session.result_version
+
+    def keep_rows(self, session, columns, rows, size, version):
+        """
+        Remember the complete result of the session's last statement
+
+        Args:
+            columns (list): Column names
+            rows (list): Result tuples
+            size (int): Size of the encoded result, counted in max_bytes
+            version: ResultCache.version() from before the statement ran
+        """
+        if len(rows) > self.max_rows or size > self.max_bytes:
+            return
+        with self._lock:
+            if session.id not in self._sessions:
+                return
+            self._drop_rows(session)
+            session.result_columns = list(columns)
+            session.rows = rows
+            session.rows_bytes = size
+            session.result_version = version
+            self._bytes += size
+            # The rows of the least recently used sessions go first
+            for other in list(self._sessions.values()):
+                if self._bytes <= self.max_bytes:
+                    break
+                if other is not session and other.rows is not None:
+                    self._drop_rows(other)
+                    self._stats['rows_dropped'] += 1
+            if self._bytes > self.max_bytes:
+                self._drop_rows(session)
+                self._stats['rows_dropped'] += 1
+
+    def stats(self):
+        """Return session counts and remembered row memory"""
+        with self._lock:
+            self._expire(time.monotonic())
+            stats = dict(self._stats)
+            stats['sessions'] = len(self._sessions)
+            stats['sessions_with_rows'] = sum(1 for session in self._sessions.values()
+                                              if session.rows is not None)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+        return stats
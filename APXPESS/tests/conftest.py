@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(TESTS_DIR, '..')
+sys.path.insert(0, APP_DIR)
+
+from natural_language_to_sql import NaturalLanguageToSQL
+from schema_catalog import SchemaCatalog
+from value_index import ValueIndex
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py, imported once against a scratch copy of demo.db"""
+    directory = tmp_path_factory.mktemp('app')
+    path = str(directory / 'demo.db')
+    shutil.copyfile(os.path.join(APP_DIR, 'demo.db'), path)
+    os.environ.update(DB_PATH=path, BACKGROUND_REFRESH='0', INDEX_ADVISOR='off', ROLLUPS='off')
+    import app
+    app.warm_up()
+    return app
+
+
+@pytest.fixture
+def demo_db(tmp_path):
+    """A scratch copy of demo.db (customers, orders, products)"""
+    path = str(tmp_path / 'demo.db')
+    shutil.copyfile(os.path.join(APP_DIR, 'demo.db'), path)
+    return path
+
+
+def make_translator(database):
+    """A translator set up from a database the way app.py sets it up"""
+    catalog = SchemaCatalog(database)
+    catalog.refresh()
+    value_index = ValueIndex(catalog)
+    value_index.refresh()
+    nl_to_sql = NaturalLanguageToSQL()
+    nl_to_sql.set_catalog(catalog)
+    nl_to_sql.set_value_index(value_index)
+    return nl_to_sql
+
+
+@pytest.fixture
+def translator(demo_db):
+    return make_translator(demo_db)
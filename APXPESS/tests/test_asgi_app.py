@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(app_module):
+    import asgi_app
+    return asgi_app
+
+
+def call(asgi, body):
+    """POST /query to the ASGI app; returns (status, decoded body)"""
+    messages = [{'type': 'http.request', 'body': body if isinstance(body, bytes) else json.dumps(body).encode(),
+                 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/query', 'headers': []}
+    asyncio.run(asgi.AsyncQueryApp()(scope, receive, send))
+    return sent[0]['status'], json.loads(sent[-1]['body'])
+
+
+def test_answers_like_the_flask_app(asgi, app_module):
+    question = {'query': 'products with price over 500'}
+    status, answer = call(asgi, question)
+    expected = app_module.app.test_client().post('/query', json=question).get_json()
+    assert status == 200
+    assert {key: answer[key] for key in expected} == expected
+
+
+@pytest.mark.parametrize('body', [b'[]', b'"x"', b'3', b'null', b'{'])
+def test_bodies_that_are_not_objects_are_rejected(asgi, body):
+    assert call(asgi, body)[0] == 400
+
+
+@pytest.mark.parametrize('timeout', ['nan', 'inf', -1, 0, 'soon'])
+def test_bad_timeouts_are_rejected(asgi, timeout):
+    status, answer = call(asgi, {'query': 'how many orders', 'timeout': timeout})
+    assert status == 400 and 'timeout' in answer['error']
+
+
+@pytest.mark.parametrize('field, value', [('session', True), ('stream', True), ('limit', 2),
+                                          ('format', 'msgpack')])
+def test_flask_only_options_are_rejected(asgi, field, value):
+    status, answer = call(asgi, {'query': 'how many orders', field: value})
+    assert status == 400 and field in answer['error']
+
+
+def test_translation_errors_are_reported(asgi, monkeypatch):
+    def fail(natural_query):
+        raise RuntimeError('no translation')
+    monkeypatch.setattr(asgi.nl_to_sql, 'generate_sql', fail)
+    assert call(asgi, {'query': 'how many orders'}) == (
+        200, {'natural_query': 'how many orders', 'error': 'no translation'})
+
+
+def test_admission_control(asgi):
+    server = asgi.AsyncQueryApp(max_pending=0)
+    messages = [{'type': 'http.request', 'body': b'{"query": "how many orders"}', 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(server({'type': 'http', 'method': 'POST', 'path': '/query', 'headers': []}, receive, send))
+    assert sent[0]['status'] == 503 and server.rejected == 1
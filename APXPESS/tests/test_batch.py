@@ -0,0 +1,80 @@
+import pytest
+
+QUESTIONS = [
+    'products with price over 100',
+    'how many customers per country',
+    'products with price over 250',
+    'show products',
+]
+
+
+def test_batch_matches_single_translations(translator, demo_db):
+    from conftest import make_translator
+    single = make_translator(demo_db)
+    results = translator.generate_sql_batch(QUESTIONS)
+    assert [(r['sql_query'], r['params']) for r in results] == [single.generate_sql(q) for q in QUESTIONS]
+    assert all(r['error'] is None for r in results)
+
+
+def test_each_question_shape_is_translated_once(translator):
+    results = translator.generate_sql_batch(QUESTIONS)
+    assert results[0]['sql_query'] == results[2]['sql_query']
+    assert (results[0]['params'], results[2]['params']) == ((100,), (250,))
+    assert translator.translation_cache.stats()['size'] == 3
+
+
+def test_second_batch_is_served_from_the_translation_cache(translator):
+    translator.generate_sql_batch(QUESTIONS)
+    results = translator.generate_sql_batch(QUESTIONS[::-1])
+    assert all(r['cached'] for r in results)
+    assert results[1]['params'] == (250,)
+
+
+@pytest.mark.parametrize('question', ['', None, 42])
+def test_missing_questions_are_errors_in_place(translator, question):
+    results = translator.generate_sql_batch(['show products', question])
+    assert results[0]['error'] is None
+    assert results[1] == {'sql_query': None, 'params': None, 'error': 'No query provided',
+                          'cached': False, 'elapsed_ms': 0.0}
+
+
+def test_process_pool_translates_like_this_process(translator):
+    from natural_language_to_sql import NaturalLanguageToSQL
+    pooled = NaturalLanguageToSQL(db_schema=translator.db_schema, translation_cache=False)
+    local = NaturalLanguageToSQL(db_schema=translator.db_schema, translation_cache=False)
+    results = pooled.generate_sql_batch(QUESTIONS, processes=2, chunk_size=1)
+    assert [(r['sql_query'], r['params']) for r in results] == \
+        [(r['sql_query'], r['params']) for r in local.generate_sql_batch(QUESTIONS)]
+
+
+def test_batch_endpoint_executes_each_item(app_module):
+    client = app_module.app.test_client()
+    body = client.post('/query/batch', json={'queries': ['products with price over 100', '']}).get_json()
+    assert (body['count'], body['errors']) == (2, 1)
+    first, second = body['items']
+    assert first['params'] == [100] and first['results']
+    assert all(row['price'] > 100 for row in first['results'])
+    assert second['error'] == 'No query provided'
+
+
+def test_batch_endpoint_can_translate_only(app_module):
+    client = app_module.app.test_client()
+    body = client.post('/query/batch', json={'queries': ['show products'], 'execute': False}).get_json()
+    assert body['items'][0]['sql_query'] == 'SELECT * FROM products'
+    assert 'results' not in body['items'][0]
+
+
+@pytest.mark.parametrize('queries, error', [
+    (None, 'No queries provided'),
+    ([], 'No queries provided'),
+])
+def test_batch_endpoint_rejects_empty_batches(app_module, queries, error):
+    client = app_module.app.test_client()
+    assert client.post('/query/batch', json={'queries': queries}).get_json() == {'error': error}
+
+
+def test_batch_endpoint_caps_the_batch_size(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'BATCH_MAX_QUERIES', 2)
+    client = app_module.app.test_client()
+    body = client.post('/query/batch', json={'queries': ['show products'] * 3}).get_json()
+    assert body == {'error': 'Too many queries (maximum is 2)'}
@@ -0,0 +1,82 @@
+import json
+import sqlite3
+
+import pytest
+
+from bulk_loader import BulkLoader, bulk_load
+
+SCHEMA = [
+    'CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, price REAL)',
+    'CREATE INDEX items_price ON items (price)',
+    'CREATE TABLE log (item_id INTEGER)',
+    'CREATE TRIGGER items_log AFTER INSERT ON items BEGIN INSERT INTO log VALUES (new.id); END',
+]
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'items.db')
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.execute("INSERT INTO items VALUES (1, 'lamp', 20.0)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def schema_objects(path):
+    conn = sqlite3.connect(path)
+    objects = {name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    rows = conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+    conn.close()
+    return objects, journal_mode, rows
+
+
+def test_load_rebuilds_indexes_and_triggers(tmp_path, database):
+    dump = write(tmp_path, 'items.json', json.dumps(
+        {'items': [{'id': i, 'name': f'item {i}', 'price': i * 1.5} for i in range(2, 102)]}))
+    report = bulk_load(database, dump, transaction_rows=30)
+    assert report['rows'] == 100
+    assert schema_objects(database) == ({'items_price', 'items_log'}, 'delete', 101)
+    conn = sqlite3.connect(database)
+    # Only the fixture's row fired the trigger; it was not there during the load
+    assert conn.execute('SELECT item_id FROM log').fetchall() == [(1,)]
+    conn.close()
+
+
+def test_failed_load_puts_back_what_it_dropped(tmp_path, database):
+    dump = write(tmp_path, 'items.sql', 'BEGIN TRANSACTION;\n'
+                 "INSERT INTO items VALUES (2, 'desk', 120.0);\n"
+                 "INSERT INTO items VALUES (3, 'chair', 45.5);\n"
+                 "INSERT INTO missing VALUES (1);\n"
+                 'COMMIT;\n')
+    with pytest.raises(sqlite3.OperationalError):
+        bulk_load(database, dump)
+    # The open transaction is rolled back; indexes, triggers and the
+    # journal mode are as they were
+    assert schema_objects(database) == ({'items_price', 'items_log'}, 'delete', 1)
+
+
+def test_index_that_cannot_be_rebuilt_is_reported(tmp_path, database):
+    conn = sqlite3.connect(database)
+    conn.execute('CREATE UNIQUE INDEX items_name ON items (name)')
+    conn.commit()
+    conn.close()
+    dump = write(tmp_path, 'items.json', json.dumps(
+        {'items': [{'id': 2, 'name': 'lamp', 'price': 25.0}]}))
+
+    loader = BulkLoader(database)
+    loader.load_json(dump)
+    with pytest.raises(sqlite3.IntegrityError, match='items_name'):
+        loader.finish()
+    # Committed rows stay; everything else that was dropped is back
+    assert schema_objects(database) == ({'items_price', 'items_log'}, 'delete', 2)
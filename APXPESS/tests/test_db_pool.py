@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+@pytest.fixture
+def pool(demo_db):
+    pool = ConnectionPool(lambda: sqlite3.connect(demo_db, check_same_thread=False), max_size=2, timeout=0.2)
+    yield pool
+    pool.close()
+
+
+def stock(demo_db):
+    conn = sqlite3.connect(demo_db)
+    try:
+        return conn.execute('SELECT stock FROM products WHERE id = 1').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_threads_get_their_connection_back(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as again:
+        assert again is first
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.acquire()))
+    thread.start()
+    thread.join()
+    assert other[0] is first
+    pool.release(other[0])
+    assert pool.stats()['affinity_hits'] == 1
+
+
+def test_checkout_times_out_when_exhausted(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    for conn in held:
+        pool.release(conn)
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_writes_are_committed(pool, demo_db):
+    with pool.connection() as conn:
+        conn.execute('UPDATE products SET stock = 4321 WHERE id = 1')
+    assert stock(demo_db) == 4321
+
+
+def test_failed_blocks_roll_back(pool, demo_db):
+    before = stock(demo_db)
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection() as conn:
+            conn.execute('UPDATE products SET stock = 4321 WHERE id = 1')
+            conn.execute('SELECT missing FROM products')
+    assert stock(demo_db) == before
+    assert pool.stats()['idle'] == 1
+
+
+def test_broken_connections_are_discarded(pool):
+    with pytest.raises(sqlite3.DatabaseError):
+        with pool.connection():
+            raise sqlite3.DatabaseError('database disk image is malformed')
+    assert pool.stats()['size'] == 0
+
+
+def test_writes_through_the_app_are_kept(app_module, monkeypatch):
+    client = app_module.app.test_client()
+    update = 'UPDATE products SET stock = ? WHERE id = ?'
+    monkeypatch.setattr(app_module.nl_to_sql, 'generate_statement', lambda natural_query: (update, (77, 2), None))
+    monkeypatch.setattr(app_module.nl_to_sql, 'generate_sql_batch', lambda queries, processes=1: [
+        {'sql_query': update, 'params': (78, 3), 'elapsed_ms': 0.0, 'error': None}])
+    assert 'error' not in client.post('/query', json={'query': 'set the stock'}).get_json()
+    assert 'error' not in client.post('/query/batch', json={'queries': ['set the stock']}).get_json()['items'][0]
+    conn = sqlite3.connect(app_module.DB_PATH)
+    try:
+        assert conn.execute('SELECT id, stock FROM products WHERE id IN (2, 3)').fetchall() == [(2, 77), (3, 78)]
+    finally:
+        conn.close()
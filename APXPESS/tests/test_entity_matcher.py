@@ -0,0 +1,73 @@
+import random
+
+from entity_matcher import EntityMatcher
+from lexer import Lexer
+
+
+def naive_matches(patterns, text):
+    matches = []
+    for pattern in patterns:
+        start = text.find(pattern)
+        while start != -1:
+            matches.append((start, start + len(pattern), pattern))
+            start = text.find(pattern, start + 1)
+    return sorted(matches, key=lambda match: (match[1], match[0]))
+
+
+def test_find_all_reports_overlapping_matches():
+    matcher = EntityMatcher()
+    for pattern in ('order', 'orders', 'der', 'customer'):
+        matcher.add(pattern, pattern)
+    assert matcher.find_all('customer orders') == [
+        (0, 8, 'customer'), (9, 14, 'order'), (11, 14, 'der'), (9, 15, 'orders')]
+
+
+def test_find_all_matches_substring_search():
+    rng = random.Random(7)
+    patterns = {''.join(rng.choice('abc ') for _ in range(rng.randint(1, 4))) for _ in range(40)}
+    matcher = EntityMatcher()
+    for pattern in patterns:
+        matcher.add(pattern, None)
+    for _ in range(200):
+        text = ''.join(rng.choice('abcd ') for _ in range(rng.randint(0, 30)))
+        assert sorted(matcher.find_all(text), key=lambda match: (match[1], match[0])) == \
+            naive_matches(patterns, text)
+
+
+def test_find_in_runs_matches_find_all():
+    matcher = EntityMatcher()
+    for pattern in ('price', 'greater than', 'total amount', 'amount', 'products', 'product'):
+        matcher.add(pattern, pattern)
+    lexer = Lexer()
+    for text in ('products with price greater than 100',
+                 'orders with total amount greater than 500',
+                 'greater than greater than'):
+        assert matcher.find_in_runs(text, lexer.lex(text)) == matcher.find_all(text)
+
+
+def test_payloads_and_remove():
+    matcher = EntityMatcher()
+    matcher.add('name', ('column', 'customers'))
+    matcher.add('name', ('column', 'products'))
+    matcher.add('name', ('column', 'products'))
+    assert matcher.payloads('name') == [('column', 'customers'), ('column', 'products')]
+
+    matcher.remove('name', ('column', 'customers'))
+    assert matcher.payloads('name') == [('column', 'products')]
+    assert matcher.find_all('name') == [(0, 4, 'name')]
+
+    matcher.remove('name')
+    assert 'name' not in matcher
+    assert matcher.find_all('name') == []
+
+
+def test_copy_is_independent():
+    matcher = EntityMatcher()
+    matcher.add('order', 'order')
+    matcher.build()
+    clone = matcher.copy()
+    clone.add('customer', 'customer')
+    clone.remove('order', 'order')
+    clone.build()
+    assert matcher.find_all('customer order') == [(9, 14, 'order')]
+    assert clone.find_all('customer order') == [(0, 8, 'customer')]
@@ -0,0 +1,124 @@
+import pytest
+
+from fuzzy_matcher import FuzzyMatcher, bounded_distance, name_words, stem
+
+NAMES = [
+    ('InvoiceLine', ('table', 'InvoiceLine')),
+    ('Invoice', ('table', 'Invoice')),
+    ('customers', ('table', 'customers')),
+    ('categories', ('table', 'categories')),
+    ('total_amount', ('column', 'total_amount', 'orders')),
+    ('email', ('column', 'email', 'customers')),
+]
+
+
+@pytest.fixture
+def matcher():
+    matcher = FuzzyMatcher()
+    matcher.build(NAMES)
+    return matcher
+
+
+def payloads(matches):
+    return [payload for _, _, payload, _ in matches]
+
+
+@pytest.mark.parametrize('word, expected', [
+    ('customers', 'customer'),
+    ('addresses', 'address'),
+    ('categories', 'category'),
+    ('class', 'class'),
+    ('bus', 'bus'),
+])
+def test_stem_folds_plurals(word, expected):
+    assert stem(word) == expected
+
+
+def test_name_words_split_identifiers():
+    assert name_words('BillingPostalCode') == ('billing', 'postal', 'code')
+    assert name_words('total_amount') == ('total', 'amount')
+    assert name_words('InvoiceLines') == ('invoice', 'line')
+
+
+@pytest.mark.parametrize('a, b, limit, expected', [
+    ('customer', 'customer', 2, 0),
+    ('customer', 'cusotmer', 2, 1),
+    ('kitten', 'sitting', 5, 3),
+    ('kitten', 'sitting', 1, 2),
+    ('ab', 'abcdef', 2, 3),
+])
+def test_bounded_distance_stops_past_the_limit(a, b, limit, expected):
+    assert bounded_distance(a, b, limit) == expected
+
+
+@pytest.mark.parametrize('question, expected', [
+    ('show invoice lines', [('table', 'InvoiceLine')]),
+    ('invoiceline', [('table', 'InvoiceLine')]),
+    ('the invoice total amount', [('table', 'Invoice'), ('column', 'total_amount', 'orders')]),
+    ('amount spent', [('column', 'total_amount', 'orders')]),
+])
+def test_names_match_in_any_spelling(matcher, question, expected):
+    matches = matcher.find(question)
+    assert payloads(matches) == expected
+    assert all(score == 1.0 for _, _, _, score in matches)
+
+
+@pytest.mark.parametrize('question, expected', [
+    ('custmers', ('table', 'customers')),
+    ('cusotmers', ('table', 'customers')),
+    ('categroy', ('table', 'categories')),
+    ('emial', ('column', 'email', 'customers')),
+])
+def test_typos_are_corrected_with_a_lower_score(matcher, question, expected):
+    [(start, end, payload, score)] = matcher.find(question)
+    assert (start, end, payload) == (0, len(question), expected)
+    assert matcher.min_score <= score < 1.0
+
+
+def test_short_and_distant_words_are_not_corrected(matcher):
+    assert matcher.resolve('emal') is not None
+    assert matcher.resolve('eml') is None
+    assert matcher.resolve('cstmrs') is None
+
+
+def test_ignored_words_are_not_corrected():
+    names = [('wires', ('table', 'wires'))]
+    matcher = FuzzyMatcher()
+    matcher.build(names)
+    assert payloads(matcher.find('which were sold')) == [('table', 'wires')]
+    matcher = FuzzyMatcher(ignore_words={'were'})
+    matcher.build(names)
+    assert matcher.find('which were sold') == []
+
+
+def test_windows_stop_at_unresolved_words():
+    matcher = FuzzyMatcher()
+    matcher.build([('InvoiceLine', 'invoice line'), ('line', 'line')])
+    assert payloads(matcher.find('invoice line')) == ['invoice line']
+    assert payloads(matcher.find('invoice of line')) == ['line']
+    matcher.max_window = 1
+    assert matcher.find('invoice line') == [(8, 12, 'line', 1.0)]
+
+
+def test_resolved_words_cache_is_bounded():
+    matcher = FuzzyMatcher(max_cache=2)
+    matcher.build(NAMES)
+    for word in ['custmers', 'emial', 'invoice']:
+        matcher.resolve(word)
+        assert len(matcher._cache) <= 2
+    assert matcher.resolve('emial') == (('email',), 0.8)
+
+
+def test_rebuilding_forgets_resolved_words(matcher):
+    assert matcher.resolve('custmers') is not None
+    matcher.build([('products', 'products')])
+    assert matcher.resolve('custmers') is None
+    # products, and item through its synonym
+    assert matcher.stats()['vocabulary'] == 2 and matcher.stats()['names'] == 1
+
+
+def test_translator_corrects_misspelt_names(translator):
+    assert translator.generate_sql('show custmers from Canada') == (
+        'SELECT * FROM customers WHERE country = ?', ('Canada',))
+    assert translator.generate_sql('prodcts with prize over 100') == (
+        'SELECT price FROM products WHERE price > ?', (100,))
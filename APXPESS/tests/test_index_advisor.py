@@ -0,0 +1,80 @@
+import os
+import sqlite3
+
+import pytest
+
+from index_advisor import INDEX_PREFIX, IndexAdvisor, parse_predicates
+
+STATEMENT = 'SELECT id, name, total FROM events WHERE kind = ?'
+
+
+@pytest.fixture
+def events_db(tmp_path):
+    path = str(tmp_path / 'events.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE events (id INTEGER PRIMARY KEY, kind TEXT, name TEXT, total REAL)')
+    conn.executemany('INSERT INTO events (kind, name, total) VALUES (?, ?, ?)',
+                     ((f'kind{i % 500}', f'event {i}', i * 0.5) for i in range(50000)))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def advise(path, create):
+    advisor = IndexAdvisor(path, min_uses=1000, create=create, timing_runs=1)
+    advisor.record(STATEMENT, ('kind7',), 0.01)
+    key, = advisor._candidates
+    advisor.evaluate(key)
+    return advisor, advisor._candidates[key]
+
+
+def auto_indexes(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT name FROM sqlite_master WHERE name LIKE ?",
+                            (INDEX_PREFIX + '%',)).fetchall()
+    finally:
+        conn.close()
+
+
+def test_predicates_put_equality_before_ranges():
+    sql = ('SELECT orders.id, customers.name FROM orders JOIN customers ON orders.customer_id = customers.id '
+           'WHERE orders.total_amount > ? AND orders.status = ?')
+    candidates = {table: (keys, covered) for table, keys, covered in parse_predicates(sql)}
+    assert candidates['orders'] == (('status', 'total_amount'), ('id',))
+    assert candidates['customers'] == (('id',), ('name',))
+
+
+def test_recommend_mode_never_writes(events_db):
+    advisor, candidate = advise(events_db, create=False)
+    assert candidate['status'] == 'recommended'
+    assert auto_indexes(events_db) == []
+    with pytest.raises(sqlite3.OperationalError):
+        advisor._connection().execute('CREATE TABLE t (x)')
+
+
+def test_create_mode_keeps_indexes_that_help(events_db):
+    advisor, candidate = advise(events_db, create=True)
+    assert candidate['status'] == 'created'
+    assert auto_indexes(events_db) == [(candidate['index'],)]
+    assert advisor.stats()['created'] == 1
+
+
+def test_missing_database_is_not_created(tmp_path):
+    path = str(tmp_path / 'missing.db')
+    with pytest.raises(sqlite3.OperationalError):
+        IndexAdvisor(path)._connection()
+    assert not os.path.exists(path)
+
+
+def test_size_estimate_reads_sqlite_stat1(events_db):
+    conn = sqlite3.connect(events_db)
+    conn.execute('CREATE INDEX events_kind ON events (kind)')
+    conn.execute('ANALYZE')
+    statements = []
+    conn.set_trace_callback(statements.append)
+    advisor = IndexAdvisor(events_db)
+    assert advisor._row_count(conn, 'events') == 50000
+    assert advisor._estimate_bytes(conn, 'events', ('kind',)) > 50000
+    assert not any('COUNT(' in sql for sql in statements)
+    conn.close()
@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+
+from join_planner import JoinPlanner
+from query_governor import JoinRefused, QueryGovernor
+from schema_catalog import SchemaCatalog
+
+ORDERS_OF_CUSTOMERS = ('SELECT * FROM customers JOIN orders ON orders.customer_id = customers.id '
+                       'WHERE customers.country = ?')
+
+
+@pytest.fixture
+def catalog(demo_db):
+    catalog = SchemaCatalog(demo_db)
+    catalog.refresh()
+    return catalog
+
+
+def planner(catalog, **options):
+    return JoinPlanner(catalog=catalog, database=catalog.database, **options)
+
+
+def test_plans_follow_foreign_keys(catalog):
+    plan = planner(catalog).plan(['orders', 'customers'], catalog.as_db_schema())
+    assert plan.from_clause() == 'orders JOIN customers ON customers.id = orders.customer_id'
+    assert plan.unreachable == []
+
+
+def test_generated_joins_carry_no_guard(translator):
+    translator.join_planner = planner(translator.catalog, max_estimated_rows=1, guard='refuse')
+    sql_query, params = translator.generate_sql('show orders of Emma Johnson')
+    assert ' JOIN ' in sql_query and 'LIMIT' not in sql_query and '--' not in sql_query
+    assert params == ('Emma Johnson',)
+
+
+def test_estimate_multiplies_the_fan_out_of_each_join(catalog):
+    join_planner = planner(catalog, max_estimated_rows=1000)
+    # 5 customers with 8 orders between them; customers.id is a key
+    assert join_planner.check_statement(ORDERS_OF_CUSTOMERS) == ('ok', None, 8)
+    assert join_planner.check_statement(
+        'SELECT * FROM orders JOIN customers ON customers.id = orders.customer_id') == ('ok', None, 8)
+
+
+def test_estimate_uses_index_statistics(demo_db, catalog):
+    conn = sqlite3.connect(demo_db)
+    conn.executemany('INSERT INTO orders (customer_id, order_date, total_amount, status) VALUES (1, ?, 1.0, ?)',
+                     [('2024-01-01', 'Pending')] * 92)
+    conn.execute('CREATE INDEX orders_customer ON orders (customer_id)')
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    # 100 orders over 5 customers on average, by sqlite_stat1
+    action, _, estimated_rows = planner(catalog, max_estimated_rows=1000).check_statement(ORDERS_OF_CUSTOMERS)
+    expected = 5 * int(sqlite3.connect(demo_db).execute(
+        "SELECT stat FROM sqlite_stat1 WHERE idx = 'orders_customer'").fetchone()[0].split()[1])
+    assert action == 'ok' and estimated_rows == expected
+
+
+def test_refused_joins_raise_when_they_run(demo_db, catalog):
+    governor = QueryGovernor(join_guard=planner(catalog, max_estimated_rows=4, guard='refuse').check_statement)
+    conn = sqlite3.connect(demo_db)
+    with pytest.raises(JoinRefused, match='estimated 8 rows exceeds the limit of 4'):
+        governor.execute(conn, ORDERS_OF_CUSTOMERS, ('USA',))
+    # Single-table statements are not guarded
+    assert len(governor.execute(conn, 'SELECT * FROM orders').rows) == 8
+    conn.close()
+
+
+def test_limited_joins_are_cut_and_marked_truncated(demo_db, catalog):
+    governor = QueryGovernor(join_guard=planner(catalog, max_estimated_rows=4).check_statement)
+    conn = sqlite3.connect(demo_db)
+    query = governor.execute(conn, 'SELECT * FROM orders JOIN customers ON customers.id = orders.customer_id')
+    assert len(query.rows) == 4 and query.truncated
+    # Aggregates are only ever refused
+    query = governor.execute(conn, 'SELECT customers.country, COUNT(*) AS count FROM orders '
+                                   'JOIN customers ON customers.id = orders.customer_id GROUP BY customers.country')
+    assert not query.truncated
+    conn.close()
+
+
+def test_guard_follows_table_growth(demo_db, catalog):
+    join_planner = planner(catalog, max_estimated_rows=10, guard='refuse', count_ttl=0)
+    assert join_planner.check_statement(ORDERS_OF_CUSTOMERS)[0] == 'ok'
+    conn = sqlite3.connect(demo_db)
+    with conn:
+        conn.executemany('INSERT INTO orders (customer_id, order_date, total_amount, status) VALUES (1, ?, 1.0, ?)',
+                         [('2024-01-01', 'Pending')] * 20)
+    conn.close()
+    assert join_planner.check_statement(ORDERS_OF_CUSTOMERS)[:2] == ('refuse', 10)
@@ -0,0 +1,56 @@
+import re
+
+from lexer import Lexer, PhraseTable, TOKEN_PATTERN
+
+
+def test_runs_carry_their_offsets():
+    query = 'show  orders\twith total  over 100 orders'
+    runs = Lexer().lex(query)
+    assert [(offset, run.text) for offset, run in runs] == \
+        [(match.start(), match.group()) for match in re.finditer(r'\S+', query)]
+
+
+def test_tokens_match_a_scan_of_the_whole_question():
+    lexer = Lexer(stop_words={'the', 'with'})
+    query = 'show the orders, with total_amount over 3.5 and 1,000 units?'
+    runs = lexer.lex(query)
+    assert lexer.tokens(runs, keep_stop_words=True) == TOKEN_PATTERN.findall(query)
+    assert lexer.tokens(runs) == [token for token in TOKEN_PATTERN.findall(query)
+                                  if token not in ('the', 'with')]
+
+
+def test_words_and_numbers_index_the_question():
+    lexer = Lexer()
+    query = 'orders over 25 and under 7.5 from order2'
+    runs = lexer.lex(query)
+    words = lexer.words(runs)
+    assert [word for _, _, word in words] == ['orders', 'over', 'and', 'under', 'from', 'order']
+    assert all(query[start:end] == word for start, end, word in words)
+    assert lexer.numbers(runs) == [(12, 14, '25'), (25, 28, '7.5')]
+
+
+def test_repeated_runs_are_analyzed_once():
+    lexer = Lexer()
+    runs = lexer.lex('orders orders orders')
+    assert [offset for offset, _ in runs] == [0, 7, 14]
+    assert runs[0][1] is runs[1][1] is runs[2][1]
+
+
+def test_run_cache_is_bounded():
+    lexer = Lexer(max_cache=3)
+    lexer.lex('a b c d e')
+    assert len(lexer._cache) <= 3
+
+
+def test_query_type_follows_keyword_table_order():
+    lexer = Lexer({'count': ['count', 'many'], 'select': ['show']})
+    assert lexer.query_type(['show', 'how', 'many']) == 'count'
+    assert lexer.query_type(['show']) == 'select'
+    assert lexer.query_type(['orders'], default='none') == 'none'
+
+
+def test_phrases_match_whole_tokens():
+    table = PhraseTable(['to', 'last year', 'between'])
+    assert table.find(['laptop', 'sales', 'last', 'year']) == {'last year'}
+    assert table.find(['from', 'may', 'to', 'june']) == {'to'}
+    assert table.find(['last', 'month']) == set()
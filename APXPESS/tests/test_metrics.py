@@ -0,0 +1,69 @@
+import os
+
+from metrics import Histogram, MetricsRegistry, SlowRequestProfiler, statement_kind
+
+
+def test_statement_kind():
+    assert statement_kind('  SELECT * FROM orders') == 'select'
+    assert statement_kind('delete from orders WHERE id = ?') == 'delete'
+    assert statement_kind('WITH x AS (SELECT 1) SELECT * FROM x') == 'other'
+    assert statement_kind(None) == 'other'
+
+
+def test_histogram_percentiles_stay_within_their_bucket():
+    histogram = Histogram(buckets=(0.001, 0.002, 0.004, 0.008))
+    for _ in range(90):
+        histogram.observe(0.0015)
+    for _ in range(10):
+        histogram.observe(0.006)
+    counts, count, total = histogram.snapshot()
+    assert counts == [0, 90, 0, 10, 0]
+    assert count == 100 and abs(total - (90 * 0.0015 + 10 * 0.006)) < 1e-12
+    assert 0.001 <= histogram.percentile(0.5) <= 0.002
+    assert 0.004 <= histogram.percentile(0.99) <= 0.008
+    assert Histogram().percentile(0.5) == 0.0
+
+
+def test_prometheus_rendering():
+    registry = MetricsRegistry(namespace='test')
+    registry.observe('translate', 0.003, 'select')
+    registry.observe_many([('translate', 0.001), ('execute', 0.002)], 'select')
+    registry.add_gauges('pool', lambda: {'size': 4, 'ready': True, 'path': '/tmp/x'})
+    registry.add_gauges('broken', lambda: 1 / 0)
+    text = registry.render_prometheus()
+    assert 'test_stage_latency_seconds_count{stage="translate",query_type="select"} 2' in text
+    assert 'test_stage_latency_seconds_bucket{stage="execute",query_type="select",le="+Inf"} 1' in text
+    assert 'test_stage_latency_quantile_seconds{stage="translate",query_type="select",quantile="0.5"}' in text
+    # Only numbers are exported, and a failing source is skipped
+    assert 'test_pool_size 4' in text
+    assert 'test_pool_ready' not in text and 'test_pool_path' not in text and 'test_broken' not in text
+    assert registry.summary()['translate']['select']['count'] == 2
+
+
+def test_slow_requests_are_profiled_and_counted(tmp_path):
+    profiler = SlowRequestProfiler(0.0, str(tmp_path), max_dumps=1)
+    path = profiler.stop(profiler.start(), '/query')
+    assert os.path.exists(path) and path.endswith('-_query-%d.prof' % os.getpid())
+    assert profiler.stats() == {'profiled': 1, 'dumps': 1, 'max_dumps': 1, 'last_profile': path}
+    # The dump budget is spent: nothing more is sampled
+    assert profiler.start() is None
+    registry = MetricsRegistry(namespace='test')
+    registry.add_gauges('slow_profiles', profiler.stats)
+    assert 'test_slow_profiles_dumps 1' in registry.render_prometheus()
+
+
+def test_fast_requests_are_not_written(tmp_path):
+    profiler = SlowRequestProfiler(60.0, str(tmp_path))
+    assert profiler.stop(profiler.start()) is None
+    assert profiler.stats()['dumps'] == 0 and profiler.stats()['profiled'] == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_requests_are_timed_per_query_type(app_module):
+    client = app_module.app.test_client()
+    client.post('/query', json={'query': 'show all customers'})
+    summary = client.get('/metrics?format=json').get_json()
+    assert summary['request']['select']['count'] >= 1
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'nl2sql_stage_latency_seconds_count{stage="request",query_type="select"}' in text
+    assert 'nl2sql_pool_' in text
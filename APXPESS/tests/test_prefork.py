@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from prefork import ActiveRequests
+
+
+def start_response(status, headers):
+    pass
+
+
+class Closing(list):
+    closed = 0
+
+    def close(self):
+        self.closed += 1
+
+
+def test_streamed_requests_count_until_the_body_is_closed():
+    body = Closing([b'a', b'b'])
+    app = ActiveRequests(lambda environ, start: body)
+    response = app({}, start_response)
+    assert app.count == 1
+    assert list(response) == [b'a', b'b'] and app.count == 1
+    response.close()
+    response.close()
+    assert app.count == 0 and body.closed == 1
+
+
+def test_failed_requests_are_not_counted():
+    def fail(environ, start):
+        raise RuntimeError('boom')
+    app = ActiveRequests(fail)
+    with pytest.raises(RuntimeError):
+        app({}, start_response)
+    assert app.count == 0
+
+
+def test_after_fork_replaces_inherited_connections(app_module):
+    client = app_module.app.test_client()
+    client.post('/query', json={'query': 'orders with customer names'})
+    app_module.result_cache.clear()
+    planner = app_module.nl_to_sql.join_planner
+    inherited = (planner._conn, app_module.result_cache._watcher)
+    assert None not in inherited and app_module.db_pool.stats()['idle'] > 0
+
+    app_module.after_fork()
+    assert planner._conn is None and app_module.db_pool.stats()['size'] == 0
+    assert app_module.result_cache._watcher not in (None, inherited[1])
+    answer = client.post('/query', json={'query': 'orders with customer names'}).get_json()
+    assert answer['results'] and planner._conn is not inherited[0]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='POSIX only')
+def test_forked_worker_answers_queries(app_module):
+    client = app_module.app.test_client()
+    expected = client.post('/query', json={'query': 'how many customers'}).get_json()['results']
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            app_module.after_fork()
+            answer = app_module.app.test_client().post('/query', json={'query': 'how many customers'})
+            os.write(write, json.dumps(answer.get_json()['results']).encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        results = json.loads(pipe.read())
+    os.waitpid(pid, 0)
+    assert results == expected
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionPool
+from query_governor import QueryBudget, QueryBudgetExceeded, QueryGovernor
+
+COUNTER = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT i FROM n'
+
+
+@pytest.fixture
+def conn(demo_db):
+    conn = sqlite3.connect(demo_db)
+    yield conn
+    conn.close()
+
+
+def test_reads_are_cut_at_max_rows(conn):
+    query = QueryGovernor(max_rows=3).execute(conn, 'SELECT id FROM customers')
+    assert query.rows == [(1,), (2,), (3,)]
+    assert query.truncated and query.reason == 'max_rows'
+
+
+def test_runaway_reads_are_interrupted(conn):
+    governor = QueryGovernor(max_rows=None, timeout=None, max_steps=100000, check_interval=100)
+    query = governor.execute(conn, COUNTER)
+    assert query.truncated and query.reason == 'max_steps'
+    assert governor.stats()['truncated_max_steps'] == 1
+
+
+def test_requests_may_only_lower_limits():
+    governor = QueryGovernor(max_rows=100, timeout=2.0)
+    assert governor.budget() is governor.default_budget
+    budget = governor.budget({'max_rows': 1000, 'timeout': '0.5'})
+    assert (budget.max_rows, budget.timeout) == (100, 0.5)
+    for value in ('nan', 'inf', 0, -3, 'many'):
+        with pytest.raises(ValueError):
+            governor.budget({'max_rows': value})
+
+
+def test_interrupted_writes_are_errors_and_not_kept(demo_db):
+    pool = ConnectionPool(lambda: sqlite3.connect(demo_db, check_same_thread=False))
+    governor = QueryGovernor(max_steps=1000, check_interval=100)
+    with pytest.raises(QueryBudgetExceeded):
+        with pool.connection() as conn:
+            governor.execute(conn, f'INSERT INTO products (name) {COUNTER}')
+    pool.close()
+    check = sqlite3.connect(demo_db)
+    assert check.execute('SELECT COUNT(*) FROM products').fetchone()[0] == 10
+    check.close()
+
+
+def test_refusals_follow_the_data(conn):
+    version = [0]
+    governor = QueryGovernor(max_cost=50, data_version=lambda: version[0])
+    budget = governor.default_budget
+    with pytest.raises(QueryBudgetExceeded):
+        governor.execute(conn, 'SELECT * FROM orders', budget=QueryBudget(max_cost=5))
+    assert governor.execute(conn, 'SELECT * FROM orders', budget=budget).estimated_cost == 8
+    assert governor.stats()['estimate_hits'] == 1
+
+    conn.executemany('INSERT INTO orders (status) VALUES (?)', [('Pending',)] * 100)
+    conn.commit()
+    assert governor.execute(conn, 'SELECT * FROM orders', budget=budget).estimated_cost == 8
+    version[0] += 1
+    with pytest.raises(QueryBudgetExceeded):
+        governor.execute(conn, 'SELECT * FROM orders', budget=budget)
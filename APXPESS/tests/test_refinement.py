@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+from select_statement import SelectStatement
+from sessions import narrow_sql, statement_subjects
+
+
+def refine(translator, question, follow_up):
+    _, params, statement = translator.generate_statement(question)
+    tables, columns = statement_subjects(statement)
+    refinement = translator.parse_refinement(follow_up, tables, columns)
+    if refinement is None:
+        return None
+    statement, params = narrow_sql(statement, params, refinement, qualify=len(tables) > 1)
+    return statement.sql(), params
+
+
+@pytest.mark.parametrize('question, follow_up, expected', [
+    ('how many orders per status', 'only those with count over 3',
+     ('SELECT status, COUNT(*) AS count FROM orders GROUP BY status HAVING COUNT(*) > ?', (3,))),
+    ('how many orders per status', 'sort by count descending',
+     ('SELECT status, COUNT(*) AS count FROM orders GROUP BY status ORDER BY COUNT(*) DESC', ())),
+    ('how many customers per country', 'top 2 by count',
+     ('SELECT country, COUNT(*) AS count FROM customers GROUP BY country ORDER BY COUNT(*) DESC LIMIT 2', ())),
+    ('total amount per status', 'only those with total amount over 1000',
+     ('SELECT status, SUM(total_amount) AS sum_total_amount FROM orders GROUP BY status '
+      'HAVING SUM(total_amount) > ?', (1000,))),
+])
+def test_aggregate_follow_ups_filter_and_sort_the_aggregate(translator, question, follow_up, expected):
+    assert refine(translator, question, follow_up) == expected
+
+
+def test_bare_comparison_on_a_grouped_count_is_not_a_refinement(translator):
+    # Neither the status nor the count is named
+    assert refine(translator, 'how many orders per status', 'only those over 3') is None
+
+
+def test_row_follow_ups_filter_rows(translator):
+    assert refine(translator, 'show orders', 'only those with total amount over 500') == (
+        'SELECT * FROM orders WHERE total_amount > ?', (500,))
+
+
+def test_refined_count_matches_the_rows(demo_db, translator):
+    sql_query, params = refine(translator, 'how many orders per status', 'only those with count over 2')
+    conn = sqlite3.connect(demo_db)
+    counts = conn.execute('SELECT status, COUNT(*) FROM orders GROUP BY status').fetchall()
+    expected = [row for row in counts if row[1] > 2]
+    assert expected and len(expected) < len(counts)
+    assert conn.execute(sql_query, params).fetchall() == expected
+    conn.close()
+
+
+def test_statement_parts_survive_the_translation_cache(translator):
+    question = 'how many orders per status'
+    first = translator.generate_statement(question)
+    second = translator.generate_statement(question)
+    assert first[2].as_dict() == second[2].as_dict()
+    assert second[2].sql() == second[0]
+
+
+def test_refinement_keeps_conditions_and_drops_notes(translator):
+    statement = SelectStatement(['name'], 'products', ['products'], ['name'], ['price > ?'],
+                                note='No join path to suppliers')
+    narrowed, params = narrow_sql(statement, (100,), {
+        'filters': [(None, 'stock', '<', 5)], 'order': (None, 'name', False), 'limit': 3})
+    assert narrowed.sql() == 'SELECT name FROM products WHERE price > ? AND stock < ? ORDER BY name LIMIT 3'
+    assert params == (100, 5)
+    assert statement.sql() == 'SELECT name FROM products WHERE price > ? -- No join path to suppliers'
+
+
+def test_follow_ups_of_a_session_narrow_the_statement(app_module):
+    client = app_module.app.test_client()
+    first = client.post('/query', json={'query': 'show orders', 'session': True}).get_json()
+    follow_up = client.post('/query', json={'query': 'only those with total amount over 500',
+                                            'session': first['session']}).get_json()
+    assert follow_up['sql_query'] == 'SELECT * FROM orders WHERE total_amount > ?'
+    assert follow_up['params'] == [500]
+    assert all(row['total_amount'] > 500 for row in follow_up['results'])
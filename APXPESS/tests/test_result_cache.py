@@ -0,0 +1,76 @@
+import sqlite3
+
+from result_cache import ResultCache
+
+SELECT_ORDERS = 'SELECT * FROM orders WHERE total_amount > ?'
+SELECT_JOINED = 'SELECT * FROM orders JOIN customers ON customers.id = orders.customer_id'
+
+
+def test_writes_invalidate_the_tables_they_touch():
+    cache = ResultCache()
+    cache.put(SELECT_ORDERS, b'[1]', (500,))
+    cache.put(SELECT_JOINED, b'[2]')
+    cache.put('SELECT * FROM products', b'[3]')
+
+    cache.note_statement("UPDATE customers SET country = 'UK' WHERE id = 1")
+    assert cache.get(SELECT_ORDERS, (500,)) == b'[1]'
+    assert cache.get(SELECT_JOINED) is None
+    assert cache.get('SELECT * FROM products') == b'[3]'
+
+    cache.note_statement('DELETE FROM orders WHERE id = 2')
+    assert cache.get(SELECT_ORDERS, (500,)) is None
+    assert cache.get('SELECT * FROM products') == b'[3]'
+
+
+def test_entries_are_keyed_on_params_and_encoding():
+    cache = ResultCache()
+    cache.put(SELECT_ORDERS, b'[1]', (500,))
+    assert cache.get(SELECT_ORDERS, (600,)) is None
+    assert cache.get(SELECT_ORDERS, (500,), encoding='columnar') is None
+
+
+def test_writes_are_not_cached():
+    cache = ResultCache()
+    cache.put('DELETE FROM orders', b'[]')
+    assert cache.get('DELETE FROM orders') is None
+
+
+def test_results_read_before_a_write_are_not_stored():
+    cache = ResultCache()
+    version = cache.version()
+    cache.note_statement('DELETE FROM orders WHERE id = 2')
+    cache.put(SELECT_ORDERS, b'[1]', (500,), version=version)
+    assert cache.get(SELECT_ORDERS, (500,)) is None
+    assert cache.stats()['stale_puts'] == 1
+
+    cache.put(SELECT_ORDERS, b'[1]', (500,), version=cache.version())
+    assert cache.get(SELECT_ORDERS, (500,)) == b'[1]'
+
+
+def test_outside_writes_clear_the_cache(demo_db):
+    cache = ResultCache(demo_db, data_version_interval=0)
+    cache.put(SELECT_ORDERS, b'[1]', (500,), version=cache.version())
+    cache.put('SELECT * FROM products', b'[3]', version=cache.version())
+    assert cache.get(SELECT_ORDERS, (500,)) == b'[1]'
+
+    version = cache.version()
+    conn = sqlite3.connect(demo_db)
+    with conn:
+        conn.execute('DELETE FROM products WHERE id = 1')
+    conn.close()
+    assert cache.get('SELECT * FROM products') is None
+    assert cache.get(SELECT_ORDERS, (500,)) is None
+    assert cache.version() != version
+    assert cache.stats()['external_writes'] == 1
+
+
+def test_eviction_keeps_the_byte_budget():
+    cache = ResultCache(max_bytes=100, max_entry_bytes=40)
+    cache.put('SELECT * FROM products', b'x' * 41)
+    assert cache.stats()['too_large'] == 1
+    for i in range(5):
+        cache.put(SELECT_ORDERS, b'x' * 30, (i,))
+    stats = cache.stats()
+    assert stats['bytes'] <= 100 and stats['entries'] == 3
+    assert cache.get(SELECT_ORDERS, (4,)) is not None
+    assert cache.get(SELECT_ORDERS, (0,)) is None
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import result_format
+from result_format import collect_columns, encode_columnar_json, negotiate_format
+
+ALL_FORMATS = ['json', 'columnar', 'msgpack', 'arrow']
+
+
+@pytest.fixture
+def all_installed(monkeypatch):
+    monkeypatch.setattr(result_format, 'available_formats', lambda: ALL_FORMATS)
+
+
+@pytest.mark.parametrize('accept, expected', [
+    (None, 'json'),
+    ('text/html', 'json'),
+    ('application/json', 'json'),
+    ('application/json; format=columnar', 'columnar'),
+    ('application/msgpack', 'msgpack'),
+    ('application/x-msgpack', 'msgpack'),
+    ('application/vnd.apache.arrow.stream, application/json;q=0.5', 'arrow'),
+    ('application/vnd.apache.arrow.stream;q=0.2, application/msgpack;q=0.8', 'msgpack'),
+    ('application/msgpack;q=oops, application/json; format=columnar', 'columnar'),
+])
+def test_accept_header_picks_the_preferred_format(all_installed, accept, expected):
+    assert negotiate_format(accept=accept) == expected
+
+
+def test_requested_format_wins_over_accept(all_installed):
+    assert negotiate_format('columnar', 'application/msgpack') == 'columnar'
+
+
+def test_unavailable_formats_are_skipped_or_rejected(monkeypatch):
+    monkeypatch.setattr(result_format, 'available_formats', lambda: ['json', 'columnar'])
+    assert negotiate_format(accept='application/msgpack, application/json;q=0.1') == 'json'
+    with pytest.raises(ValueError, match="Format 'arrow' is not available"):
+        negotiate_format('arrow')
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError, match="Unknown format 'xml'"):
+        negotiate_format('xml')
+
+
+def test_collect_columns_transposes_batches():
+    batches = [[(1, 'a'), (2, 'b')], [(3, 'c')]]
+    assert collect_columns(batches, 2) == ([[1, 2, 3], ['a', 'b', 'c']], False)
+
+
+def test_collect_columns_stops_at_the_limit():
+    batches = iter([[(1,), (2,)], [(3,), (4,)], [(5,)]])
+    assert collect_columns(batches, 1, limit=3) == ([[1, 2, 3]], True)
+    # The batch after the limit was not read
+    assert next(batches) == [(5,)]
+    assert collect_columns([[(1,), (2,)]], 1, limit=2) == ([[1, 2]], False)
+
+
+def test_collect_columns_of_no_rows():
+    assert collect_columns([[]], 3) == ([[], [], []], False)
+
+
+def test_columnar_json():
+    assert json.loads(encode_columnar_json(['id', 'name'], [[1, 2], ['a', None]])) == {
+        'columns': ['id', 'name'], 'values': [[1, 2], ['a', None]]}
+
+
+def test_msgpack_round_trip():
+    msgpack = pytest.importorskip('msgpack')
+    body = result_format.encode_msgpack({'sql_query': 'SELECT 1', 'params': []}, ['id'], [[1, 2]])
+    assert msgpack.unpackb(body, raw=False) == {
+        'sql_query': 'SELECT 1', 'params': [],
+        'results': {'columns': ['id'], 'values': [[1, 2]]}}
+
+
+def test_arrow_round_trip_sends_mixed_columns_as_text():
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    body = result_format.encode_arrow({'sql_query': 'SELECT 1'}, ['id', 'mixed'], [[1, 2], [3, 'x']])
+    table = pyarrow.ipc.open_stream(body).read_all()
+    assert table.to_pydict() == {'id': [1, 2], 'mixed': ['3', 'x']}
+    assert json.loads(table.schema.metadata[b'meta']) == {'sql_query': 'SELECT 1'}
+
+
+def test_columnar_results_hold_the_rows_of_the_json_results(app_module):
+    client = app_module.app.test_client()
+    rows = client.post('/query', json={'query': 'show products'}).get_json()
+    columnar = client.post('/query', json={'query': 'show products', 'format': 'columnar'}).get_json()
+    assert columnar['format'] == 'columnar'
+    results = columnar['results']
+    assert [dict(zip(results['columns'], row)) for row in zip(*results['values'])] == rows['results']
+
+
+def test_columnar_pages_by_accept_header(app_module):
+    client = app_module.app.test_client()
+    body = client.post('/query', json={'query': 'show orders', 'limit': 3},
+                       headers={'Accept': 'application/json; format=columnar'}).get_json()
+    assert body['format'] == 'columnar'
+    assert all(len(column) == 3 for column in body['results']['values'])
+    assert body['next'] is not None
+
+
+@pytest.mark.parametrize('request_fields, error', [
+    ({'format': 'xml'}, "Unknown format 'xml'"),
+    ({'format': 'msgpack', 'stream': True}, 'Streamed results are NDJSON'),
+])
+def test_bad_formats_are_reported(app_module, all_installed, request_fields, error):
+    client = app_module.app.test_client()
+    body = client.post('/query', json=dict(request_fields, query='show products')).get_json()
+    assert error in body['error']
+    assert 'results' not in body
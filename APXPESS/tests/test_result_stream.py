@@ -0,0 +1,105 @@
+import json
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionPool
+from result_stream import decode_cursor, encode_cursor, ndjson_stream, paginate_sql, parse_page
+
+
+@pytest.fixture
+def pool(demo_db):
+    pool = ConnectionPool(lambda: sqlite3.connect(demo_db, check_same_thread=False), max_size=2)
+    yield pool
+    pool.close()
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream]
+
+
+def test_cursors_round_trip():
+    assert decode_cursor(encode_cursor(40)) == 40
+    for cursor in ('not a cursor', encode_cursor(-1), 'eDo1'):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+def test_parse_page():
+    assert parse_page({}) == (None, 0)
+    assert parse_page({'limit': '5', 'after': encode_cursor(10)}) == (5, 10)
+    assert parse_page({'limit': 10 ** 9}, max_limit=100) == (100, 0)
+    for data in ({'limit': 0}, {'limit': 'many'}, {'after': 'x'}):
+        with pytest.raises(ValueError):
+            parse_page(data)
+
+
+@pytest.mark.parametrize('sql_query, params, limit, offset, expected', [
+    ('SELECT * FROM orders', (), 2, 4, ('SELECT * FROM orders LIMIT ? OFFSET ?', (3, 4))),
+    # Notes and a trailing semicolon are dropped
+    ('SELECT * FROM orders; -- No join path to x', (), 2, 0, ('SELECT * FROM orders LIMIT ? OFFSET ?', (3, 0))),
+    # "top 3": the look-ahead row never goes past the statement's own limit
+    ('SELECT * FROM orders LIMIT 3', (), 2, 2, ('SELECT * FROM orders LIMIT ? OFFSET ?', (1, 2))),
+    # The next page of a page
+    ('SELECT * FROM orders WHERE id > ? LIMIT ? OFFSET ?', (1, 3, 2), 2, 2,
+     ('SELECT * FROM orders WHERE id > ? LIMIT ? OFFSET ?', (1, 1, 4))),
+])
+def test_paginate_sql(sql_query, params, limit, offset, expected):
+    assert paginate_sql(sql_query, limit, offset, params) == expected
+
+
+def test_stream_pages_cover_the_result_once(demo_db, pool):
+    conn = sqlite3.connect(demo_db)
+    expected = [list(row) for row in conn.execute('SELECT * FROM orders')]
+    conn.close()
+    rows, offset, cursor = [], 0, True
+    while cursor:
+        sql_query, params = paginate_sql('SELECT * FROM orders', 3, offset)
+        stream = lines(ndjson_stream(pool, sql_query, {'page': offset}, batch_size=2, limit=3,
+                                     offset=offset, params=params))
+        assert stream[0] == {'meta': {'page': offset}}
+        assert 'columns' in stream[1]
+        page = [row for line in stream[2:-1] for row in line['rows']]
+        assert len(page) <= 3 and stream[-1]['end']['row_count'] == len(page)
+        rows.extend(page)
+        cursor = stream[-1]['end']['next']
+        offset = decode_cursor(cursor) if cursor else None
+    assert rows == expected
+
+
+def test_columnar_batches(pool):
+    stream = lines(ndjson_stream(pool, 'SELECT id, name FROM customers ORDER BY id', {}, batch_size=10,
+                                 columnar=True))
+    ids, names = stream[2]['values']
+    assert stream[1] == {'columns': ['id', 'name']}
+    assert ids == list(range(1, len(ids) + 1)) and len(names) == len(ids)
+
+
+def test_errors_end_the_stream(pool):
+    stream = lines(ndjson_stream(pool, 'SELECT * FROM missing', {}))
+    assert 'error' in stream[-1]
+    assert pool.stats()['in_use'] == 0
+
+
+def test_closing_the_stream_releases_the_connection(pool):
+    stream = ndjson_stream(pool, 'SELECT * FROM orders', {}, batch_size=1)
+    next(stream), next(stream), next(stream)
+    assert pool.stats()['in_use'] == 1
+    # The client went away
+    stream.close()
+    assert pool.stats()['in_use'] == 0
+
+
+def test_query_pages_and_streams_through_the_app(app_module):
+    client = app_module.app.test_client()
+    first = client.post('/query', json={'query': 'show all orders', 'limit': 5}).get_json()
+    assert len(first['results']) == 5 and first['next']
+    second = client.post('/query', json={'query': 'show all orders', 'limit': 5, 'after': first['next']}).get_json()
+    assert second['next'] is None
+    ids = [row['id'] for row in first['results'] + second['results']]
+    assert len(ids) == len(set(ids)) == 8
+    response = client.post('/query', json={'query': 'show all orders', 'stream': True})
+    assert response.mimetype == 'application/x-ndjson'
+    streamed = lines(response.get_data(as_text=True).splitlines())
+    assert streamed[-1]['end']['row_count'] == 8
+    assert client.post('/query', json={'query': 'show all orders', 'limit': -1}).get_json()['error']
@@ -0,0 +1,111 @@
+import sqlite3
+
+import pytest
+
+from rollups import RollupManager
+from schema_catalog import SchemaCatalog
+
+QUESTIONS = [
+    'how many orders',
+    'how many orders per status',
+    'total amount per status',
+    'average price by category',
+    'max price per category',
+]
+
+
+def normalized(rows):
+    """Rows up to order and floating point rounding of sums"""
+    return sorted(tuple(round(value, 6) if isinstance(value, float) else value for value in row)
+                  for row in rows)
+
+
+@pytest.fixture
+def rollups(demo_db, translator):
+    manager = RollupManager(demo_db, min_uses=1, min_rows=0, max_ratio=1.0, check_interval=0)
+    statements = [translator.generate_sql(question) for question in QUESTIONS]
+    for sql_query, _ in statements:
+        manager.record(sql_query, 1.0)
+    manager.wait()
+    return manager, statements
+
+
+def assert_rewrites_match(conn, manager, statements):
+    for sql_query, params in statements:
+        rollup_sql = manager.rewrite(sql_query)
+        assert rollup_sql is not None, sql_query
+        assert 'rollup_' in rollup_sql
+        assert normalized(conn.execute(rollup_sql, params)) == normalized(conn.execute(sql_query, params))
+
+
+def test_rewrites_answer_like_the_fact_table(demo_db, rollups):
+    conn = sqlite3.connect(demo_db)
+    assert_rewrites_match(conn, *rollups)
+    conn.close()
+
+
+def test_rewrites_follow_writes(demo_db, rollups):
+    conn = sqlite3.connect(demo_db)
+    with conn:
+        conn.execute("INSERT INTO orders (customer_id, order_date, total_amount, status) "
+                     "VALUES (1, '2024-01-01', 10000, 'Refunded')")
+        conn.execute("UPDATE orders SET status = 'Pending' WHERE id = 1")
+        conn.execute('DELETE FROM orders WHERE id = (SELECT MAX(id) FROM orders WHERE status = ?)',
+                     ('Completed',))
+        # Removes the current maximum of its category
+        conn.execute('DELETE FROM products WHERE price = (SELECT MAX(price) FROM products)')
+    assert_rewrites_match(conn, *rollups)
+    conn.close()
+
+
+def test_rollups_are_hidden_from_the_schema(demo_db, rollups):
+    conn = sqlite3.connect(demo_db)
+    with conn:
+        conn.execute('CREATE TABLE rollup_notes (id INTEGER PRIMARY KEY, note TEXT)')
+    conn.close()
+    catalog = SchemaCatalog(demo_db)
+    catalog.refresh()
+    assert sorted(catalog.tables) == ['customers', 'orders', 'products', 'rollup_notes']
+
+
+def test_or_replace_writes_retire_the_rollup(demo_db, rollups):
+    manager, statements = rollups
+    conn = sqlite3.connect(demo_db)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO orders (id, customer_id, order_date, total_amount, status) "
+                     "VALUES (1, 1, '2024-01-01', 10000, 'Refunded')")
+    for sql_query, params in statements:
+        rollup_sql = manager.rewrite(sql_query)
+        if 'FROM orders' in sql_query:
+            assert rollup_sql is None, sql_query
+        else:
+            assert rollup_sql is not None, sql_query
+            assert normalized(conn.execute(rollup_sql, params)) == normalized(conn.execute(sql_query, params))
+    manager.wait()
+    assert manager.stats()['stale'] == 3
+    assert {candidate['status'] for candidate in manager.report()['candidates']
+            if candidate['table'] == 'orders'} == {'rejected'}
+    # Dropped, and not built again
+    for sql_query, _ in statements:
+        manager.record(sql_query, 1.0)
+    manager.wait()
+    assert conn.execute("SELECT COUNT(*) FROM rollup_catalog WHERE definition LIKE '%\"orders\"%'").fetchone() == (0,)
+    conn.close()
+
+
+def test_aborted_conflicting_writes_keep_the_rollup(demo_db, rollups):
+    manager, statements = rollups
+    conn = sqlite3.connect(demo_db)
+    with pytest.raises(sqlite3.IntegrityError):
+        with conn:
+            conn.execute("INSERT INTO orders (id, customer_id, order_date, total_amount, status) "
+                         "VALUES (1, 1, '2024-01-01', 10000, 'Refunded')")
+    with pytest.raises(sqlite3.IntegrityError):
+        with conn:
+            conn.execute('UPDATE orders SET id = 2 WHERE id = 1')
+    assert manager.stats()['stale'] == 0
+    assert_rewrites_match(conn, manager, statements)
+    with conn:
+        conn.execute('UPDATE OR REPLACE orders SET id = 2 WHERE id = 1')
+    assert manager.rewrite(statements[1][0]) is None
+    conn.close()
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from conftest import APP_DIR
+from schema_catalog import SchemaCatalog
+
+
+def test_snapshot_round_trip(demo_db):
+    catalog = SchemaCatalog(demo_db, snapshot_path=demo_db + '.schema.json')
+    assert catalog.refresh()
+    loaded = SchemaCatalog(demo_db, snapshot_path=demo_db + '.schema.json')
+    assert loaded.load()
+    assert loaded.tables == catalog.tables and loaded.schema_version == catalog.schema_version
+    assert set(loaded.as_db_schema()) == {'customers', 'orders', 'products'}
+
+
+def test_refresh_reintrospects_only_changed_tables(demo_db):
+    catalog = SchemaCatalog(demo_db)
+    catalog.refresh()
+    customers = catalog.tables['customers']
+    assert not catalog.refresh()
+
+    conn = sqlite3.connect(demo_db)
+    conn.execute('ALTER TABLE orders ADD COLUMN note TEXT')
+    conn.execute('CREATE TABLE reviews (id INTEGER PRIMARY KEY, product_id INTEGER REFERENCES products(id))')
+    conn.close()
+    assert catalog.refresh()
+    assert catalog.tables['customers'] is customers
+    assert 'note' in catalog.as_db_schema()['orders']
+    assert ('products', 'product_id', 'id') in catalog.fk_graph()['reviews']
+
+
+def test_importing_the_app_writes_no_snapshots(demo_db):
+    script = '\n'.join([
+        'import os, time, app',
+        'time.sleep(0.5)',
+        'print(os.path.exists(app.schema_catalog.snapshot_path))',
+        'app.start_background_refresh()',
+        'deadline = time.monotonic() + 10',
+        'while not os.path.exists(app.schema_catalog.snapshot_path) and time.monotonic() < deadline:',
+        '    time.sleep(0.05)',
+        'print(os.path.exists(app.schema_catalog.snapshot_path))',
+    ])
+    env = dict(os.environ, DB_PATH=demo_db, BACKGROUND_REFRESH='1')
+    output = subprocess.run([sys.executable, '-c', script], cwd=APP_DIR, env=env, capture_output=True,
+                            text=True, timeout=60).stdout
+    assert output.split() == ['False', 'True']
@@ -0,0 +1,80 @@
+import sqlite3
+
+from conftest import make_translator
+from natural_language_to_sql import NaturalLanguageToSQL
+
+
+def test_numbers_are_bound_not_inlined(translator):
+    sql_query, params = translator.generate_sql('products with price over 100')
+    assert sql_query == 'SELECT price FROM products WHERE price > ?'
+    assert params == (100,)
+
+
+def test_question_shape_is_translated_once(translator):
+    first = translator.generate_sql('products with price over 100')
+    second = translator.generate_sql('products with price over 250')
+    assert second == (first[0], (250,))
+    assert translator.translation_cache.stats()['memory_hits'] == 1
+
+
+def test_column_values_are_bound(translator):
+    assert translator.generate_sql('Show all customers from Canada') == (
+        'SELECT * FROM customers WHERE country = ?', ('Canada',))
+
+
+def test_quoted_values_execute_as_parameters(demo_db):
+    conn = sqlite3.connect(demo_db)
+    with conn:
+        conn.execute("INSERT INTO customers (name, email, country, signup_date) "
+                     "VALUES ('Ama Owusu', 'ama@example.com', 'Cote d''Ivoire', '2023-03-01')")
+    translator = make_translator(demo_db)
+
+    sql_query, params = translator.generate_sql("customers from Cote d'Ivoire")
+    assert "'" not in sql_query
+    assert params == ("Cote d'Ivoire",)
+    assert [row[1] for row in conn.execute(sql_query, params)] == ['Ama Owusu']
+    conn.close()
+
+
+def test_bind_parameters():
+    nl_to_sql = NaturalLanguageToSQL({}, translation_cache=False)
+    # Integer slots index the literals; strings are bound as they are
+    assert nl_to_sql.bind_parameters([1, 'Canada', 0], ['2.5', '7']) == (7, 'Canada', 2.5)
+    assert nl_to_sql.bind_parameters(['UK'], None) == ('UK',)
+
+
+def test_each_number_compares_with_its_own_column(translator):
+    assert translator.generate_sql('products with price over 150 and stock under 3') == (
+        'SELECT price, stock FROM products WHERE price > ? AND stock < ?', (150, 3))
+    assert translator.generate_sql('products with stock under 3 and price over 150') == (
+        'SELECT price, stock FROM products WHERE stock < ? AND price > ?', (3, 150))
+
+
+def test_numbers_do_not_compare_with_value_columns(translator):
+    assert translator.generate_sql('List all products in the Electronics category with stock less than 10') == (
+        'SELECT category, stock FROM products WHERE stock < ? AND category = ?', (10, 'Electronics'))
+
+
+def test_shape_translation_holds_for_longer_numbers(translator):
+    translator.generate_sql('products with price over 1 and stock under 2')
+    assert translator.generate_sql('products with price over 150000000 and stock under 30000') == (
+        'SELECT price, stock FROM products WHERE price > ? AND stock < ?', (150000000, 30000))
+
+
+def test_entities_are_matched_outside_the_schema_lock(translator):
+    # A refresh in progress holds the update lock; matching must not wait
+    with translator._update_lock:
+        entities = translator.identify_entities('show customers with total amount greater than 100')
+    assert 'customers' in entities['tables']
+
+
+def test_schema_swap_keeps_previous_matcher_intact(translator):
+    matcher = translator._entity_matcher
+    schema = dict(translator.db_schema)
+    schema['suppliers'] = ['id', 'name']
+    translator.db_schema = schema
+    assert translator._entity_matcher is not matcher
+    # Readers still holding the old matcher see the old schema
+    assert ('table', 'suppliers', 'suppliers') not in {
+        payload for _, _, pattern in matcher.find_all('suppliers') for payload in matcher.payloads(pattern)}
+    assert 'suppliers' in translator.identify_entities('list suppliers')['tables']
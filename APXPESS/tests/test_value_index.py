@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import APP_DIR
+from schema_catalog import SchemaCatalog
+from value_index import ValueIndex
+
+
+@pytest.fixture
+def tickets_db(tmp_path):
+    path = str(tmp_path / 'tickets.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE agents (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.execute('CREATE TABLE tickets (id INTEGER PRIMARY KEY, agent_id INTEGER REFERENCES agents(id), '
+                 'status TEXT, priority VARCHAR(10), reference TEXT, description TEXT, hours REAL)')
+    conn.executemany('INSERT INTO agents (name) VALUES (?)', [('Ann',), ('Bo',)])
+    conn.executemany('INSERT INTO tickets (agent_id, status, priority, reference, description, hours) '
+                     'VALUES (?, ?, ?, ?, ?, ?)',
+                     ((1 + i % 2, ('Open', 'Closed', 'Waiting')[i % 3], ('low', 'high')[i % 2], f'T-{i}',
+                       f'The printer on floor {i % 9} stopped working again after the last firmware update'
+                       if i % 7 else 'Duplicate',
+                       i / 2) for i in range(1000)))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def build(path, **options):
+    catalog = SchemaCatalog(path)
+    catalog.refresh()
+    index = ValueIndex(catalog, snapshot_path=path + '.values.json', **options)
+    index.refresh()
+    return index
+
+
+def test_indexes_low_cardinality_text_only(tickets_db):
+    index = build(tickets_db)
+    assert index.values == {
+        ('agents', 'name'): ['Ann', 'Bo'],
+        ('tickets', 'status'): ['Closed', 'Open', 'Waiting'],
+        ('tickets', 'priority'): ['high', 'low'],
+    }
+
+
+def test_free_text_is_skipped_even_with_few_values(tickets_db):
+    index = build(tickets_db, max_distinct=5000)
+    assert ('tickets', 'reference') in index.values
+    assert ('tickets', 'description') not in index.values
+
+
+def test_large_tables_are_sampled(tickets_db):
+    conn = sqlite3.connect(tickets_db)
+    conn.execute("UPDATE tickets SET status = 'Escalated' WHERE id = 500")
+    conn.commit()
+    conn.close()
+    statements = []
+    catalog = SchemaCatalog(tickets_db)
+    catalog.refresh()
+    index = ValueIndex(catalog, sample_rows=100, sample_blocks=4)
+    original = sqlite3.connect
+
+    def traced(*args, **kwargs):
+        conn = original(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+    sqlite3.connect = traced
+    try:
+        index.refresh()
+    finally:
+        sqlite3.connect = original
+    assert index.stats()['sampled_tables'] == 1
+    # Row 500 lies between the sampled ranges; reading the whole table finds it
+    assert index.values[('tickets', 'status')] == ['Closed', 'Open', 'Waiting']
+    assert not any('GROUP BY' in sql for sql in statements)
+    assert 'Escalated' in build(tickets_db).values[('tickets', 'status')]
+
+
+def test_snapshot_skips_the_rescan(tickets_db):
+    index = build(tickets_db)
+    catalog = SchemaCatalog(tickets_db)
+    catalog.refresh()
+    restarted = ValueIndex(catalog, snapshot_path=tickets_db + '.values.json')
+    assert restarted.load() and restarted.values == index.values
+    assert not restarted.refresh()
+    assert restarted.stats()['rebuilt_tables'] == 0
+
+
+def test_importing_the_app_writes_no_value_snapshot(demo_db):
+    script = 'import os, time, app; time.sleep(0.5); print(os.path.exists(app.value_index.snapshot_path))'
+    env = dict(os.environ, DB_PATH=demo_db, BACKGROUND_REFRESH='1')
+    output = subprocess.run([sys.executable, '-c', script], cwd=APP_DIR, env=env, capture_output=True,
+                            text=True, timeout=60).stdout
+    assert output.split() == ['False']
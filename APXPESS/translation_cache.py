@@ -0,0 +1,172 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TranslationCache:
+    """
+    Two-level cache of natural language -> SQL translations
+
+    The first level is an in-process LRU with size and TTL eviction. The
+    optional second level is a sqlite file shared by every worker process
+    on the host, so a question translated by one gunicorn worker is a hit
+    for all of them. Keys combine the schema version with the normalized
+    question, so entries for an old schema can never be returned.
+    """
+
+    def __init__(self, max_size=2048, ttl=3600.0, shared_path=None):
+        """
+        Args:
+            max_size (int): Maximum number of entries kept in memory
+            ttl (float): Seconds an entry stays valid, in either level
+            shared_path (str): Optional path of the shared sqlite cache file
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_path = shared_path
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._shared = None
+        # Handles inherited over fork(), kept open but never used
+        self._inherited = []
+        self._stats = {
+            'memory_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+        if shared_path:
+            self._shared = self._open_shared(shared_path)
+
+    def _open_shared(self, path):
+        conn = sqlite3.connect(path, timeout=1.0, check_same_thread=False, isolation_level=None)
+        try:
+            # WAL lets readers in other workers proceed while one writes, and
+            # mmap serves lookups straight from the shared page cache
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA mmap_size=67108864')
+            conn.execute('''CREATE TABLE IF NOT EXISTS translations
+                            (schema_version TEXT, query TEXT, value TEXT, created REAL,
+                             PRIMARY KEY (schema_version, query))''')
+        except sqlite3.Error as e:
+            print(f"Note: shared translation cache unavailable ({e}), using memory only")
+            conn.close()
+            return None
+        return conn
+
+    def after_fork(self):
+        """Open a fresh shared-cache connection in a forked child process"""
+        self._lock = threading.Lock()
+        if self._shared is not None:
+            # sqlite connections must not be used across fork(), and closing
+            # the parent's one here could disturb its locks
+            self._inherited.append(self._shared)
+            self._shared = self._open_shared(self.shared_path)
+
+    def get(self, schema_version, query):
+        """
+        Look up a translation
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        key = (schema_version, query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._entries[key]
+                self._stats['expirations'] += 1
+
+            if self._shared is not None:
+                row = self._shared_get(schema_version, query, now)
+                if row is not None:
+                    value, created = row
+                    self._store(key, value, created)
+                    self._stats['shared_hits'] += 1
+                    return value
+
+            self._stats['misses'] += 1
+            return None
+
+    def _shared_get(self, schema_version, query, now):
+        try:
+            row = self._shared.execute(
+                'SELECT value, created FROM translations WHERE schema_version = ? AND query = ? AND created >= ?',
+                (schema_version, query, now - self.ttl)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, schema_version, query, value):
+        """Store a translation in both levels"""
+        now = time.time()
+        with self._lock:
+            self._store((schema_version, query), value, now)
+            if self._shared is not None:
+                try:
+                    self._shared.execute(
+                        'INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)',
+                        (schema_version, query, json.dumps(value), now))
+                except sqlite3.Error:
+                    # A busy shared cache only costs us a future miss
+                    pass
+
+    def _store(self, key, value, created):
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def invalidate(self, schema_version=None):
+        """
+        Drop entries from the memory level
+
+        Args:
+            schema_version (str): Keep only entries for this schema version;
+                drop everything when None
+        """
+        with self._lock:
+            if schema_version is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [key for key in self._entries if key[0] != schema_version]
+                for key in stale:
+                    del self._entries[key]
+                dropped = len(stale)
+            self._stats['invalidations'] += dropped
+
+            if self._shared is not None:
+                try:
+                    self._shared.execute('DELETE FROM translations WHERE created < ?',
+                                         (time.time() - self.ttl,))
+                except sqlite3.Error:
+                    pass
+
+    def stats(self):
+        """Return hit/miss counters and hit ratios"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self.max_size
+        lookups = stats['memory_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        stats['memory_hit_ratio'] = stats['memory_hits'] / lookups if lookups else 0.0
+        stats['shared'] = self._shared is not None
+        return stats
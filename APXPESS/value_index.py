@@ -0,0 +1,316 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SNAPSHOT_VERSION = 3
+
+# Declared types whose values can be looked up by name
+TEXT_TYPES = ('CHAR', 'TEXT', 'CLOB')
+
+
+class ValueIndex:
+    """
+    Distinct values of the low-cardinality text columns of a database
+
+    Lets the translator resolve "customers from Canada" to
+    ``Country = 'Canada'``: columns such as country, status, category,
+    Genre.Name or MediaType.Name with at most ``max_distinct`` values are
+    collected, smallest columns first, until ``max_bytes`` is used. Key
+    columns are skipped, and so are free-text columns: any value longer
+    than ``max_value_length`` rules a column out.
+
+    A table is read in one pass over all its candidate columns that stops
+    as soon as every column was ruled out. Tables of more than
+    ``sample_rows`` rows are sampled in ``sample_blocks`` evenly spaced
+    rowid ranges instead of being read whole, so a value that only occurs
+    outside the sampled rows may be missing from the index.
+
+    A refresh first compares the modification times and sizes of the
+    database and its WAL file with those of the previous refresh, and
+    reads nothing when they did not move. Otherwise tables are
+    fingerprinted by their DDL and largest rowid (an index lookup, never a
+    scan): tables whose fingerprint changed are re-read, and so are the
+    other tables of at most ``max_rescan_rows`` rows, whose values may have
+    been updated in place. Larger tables are only re-read when rows were
+    added. The result is persisted as a JSON snapshot with that signature,
+    so a restart over an unchanged database scans nothing.
+    """
+
+    def __init__(self, catalog, snapshot_path=None, max_distinct=100, max_bytes=4 * 1024 * 1024,
+                 max_value_length=64, max_table_rows=5000000, max_rescan_rows=100000,
+                 sample_rows=100000, sample_blocks=10):
+        """
+        Args:
+            catalog (SchemaCatalog): Catalog of the database to index
+            snapshot_path (str): Where to persist the index; nothing is
+                written when None
+            max_distinct (int): Columns with more distinct values are skipped
+            max_bytes (int): Memory budget for the indexed values
+            max_value_length (int): Columns with longer values are free
+                text and not indexed
+            max_table_rows (int): Larger tables are never read
+            max_rescan_rows (int): Tables up to this size are re-read on any
+                change to the database, to pick up updated values
+            sample_rows (int): Larger tables are sampled, reading at most
+                this many rows
+            sample_blocks (int): Number of rowid ranges a sample is spread over
+        """
+        self.catalog = catalog
+        self.database = catalog.database
+        self.snapshot_path = snapshot_path
+        self.max_distinct = max_distinct
+        self.max_bytes = max_bytes
+        self.max_value_length = max_value_length
+        self.max_table_rows = max_table_rows
+        self.max_rescan_rows = max_rescan_rows
+        self.sample_rows = sample_rows
+        self.sample_blocks = sample_blocks
+
+        # table -> {'fingerprint': [ddl hash, rows], 'columns': {column: [values]}}
+        self._tables = {}
+        # Modification times and sizes of the database and its WAL at the
+        # last refresh
+        self._signature = None
+        # (table, column) -> [values] within the memory budget
+        self.values = {}
+        self.version = None
+        self.refreshed_at = None
+        self._refresh_lock = threading.Lock()
+        self._stats = {'refreshes': 0, 'rebuilt_tables': 0, 'last_refresh_seconds': 0.0,
+                       'sampled_tables': 0, 'bytes': 0, 'truncated_columns': 0}
+
+    def load(self):
+        """
+        Load the persisted snapshot
+
+        Returns:
+            bool: True if a usable snapshot was loaded
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return False
+        if snapshot.get('database') != os.path.abspath(self.database):
+            return False
+        self.refreshed_at = snapshot.get('refreshed_at')
+        self._signature = snapshot.get('signature')
+        self._tables = snapshot.get('tables', {})
+        self._assemble()
+        return True
+
+    def save(self):
+        """Write the snapshot atomically"""
+        if not self.snapshot_path:
+            return
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'database': os.path.abspath(self.database),
+            'refreshed_at': self.refreshed_at,
+            'signature': self._signature,
+            'tables': self._tables,
+        }
+        tmp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, self.snapshot_path)
+
+    def refresh(self):
+        """
+        Re-read the values of tables that changed since the last refresh
+
+        Returns:
+            bool: True if the indexed values changed
+        """
+        if not os.path.exists(self.database) or not self.catalog.tables:
+            return False
+
+        with self._refresh_lock:
+            start = time.perf_counter()
+            catalog_tables = self.catalog.tables
+            # Taken before reading, so writes made meanwhile show next time
+            signature = self._data_signature()
+            if (signature == self._signature and set(catalog_tables) == set(self._tables)
+                    and all(self._tables[table]['fingerprint'][0] == info['ddl_hash']
+                            for table, info in catalog_tables.items())):
+                self._stats['refreshes'] += 1
+                self._stats['last_refresh_seconds'] = time.perf_counter() - start
+                self.refreshed_at = time.time()
+                return False
+            conn = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True)
+            try:
+                tables = {}
+                rebuilt = 0
+                for table, info in catalog_tables.items():
+                    fingerprint = self._fingerprint(conn, table, info)
+                    previous = self._tables.get(table)
+                    if (previous is not None and previous['fingerprint'] == fingerprint
+                            and (fingerprint[1] is None or fingerprint[1] > self.max_rescan_rows)):
+                        tables[table] = previous
+                    else:
+                        columns = self._read_values(conn, table, info, fingerprint)
+                        if previous is None or previous['columns'] != columns:
+                            rebuilt += 1
+                        tables[table] = {'fingerprint': fingerprint, 'columns': columns}
+            finally:
+                conn.close()
+
+            changed = rebuilt > 0 or set(tables) != set(self._tables)
+            self._signature = signature
+            self._stats['refreshes'] += 1
+            self._stats['rebuilt_tables'] += rebuilt
+            self._stats['last_refresh_seconds'] = time.perf_counter() - start
+            self.refreshed_at = time.time()
+            self._tables = tables
+            if changed:
+                self._assemble()
+            self.save()
+            return changed
+
+    def _data_signature(self):
+        """Modification times and sizes of the database and its WAL file"""
+        signature = []
+        for path in (self.database, self.database + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append([stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def _fingerprint(self, conn, table, info):
+        """
+        [DDL hash, rows] of a table; rows is the largest rowid, an upper
+        bound found by one index lookup, or for WITHOUT ROWID tables the
+        sqlite_stat1 estimate (None without ANALYZE)
+        """
+        quoted = table.replace('"', '""')
+        try:
+            rows = conn.execute(f'SELECT MAX(rowid) FROM "{quoted}"').fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID table
+            try:
+                stat = conn.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1', (table,)).fetchone()
+            except sqlite3.OperationalError:
+                stat = None
+            rows = int(stat[0].split()[0]) if stat and stat[0] else None
+        return [info['ddl_hash'], rows]
+
+    def _read_values(self, conn, table, info, fingerprint):
+        """Return {column: sorted distinct values} for the indexable columns of a table"""
+        rows = fingerprint[1]
+        if rows is None or rows > self.max_table_rows:
+            return {}
+        foreign_keys = {fk['column'] for fk in info['foreign_keys']}
+        names = [column['name'] for column in info['columns']
+                 if not column['pk'] and column['name'] not in foreign_keys
+                 and (not column['type'] or any(text in column['type'] for text in TEXT_TYPES))]
+        if not names:
+            return {}
+
+        # position -> distinct values of the columns not ruled out yet
+        live = {position: set() for position in range(len(names))}
+        for cursor in self._sample(conn, table, names, rows):
+            for row in cursor:
+                for position, distinct in list(live.items()):
+                    value = row[position]
+                    if value is None or value in distinct:
+                        continue
+                    if ((isinstance(value, str) and len(value) > self.max_value_length)
+                            or len(distinct) >= self.max_distinct):
+                        del live[position]
+                    else:
+                        distinct.add(value)
+                if not live:
+                    return {}
+
+        columns = {}
+        for position, distinct in live.items():
+            values = sorted(value for value in distinct if isinstance(value, str) and value)
+            if values:
+                columns[names[position]] = values
+        return columns
+
+    def _sample(self, conn, table, names, rows):
+        """Cursors over the rows to read: a whole small table, else evenly spaced rowid ranges"""
+        quoted_table = table.replace('"', '""')
+        select = ', '.join('"' + name.replace('"', '""') + '"' for name in names)
+        if rows <= self.sample_rows:
+            yield conn.execute(f'SELECT {select} FROM "{quoted_table}"')
+            return
+        self._stats['sampled_tables'] += 1
+        block = max(1, self.sample_rows // self.sample_blocks)
+        for i in range(self.sample_blocks):
+            try:
+                cursor = conn.execute(f'SELECT {select} FROM "{quoted_table}" WHERE rowid > ? '
+                                      f'ORDER BY rowid LIMIT ?', (rows * i // self.sample_blocks, block))
+            except sqlite3.OperationalError:
+                # WITHOUT ROWID table: its first rows only
+                yield conn.execute(f'SELECT {select} FROM "{quoted_table}" LIMIT ?', (self.sample_rows,))
+                return
+            yield cursor
+
+    def _assemble(self):
+        """Apply the memory budget, smallest columns first, and compute the version"""
+        candidates = sorted(
+            ((len(values), table, column, values)
+             for table, data in self._tables.items()
+             for column, values in data['columns'].items()),
+            key=lambda item: (item[0], item[1], item[2]))
+        values = {}
+        used = 0
+        truncated = 0
+        for _, table, column, column_values in candidates:
+            size = sum(len(value.encode('utf-8')) + 48 for value in column_values)
+            if used + size > self.max_bytes:
+                truncated += 1
+                continue
+            used += size
+            values[(table, column)] = column_values
+
+        self.values = values
+        self._stats['bytes'] = used
+        self._stats['truncated_columns'] = truncated
+        self.version = hashlib.sha1(json.dumps(
+            sorted((table, column, column_values) for (table, column), column_values in values.items())
+        ).encode('utf-8')).hexdigest()[:16]
+
+    def refresh_in_background(self, on_change=None, interval=None):
+        """
+        Refresh on a daemon thread once the catalog is ready
+
+        Args:
+            on_change (callable): Called with the index when it changed
+            interval (float): Keep polling every interval seconds; refresh
+                once when None
+        """
+        def run():
+            self.catalog.ready.wait()
+            while True:
+                try:
+                    if self.refresh() and on_change is not None:
+                        on_change(self)
+                except Exception as e:
+                    print(f"Note: value index refresh failed: {e}")
+                if interval is None:
+                    return
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='value-index-refresh', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """Return index size and refresh counters"""
+        stats = dict(self._stats)
+        stats['tables'] = len(self._tables)
+        stats['columns'] = len(self.values)
+        stats['values'] = sum(len(values) for values in self.values.values())
+        return stats